@@ -0,0 +1,308 @@
+"""
+Admission control for write endpoints.
+
+Token buckets (per restaurant, per table, per login account and IP) and
+a per-restaurant in-flight cap on writes, so one tenant's spike or a
+client retry loop gets fast 429s instead of saturating every worker and
+the database for everyone else.
+
+RATE_LIMIT_BACKEND=sqlite (default) keeps state in a small local file
+shared by all gunicorn workers on the host; =memory is a per-process
+stand-in for tests and single-process dev.
+"""
+import os
+import math
+import time
+import uuid
+import sqlite3
+import logging
+import tempfile
+import functools
+import threading
+
+from flask import jsonify, request, session
+
+ADMISSION_CONTROL = os.getenv("ADMISSION_CONTROL", "on") == "on"
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "sqlite")
+RATE_LIMIT_DB = os.getenv(
+    "RATE_LIMIT_DB", os.path.join(tempfile.gettempdir(), "qr_restaurant_limits.db")
+)
+
+# tokens per second, bucket size
+ORDER_RATE_PER_RESTAURANT = float(os.getenv("ORDER_RATE_PER_RESTAURANT", "10"))
+ORDER_BURST_PER_RESTAURANT = float(os.getenv("ORDER_BURST_PER_RESTAURANT", "30"))
+ORDER_RATE_PER_TABLE = float(os.getenv("ORDER_RATE_PER_TABLE", "0.5"))
+ORDER_BURST_PER_TABLE = float(os.getenv("ORDER_BURST_PER_TABLE", "5"))
+
+# login attempts per (client IP, username): password guessing on one
+# account; and per client IP, looser, since a restaurant's tablets often
+# share one NAT address and all log in at shift change
+LOGIN_RATE_PER_ACCOUNT = float(os.getenv("LOGIN_RATE_PER_ACCOUNT", "0.2"))
+LOGIN_BURST_PER_ACCOUNT = float(os.getenv("LOGIN_BURST_PER_ACCOUNT", "10"))
+LOGIN_RATE_PER_IP = float(os.getenv("LOGIN_RATE_PER_IP", "2"))
+LOGIN_BURST_PER_IP = float(os.getenv("LOGIN_BURST_PER_IP", "60"))
+
+# concurrent write requests per restaurant across all workers on the host
+WRITE_CONCURRENCY_PER_RESTAURANT = int(os.getenv("WRITE_CONCURRENCY_PER_RESTAURANT", "4"))
+WRITE_SLOT_LEASE = float(os.getenv("WRITE_SLOT_LEASE", "30"))
+
+# buckets untouched this long are full again and can be dropped
+BUCKET_IDLE_SECONDS = float(os.getenv("BUCKET_IDLE_SECONDS", "3600"))
+BUCKET_PRUNE_EVERY = float(os.getenv("BUCKET_PRUNE_EVERY", "60"))
+
+log = logging.getLogger(__name__)
+
+
+# --------------------------------------------------
+# BACKENDS
+# --------------------------------------------------
+
+def _refill(tokens, updated, rate, burst, now):
+    if tokens is None:
+        return burst
+    return min(burst, tokens + (now - updated) * rate)
+
+
+class MemoryBackend:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.buckets = {}
+        self.slots = {}
+        self.pruned = 0.0
+
+    def take(self, limits, now):
+        with self.lock:
+            if now - self.pruned > BUCKET_PRUNE_EVERY:
+                idle = now - BUCKET_IDLE_SECONDS
+                self.buckets = {k: b for k, b in self.buckets.items() if b[1] >= idle}
+                self.pruned = now
+
+            levels = []
+            for key, rate, burst in limits:
+                tokens, updated = self.buckets.get(key, (None, now))
+                levels.append(_refill(tokens, updated, rate, burst, now))
+
+            wait = max(
+                ((1 - level) / rate if level < 1 else 0.0)
+                for level, (_, rate, _) in zip(levels, limits)
+            )
+            spend = 1 if wait == 0 else 0
+
+            for level, (key, _, _) in zip(levels, limits):
+                self.buckets[key] = (level - spend, now)
+
+            return wait
+
+    def acquire(self, scope, limit, now):
+        with self.lock:
+            live = {t: s for t, s in self.slots.items() if s[1] > now}
+            self.slots = live
+            if sum(1 for s in live.values() if s[0] == scope) >= limit:
+                return None
+
+            token = uuid.uuid4().hex
+            self.slots[token] = (scope, now + WRITE_SLOT_LEASE)
+            return token
+
+    def release(self, token):
+        with self.lock:
+            self.slots.pop(token, None)
+
+
+class SQLiteBackend:
+
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+        self.pruned = 0.0
+
+    def _db(self):
+        db = getattr(self.local, "db", None)
+        if db is None or self.local.pid != os.getpid():
+            db = sqlite3.connect(self.path, timeout=1, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=OFF")   # limiter state is disposable
+            db.execute("""
+                CREATE TABLE IF NOT EXISTS buckets (
+                    key TEXT PRIMARY KEY,
+                    tokens REAL NOT NULL,
+                    updated REAL NOT NULL
+                )
+            """)
+            db.execute("""
+                CREATE TABLE IF NOT EXISTS slots (
+                    token TEXT PRIMARY KEY,
+                    scope TEXT NOT NULL,
+                    expires REAL NOT NULL
+                )
+            """)
+            self.local.db, self.local.pid = db, os.getpid()
+        return db
+
+    def take(self, limits, now):
+        db = self._db()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            if now - self.pruned > BUCKET_PRUNE_EVERY:
+                db.execute("DELETE FROM buckets WHERE updated < ?", (now - BUCKET_IDLE_SECONDS,))
+                self.pruned = now
+
+            levels = []
+            for key, rate, burst in limits:
+                row = db.execute(
+                    "SELECT tokens, updated FROM buckets WHERE key=?", (key,)
+                ).fetchone()
+                tokens, updated = row if row else (None, now)
+                levels.append(_refill(tokens, updated, rate, burst, now))
+
+            wait = max(
+                ((1 - level) / rate if level < 1 else 0.0)
+                for level, (_, rate, _) in zip(levels, limits)
+            )
+            spend = 1 if wait == 0 else 0
+
+            db.executemany(
+                "INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)",
+                [(key, level - spend, now) for level, (key, _, _) in zip(levels, limits)]
+            )
+            db.execute("COMMIT")
+            return wait
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+
+    def acquire(self, scope, limit, now):
+        db = self._db()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            db.execute("DELETE FROM slots WHERE expires < ?", (now,))
+            used = db.execute(
+                "SELECT COUNT(*) FROM slots WHERE scope=?", (scope,)
+            ).fetchone()[0]
+
+            token = None
+            if used < limit:
+                token = uuid.uuid4().hex
+                db.execute(
+                    "INSERT INTO slots (token, scope, expires) VALUES (?, ?, ?)",
+                    (token, scope, now + WRITE_SLOT_LEASE)
+                )
+            db.execute("COMMIT")
+            return token
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+
+    def release(self, token):
+        self._db().execute("DELETE FROM slots WHERE token=?", (token,))
+
+
+backend = (
+    MemoryBackend() if RATE_LIMIT_BACKEND == "memory"
+    else SQLiteBackend(RATE_LIMIT_DB)
+)
+
+
+# --------------------------------------------------
+# FLASK HELPERS
+# --------------------------------------------------
+
+def too_many(retry_after):
+    seconds = max(1, math.ceil(retry_after))
+    resp = jsonify({"error": "Too many requests", "retry_after": seconds})
+    resp.status_code = 429
+    resp.headers["Retry-After"] = str(seconds)
+    return resp
+
+
+def take(limits):
+    """
+    Spend one token from every (key, rate, burst) bucket, or none if any
+    is empty. Returns a 429 response, or None when admitted.
+    """
+    if not ADMISSION_CONTROL:
+        return None
+
+    try:
+        wait = backend.take(limits, time.time())
+    except sqlite3.Error:
+        log.exception("rate limiter unavailable, admitting request")
+        return None
+
+    return too_many(wait) if wait else None
+
+
+def positive_int(value):
+    """
+    An id from a JSON body (number or digit string) as an int, else None;
+    rate-limit keys must not differ for "4" and "04"
+    """
+    if isinstance(value, bool) or not isinstance(value, (int, str)):
+        return None
+    try:
+        value = int(value)
+    except ValueError:
+        return None
+    return value if value > 0 else None
+
+
+def check_order_rate(restaurant_id, table_no):
+    """
+    restaurant_id and table_no must already be ints (positive_int)
+    """
+    return take([
+        (f"order:r:{restaurant_id}",
+         ORDER_RATE_PER_RESTAURANT, ORDER_BURST_PER_RESTAURANT),
+        (f"order:t:{restaurant_id}:{table_no}",
+         ORDER_RATE_PER_TABLE, ORDER_BURST_PER_TABLE),
+    ])
+
+
+def check_login_rate(ip, username):
+    return take([
+        (f"login:account:{ip}:{username[:254]}", LOGIN_RATE_PER_ACCOUNT, LOGIN_BURST_PER_ACCOUNT),
+        (f"login:ip:{ip}", LOGIN_RATE_PER_IP, LOGIN_BURST_PER_IP)
+    ])
+
+
+def write_scope():
+    """
+    The restaurant a write is for: the staff session's, else the body's
+    (public /order)
+    """
+    restaurant_id = session.get("restaurant_id")
+    if restaurant_id is None:
+        data = request.get_json(silent=True)
+        if isinstance(data, dict):
+            restaurant_id = positive_int(data.get("restaurant_id"))
+    return f"write:{restaurant_id}"
+
+
+def admit_write(func):
+    """
+    Cap concurrent write requests per restaurant host-wide; over the cap
+    gets a 429, and other restaurants keep their own slots
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not ADMISSION_CONTROL:
+            return func(*args, **kwargs)
+
+        try:
+            token = backend.acquire(write_scope(), WRITE_CONCURRENCY_PER_RESTAURANT, time.time())
+        except sqlite3.Error:
+            log.exception("rate limiter unavailable, admitting request")
+            return func(*args, **kwargs)
+
+        if token is None:
+            return too_many(1)
+
+        try:
+            return func(*args, **kwargs)
+        finally:
+            try:
+                backend.release(token)
+            except sqlite3.Error:
+                log.exception("could not release write slot")   # lease expires
+    return wrapper
@@ -1,25 +1,17 @@
-@app.route("/api/daily-report", methods=["GET"])
-def daily_report():
-    today = datetime.date.today()
+import datetime
 
-    orders = fetchall("""
-        SELECT table_number, dish_name, total, wait_time
-        FROM orders
-        WHERE DATE(created_at)=?
-        AND status='Closed'
-    """, (today,))
+from analytics import load_orders, summary, top_dishes
 
-    total_revenue = sum(o["total"] for o in orders)
-    total_orders = len(orders)
 
-    dish_count = {}
-    for o in orders:
-        dish_count[o["dish_name"]] = dish_count.get(o["dish_name"], 0) + 1
+def daily_report(restaurant_id, day=None):
+    day = day or datetime.date.today()
 
-    top_dish = max(dish_count, key=dish_count.get) if dish_count else None
+    cols = load_orders(restaurant_id, day, day)
+    totals = summary(cols)
+    top = top_dishes(cols, limit=1)
 
-    return jsonify({
-        "revenue": total_revenue,
-        "orders": total_orders,
-        "top_dish": top_dish
-    })
+    return {
+        "revenue": totals["revenue"],
+        "orders": totals["orders"],
+        "top_dish": top[0]["name"] if top else None
+    }
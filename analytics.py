@@ -0,0 +1,244 @@
+import json
+import datetime as dt
+
+import numpy as np
+
+from db import fetchall, sql, json_elements, json_field
+
+
+# --------------------------------------------------
+# COLUMNAR LOADING
+# --------------------------------------------------
+
+class OrderColumns:
+    """
+    Closed orders for one restaurant and date range, held as NumPy arrays.
+
+    Order level arrays have one entry per order; line level arrays have
+    one entry per item line and point back to their order via line_order.
+    """
+
+    def __init__(self, start, end, order_ids, table_no, created_at, total,
+                 line_order, line_dish, line_qty, line_price, dishes):
+        self.start = start
+        self.end = end
+        self.order_ids = order_ids
+        self.table_no = table_no
+        self.created_at = created_at
+        self.total = total
+        self.line_order = line_order
+        self.line_dish = line_dish
+        self.line_qty = line_qty
+        self.line_price = line_price
+        self.dishes = dishes
+
+    @property
+    def days(self):
+        return (self.end - self.start).days + 1
+
+    def __len__(self):
+        return len(self.order_ids)
+
+
+def _as_timestamp(value):
+    if isinstance(value, dt.datetime):
+        return value.replace(tzinfo=None)
+    return value
+
+
+def load_orders(restaurant_id, start, end):
+    """
+    Load closed orders created between start and end (inclusive dates)
+    """
+    rows = fetchall(sql("""
+        SELECT id, table_no, items, total, created_at
+        FROM orders_history
+        WHERE restaurant_id=?
+        AND status='Closed'
+        AND created_at >= ?
+        AND created_at < ?
+        ORDER BY created_at
+    """), (
+        restaurant_id,
+        start.isoformat(),
+        (end + dt.timedelta(days=1)).isoformat()
+    ))
+
+    n = len(rows)
+    order_ids = np.empty(n, dtype=np.int64)
+    table_no = np.empty(n, dtype=np.int64)
+    total = np.empty(n, dtype=np.float64)
+    created = []
+
+    line_order, names, qtys, prices = [], [], [], []
+
+    for idx, r in enumerate(rows):
+        order_ids[idx] = r["id"]
+        table_no[idx] = r["table_no"] or 0
+        total[idx] = float(r["total"] or 0)
+        created.append(_as_timestamp(r["created_at"]))
+
+        items = r["items"]
+        if isinstance(items, str):
+            items = json.loads(items or "[]")
+
+        for i in items or []:
+            line_order.append(idx)
+            names.append(i["name"])
+            qtys.append(int(i["qty"]))
+            prices.append(float(i["price"]))
+
+    dishes, line_dish = np.unique(
+        np.array(names, dtype=object).astype(str), return_inverse=True
+    )
+
+    return OrderColumns(
+        start=start,
+        end=end,
+        order_ids=order_ids,
+        table_no=table_no,
+        created_at=np.array(created, dtype="datetime64[s]"),
+        total=total,
+        line_order=np.array(line_order, dtype=np.int64),
+        line_dish=line_dish.astype(np.int64),
+        line_qty=np.array(qtys, dtype=np.int64),
+        line_price=np.array(prices, dtype=np.float64),
+        dishes=dishes
+    )
+
+
+# --------------------------------------------------
+# REPORTS
+# --------------------------------------------------
+
+def revenue_by_hour(cols):
+    hours = (
+        cols.created_at.astype("datetime64[h]")
+        - cols.created_at.astype("datetime64[D]")
+    ).astype(np.int64)
+
+    revenue = np.bincount(hours, weights=cols.total, minlength=24)
+    orders = np.bincount(hours, minlength=24)
+
+    return [
+        {"hour": h, "orders": int(orders[h]), "revenue": round(float(revenue[h]), 2)}
+        for h in range(24)
+    ]
+
+
+def top_dishes(cols, limit=10, by="qty"):
+    if not len(cols.line_dish):
+        return []
+
+    n = len(cols.dishes)
+    qty = np.bincount(cols.line_dish, weights=cols.line_qty, minlength=n)
+    revenue = np.bincount(
+        cols.line_dish,
+        weights=cols.line_qty * cols.line_price,
+        minlength=n
+    )
+
+    key = revenue if by == "revenue" else qty
+    top = np.argsort(-key, kind="stable")[:limit]
+
+    return [
+        {
+            "name": str(cols.dishes[i]),
+            "qty": int(qty[i]),
+            "revenue": round(float(revenue[i]), 2)
+        }
+        for i in top
+    ]
+
+
+def summary(cols):
+    n = len(cols)
+    if not n:
+        return {
+            "orders": 0,
+            "revenue": 0.0,
+            "avg_ticket": 0.0,
+            "items_per_order": 0.0
+        }
+
+    items = np.bincount(cols.line_order, weights=cols.line_qty, minlength=n)
+
+    return {
+        "orders": n,
+        "revenue": round(float(cols.total.sum()), 2),
+        "avg_ticket": round(float(cols.total.mean()), 2),
+        "items_per_order": round(float(items.mean()), 2)
+    }
+
+
+def table_turnover(cols):
+    """
+    Closed orders per table, overall and per day of the range
+    """
+    if not len(cols):
+        return {"tables": [], "avg_turnover_per_day": 0.0}
+
+    tables, counts = np.unique(cols.table_no, return_counts=True)
+    revenue = np.bincount(
+        np.searchsorted(tables, cols.table_no),
+        weights=cols.total,
+        minlength=len(tables)
+    )
+    per_day = counts / cols.days
+
+    return {
+        "tables": [
+            {
+                "table_no": int(t),
+                "orders": int(c),
+                "turnover_per_day": round(float(d), 2),
+                "revenue": round(float(rv), 2)
+            }
+            for t, c, d, rv in zip(tables, counts, per_day, revenue)
+        ],
+        "avg_turnover_per_day": round(float(per_day.mean()), 2)
+    }
+
+
+# --------------------------------------------------
+# SQL-SIDE ITEM AGGREGATES
+# --------------------------------------------------
+
+def item_totals(restaurant_id, start, end, limit=None, by="qty"):
+    """
+    Quantity and revenue per dish over closed orders, aggregated in the
+    database (jsonb on Postgres, JSON1 on SQLite) without loading items
+    """
+    order = "revenue" if by == "revenue" else "qty"
+    name = json_field("line", "name")
+    qty = f"CAST({json_field('line', 'qty')} AS INTEGER)"
+    price = f"CAST({json_field('line', 'price')} AS NUMERIC)"
+
+    rows = fetchall(sql(f"""
+        SELECT {name} AS name,
+               SUM({qty}) AS qty,
+               SUM({qty} * {price}) AS revenue
+        FROM orders_history o
+        CROSS JOIN {json_elements("o.items", "line")}
+        WHERE o.restaurant_id=?
+        AND o.status='Closed'
+        AND o.created_at >= ?
+        AND o.created_at < ?
+        GROUP BY {name}
+        ORDER BY {order} DESC, name
+        {"LIMIT ?" if limit else ""}
+    """), (
+        restaurant_id,
+        start.isoformat(),
+        (end + dt.timedelta(days=1)).isoformat(),
+        *([limit] if limit else [])
+    ))
+
+    return [
+        {
+            "name": r["name"],
+            "qty": int(r["qty"] or 0),
+            "revenue": round(float(r["revenue"] or 0), 2)
+        }
+        for r in rows
+    ]
@@ -1,29 +1,31 @@
 from flask import (
     Flask, render_template, request, redirect,
     session, Response, send_file, jsonify,
-    current_app
+    current_app, stream_with_context
 )
-import requests
 import uuid
 from flask import url_for
-from flask_dance.contrib.google import google
 from db import (
     execute, fetchone, fetchall, commit, sql,
-    init_db, close_db, today_clause, get_db
+    init_db, close_db, today_clause, json_append, get_db,
+    json_elements, json_field, json_group,
+    use_tenant, create_tenant, restaurant_ids, split_tenants,
+    TENANT_SHARDED, TENANT_DIR, DB_TYPE, replica_safe, mark_write,
+    transaction, FOR_UPDATE
 )
 from email_utils import send_otp_email
-from otp_utils import generate_otp   # or wherever you put it
-import cloudinary
-import cloudinary.uploader
+from otp_utils import issue_otp, verify_otp
 from auth import login_required
-import os, json, time, qrcode
+import os, json, time, click
 from zipfile import ZipFile
-from reportlab.pdfgen import canvas
-from flask_dance.contrib.google import make_google_blueprint
-from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.middleware.proxy_fix import ProxyFix
+from passwords import hash_password, verify_password, PasswordHashBusy
 from menu_templates import MENU_TEMPLATES
+import rollups, events, logs, archive, bill_cache, billing, prices, exports, shared_cache, assets, table_status
+from admission import admit_write, check_order_rate, check_login_rate, positive_int
+from writer import GROUP_COMMIT, GroupCommitBusy, writer_for
 from decimal import Decimal
-from datetime import datetime
+from datetime import datetime, date, timedelta
 def serialize_row(row):
     return {
         k: float(v) if isinstance(v, Decimal) else v
@@ -38,20 +40,60 @@ def json_safe(obj):
         return float(obj)
     return obj
 
-def calculate_bill(items, gst_rate=0.05):
-    subtotal = round(
-        sum(float(i["price"]) * int(i["qty"]) for i in items),
-        2
-    )
+def money_columns(subtotal_paise, gst_rate_bp):
+    """
+    Params for `subtotal_paise=?, subtotal=?, cgst=?, sgst=?, total=?`
+    """
+    return (subtotal_paise, *billing.totals(subtotal_paise, gst_rate_bp))
 
-    half = gst_rate / 2
 
-    cgst = round(subtotal * half, 2)
-    sgst = round(subtotal * half, 2)
+def add_to_subtotal(order_id, delta_paise, db=None):
+    """
+    Move an order's running total by delta_paise in SQL, so concurrent
+    writers (other workers) never lose each other's lines. The rupee
+    columns are then written for the resulting subtotal, unless a later
+    writer has already moved it on and will write its own.
+    """
+    row = execute(sql("""
+        UPDATE orders
+        SET subtotal_paise = subtotal_paise + ?
+        WHERE id=?
+        RETURNING subtotal_paise, gst_rate_bp
+    """), (delta_paise, order_id), db).fetchall()[0]
+
+    execute(sql("""
+        UPDATE orders
+        SET subtotal=?, cgst=?, sgst=?, total=?
+        WHERE id=? AND subtotal_paise=?
+    """), (
+        *billing.totals(row["subtotal_paise"], row["gst_rate_bp"]),
+        order_id,
+        row["subtotal_paise"]
+    ), db)
 
-    total = round(subtotal + cgst + sgst, 2)
 
-    return subtotal, cgst, sgst, total
+def mark_order_closed(order_id, restaurant_id):
+    """
+    Close an order; publishes order.closed only on the first close
+    """
+    rows = execute(sql("""
+        UPDATE orders
+        SET status='Closed'
+        WHERE id=? AND restaurant_id=? AND status!='Closed'
+        RETURNING table_no
+    """), (order_id, restaurant_id)).fetchall()
+    commit()
+
+    closed_now = len(rows) == 1
+
+    if closed_now:
+        table_status.notify(restaurant_id, rows[0]["table_no"])
+        events.publish("order.closed", {
+            "order_id": order_id,
+            "restaurant_id": restaurant_id
+        })
+
+    return closed_now
 def check_subscription():
     rid = session.get("restaurant_id")
     if not rid:
@@ -83,81 +125,131 @@ app.config.update(
     SESSION_COOKIE_HTTPONLY=True,
     SESSION_COOKIE_SAMESITE="Lax"
 )
-cloudinary.config(
-    cloud_name=os.getenv("CLOUDINARY_CLOUD_NAME"),
-    api_key=os.getenv("CLOUDINARY_API_KEY"),
-    api_secret=os.getenv("CLOUDINARY_API_SECRET"),
-    secure=True
-)
 
 app.secret_key = os.getenv("SECRET_KEY", "dev-secret")
+logs.init_app(app)
+assets.init_app(app)
+
+# Render (and most hosts) put one proxy in front; per-IP limits need the
+# client address from X-Forwarded-For, trusted only for these hops
+TRUSTED_PROXY_HOPS = int(os.getenv("TRUSTED_PROXY_HOPS", "1" if os.getenv("RENDER") else "0"))
+if TRUSTED_PROXY_HOPS:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXY_HOPS, x_proto=TRUSTED_PROXY_HOPS)
+events.init_app(app)
+
+# Schema changes run once per deploy (`flask --app app migrate`, see
+# Procfile), not in every worker at import time
+app.teardown_appcontext(close_db)
 
 
-init_db()
-app.teardown_appcontext(close_db)
+@app.before_request
+def route_tenant():
+    use_tenant(session.get("restaurant_id"))
 
 UPLOAD_FOLDER = "static/uploads"
 QR_FOLDER = "static/qr"
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-os.makedirs(QR_FOLDER, exist_ok=True)
+
+
+@app.cli.command("migrate")
+def migrate_command():
+    """Create or upgrade the database schema (run once per deploy)."""
+    init_db()
+    click.echo("Schema up to date")
+
+
+# Heavy, rarely used clients are imported on first use to keep worker
+# cold starts fast (see benchmarks/bench_startup.py)
+
+def cloudinary_uploader():
+    import cloudinary
+    import cloudinary.uploader
+
+    cloudinary.config(
+        cloud_name=os.getenv("CLOUDINARY_CLOUD_NAME"),
+        api_key=os.getenv("CLOUDINARY_API_KEY"),
+        api_secret=os.getenv("CLOUDINARY_API_SECRET"),
+        secure=True
+    )
+    return cloudinary.uploader
 
 # --------------------------------------------------
 # GOOGLE AUTH (optional)
 # --------------------------------------------------
 
-google_bp = make_google_blueprint(
-    client_id=os.getenv("GOOGLE_CLIENT_ID"),
-    client_secret=os.getenv("GOOGLE_CLIENT_SECRET"),
-    scope=[
-        "openid",
-        "https://www.googleapis.com/auth/userinfo.email",
-        "https://www.googleapis.com/auth/userinfo.profile"
-    ]
-)
+GOOGLE_LOGIN = bool(os.getenv("GOOGLE_CLIENT_ID"))
+app.jinja_env.globals["google_login"] = GOOGLE_LOGIN
+
+if GOOGLE_LOGIN:
+    from flask_dance.contrib.google import make_google_blueprint
 
-app.register_blueprint(google_bp, url_prefix="/login")
-google_bp.redirect_url = "/google/after-login"
+    google_bp = make_google_blueprint(
+        client_id=os.getenv("GOOGLE_CLIENT_ID"),
+        client_secret=os.getenv("GOOGLE_CLIENT_SECRET"),
+        scope=[
+            "openid",
+            "https://www.googleapis.com/auth/userinfo.email",
+            "https://www.googleapis.com/auth/userinfo.profile"
+        ]
+    )
+
+    app.register_blueprint(google_bp, url_prefix="/login")
+    google_bp.redirect_url = "/google/after-login"
 
 # --------------------------------------------------
 # AUTH
 # --------------------------------------------------
 
+@app.errorhandler(PasswordHashBusy)
+def password_hash_busy(e):
+    return "Server busy, please try again in a moment", 503, {"Retry-After": "1"}
+
+
+@app.errorhandler(GroupCommitBusy)
+def group_commit_busy(e):
+    # The order was not written, so retrying cannot duplicate it
+    return jsonify({"error": "Server busy, please try again"}), 503, {"Retry-After": "1"}
+
+
 @app.route("/login", methods=["GET", "POST"])
 def login():
     if request.method == "POST":
         email = request.form["username"].strip().lower()
         password = request.form["password"]
 
+        # 🚦 Per-account and per-IP throttle before any hashing work
+        limited = check_login_rate(request.remote_addr, email)
+        if limited:
+            return render_template(
+                "login.html", error="Too many login attempts. Please wait a minute."
+            ), 429, {"Retry-After": limited.headers["Retry-After"]}
+
         user = fetchone(
             sql("SELECT * FROM users WHERE username=?"),
             (email,)
         )
 
-        if not user or not check_password_hash(user["password"], password):
+        ok, new_hash = verify_password(user["password"], password) if user else (False, None)
+        if not ok:
             return render_template("login.html", error="Invalid email or password")
 
+        # 🔁 Hash parameters changed since this password was set: upgrade it
+        if new_hash:
+            execute(sql("UPDATE users SET password=? WHERE id=?"), (new_hash, user["id"]))
+            commit()
+
         # 🔐 IF NOT VERIFIED → SEND OTP
         if not user["is_verified"]:
-            otp = generate_otp()
-
-            execute(sql("""
-                UPDATE users
-                SET otp_code=?, otp_expires_at=NOW() + INTERVAL '10 minutes'
-                WHERE username=?
-            """), (otp, email))
-            commit()
+            otp = issue_otp(email, "verify")
 
             send_otp_email(email, otp)
             session["pending_email"] = email
             return redirect("/verify-email")
 
-        # ✅ DEBUG (SAFE — user EXISTS here)
-        print(
-            "LOGIN DEBUG →",
-            user["username"],
-            user["role"],
-            "verified:", user["is_verified"]
-        )
+        app.logger.info("login", extra={
+            "user": user["username"],
+            "role": user["role"],
+            "verified": bool(user["is_verified"])
+        })
 
         # ✅ LOGIN SUCCESS
         session.clear()
@@ -197,16 +289,7 @@ def forgot_password():
                 error="No account found with this email"
             )
 
-        otp = generate_otp()
-
-        execute(sql("""
-            UPDATE users
-            SET otp_code=?,
-                otp_expires_at=NOW() + INTERVAL '10 minutes'
-            WHERE username=?
-        """), (otp, email))
-
-        commit()
+        otp = issue_otp(email, "reset")
 
         send_otp_email(email, otp)
 
@@ -226,15 +309,7 @@ def reset_verify():
     if request.method == "POST":
         code = request.form["otp"]
 
-        user = fetchone(sql("""
-            SELECT *
-            FROM users
-            WHERE username=?
-              AND otp_code=?
-              AND otp_expires_at > NOW()
-        """), (email, code))
-
-        if not user:
+        if not verify_otp(email, "reset", code):
             return render_template(
                 "reset_verify.html",
                 error="Invalid or expired OTP"
@@ -270,12 +345,10 @@ def reset_password():
 
         execute(sql("""
             UPDATE users
-            SET password=?,
-                otp_code=NULL,
-                otp_expires_at=NULL
+            SET password=?
             WHERE username=?
         """), (
-            generate_password_hash(password),
+            hash_password(password),
             email
         ))
 
@@ -299,9 +372,9 @@ def signup():
         if fetchone(sql("SELECT id FROM restaurants WHERE subdomain=?"), (subdomain,)):
             return render_template("signup.html", error="Subdomain already taken.")
 
-        try:
-            otp = generate_otp()
+        password_hash = hash_password(request.form["password"])
 
+        try:
             cursor = execute(sql("""
                 INSERT INTO restaurants
                 (name, subdomain, gstin, phone, address,
@@ -325,24 +398,23 @@ def signup():
                     username,
                     password,
                     role,
-                    is_verified,
-                    otp_code,
-                    otp_expires_at
+                    is_verified
                 )
-                VALUES (?, ?, ?, 'admin', FALSE, ?, NOW() + INTERVAL '10 minutes')
+                VALUES (?, ?, ?, 'admin', FALSE)
             """), (
                 restaurant_id,
                 email,
-                generate_password_hash(request.form["password"]),
-                otp
+                password_hash
             ))
 
             commit()
+            create_tenant(restaurant_id)
 
         except Exception:
             get_db().rollback()
             return render_template("signup.html", error="Signup failed.")
 
+        otp = issue_otp(email, "verify")
         send_otp_email(email, otp)
 
         session.clear()
@@ -396,6 +468,7 @@ def onboarding():
         """), (restaurant_id, user_id))
 
         commit()
+        create_tenant(restaurant_id)
 
         session.clear()
         session["user"] = email
@@ -408,6 +481,11 @@ def onboarding():
 
 @app.route("/google/after-login")
 def google_after_login():
+    if not GOOGLE_LOGIN:
+        return redirect("/login")
+
+    from flask_dance.contrib.google import google
+
     if not google.authorized:
         return redirect("/login")
 
@@ -455,7 +533,7 @@ def google_after_login():
         RETURNING id
     """), (
         email,
-        generate_password_hash(google_id)
+        hash_password(google_id)
     ))
 
     user_id = cursor.fetchone()["id"]
@@ -477,23 +555,15 @@ def verify_email():
     if request.method == "POST":
         code = request.form["otp"]
 
-        user = fetchone(sql("""
-            SELECT *
-            FROM users
-            WHERE username=?
-              AND otp_code=?
-              AND otp_expires_at > NOW()
-        """), (email, code))
+        user = fetchone(sql("SELECT * FROM users WHERE username=?"), (email,))
 
-        if not user:
+        if not user or not verify_otp(email, "verify", code):
             return render_template("verify_email.html",
                                    error="Invalid or expired OTP")
 
         execute(sql("""
             UPDATE users
-            SET is_verified=TRUE,
-                otp_code=NULL,
-                otp_expires_at=NULL
+            SET is_verified=TRUE
             WHERE username=?
         """), (email,))
         commit()
@@ -512,15 +582,7 @@ def resend_otp():
     if not email:
         return redirect("/login")
 
-    otp = generate_otp()
-
-    execute(sql("""
-        UPDATE users
-        SET otp_code=?, otp_expires_at=NOW() + INTERVAL '10 minutes'
-        WHERE username=?
-    """), (otp, email))
-
-    commit()
+    otp = issue_otp(email, "verify")
     send_otp_email(email, otp)
 
     return redirect("/verify-email")
@@ -535,24 +597,55 @@ def logout():
 
 @app.route("/platform/restaurants")
 @login_required("superadmin")
+@replica_safe
 def platform_restaurants():
-    rows = fetchall(sql("""
-        SELECT 
-            r.id,
-            r.name,
-            r.subdomain,
-            r.plan,
-            r.created_at,
-            r.trial_expires_at,
-            r.subscription_end,
-            r.is_active,
-            COUNT(o.id) AS total_orders,
-            COALESCE(SUM(o.total), 0) AS total_revenue
-        FROM restaurants r
-        LEFT JOIN orders o ON r.id=o.restaurant_id
-        GROUP BY r.id
-        ORDER BY r.id DESC
-    """))
+    if TENANT_SHARDED:
+        rows = [dict(r) for r in fetchall(sql("""
+            SELECT 
+                r.id,
+                r.name,
+                r.subdomain,
+                r.plan,
+                r.created_at,
+                r.trial_expires_at,
+                r.subscription_end,
+                r.is_active
+            FROM restaurants r
+            ORDER BY r.id DESC
+        """))]
+
+        # Each restaurant's orders live in its own database file
+        for r in rows:
+            if not use_tenant(r["id"]):
+                # No tenant file yet (e.g. signup never finished): no orders
+                r.update(total_orders=0, total_revenue=0)
+                continue
+            r.update(fetchone(sql("""
+                SELECT
+                    COUNT(id) AS total_orders,
+                    COALESCE(SUM(total), 0) AS total_revenue
+                FROM orders_history
+                WHERE restaurant_id=?
+            """), (r["id"],)))
+        use_tenant(None)
+    else:
+        rows = fetchall(sql("""
+            SELECT 
+                r.id,
+                r.name,
+                r.subdomain,
+                r.plan,
+                r.created_at,
+                r.trial_expires_at,
+                r.subscription_end,
+                r.is_active,
+                COUNT(o.id) AS total_orders,
+                COALESCE(SUM(o.total), 0) AS total_revenue
+            FROM restaurants r
+            LEFT JOIN orders_history o ON r.id=o.restaurant_id
+            GROUP BY r.id
+            ORDER BY r.id DESC
+        """))
     restaurants = []
 
     for r in rows:
@@ -580,7 +673,10 @@ def platform_restaurants():
     )
 @app.route("/platform/restaurants/<int:restaurant_id>")
 @login_required("superadmin")
+@replica_safe
 def platform_restaurant_details(restaurant_id):
+    if not use_tenant(restaurant_id):
+        return "Restaurant not found", 404
 
     restaurant = fetchone(sql("""
         SELECT r.*, u.username AS admin_email
@@ -596,7 +692,7 @@ def platform_restaurant_details(restaurant_id):
         SELECT
             COUNT(id) AS total_orders,
             COALESCE(SUM(total), 0) AS revenue
-        FROM orders
+        FROM orders_history
         WHERE restaurant_id=?
     """), (restaurant_id,))
 
@@ -656,7 +752,7 @@ def toggle_restaurant_status(restaurant_id):
         return jsonify({"success": True})
 
     except Exception as e:
-        print("TOGGLE ERROR:", e)
+        app.logger.exception("toggle restaurant failed")
         return jsonify({"error": str(e)}), 500
 # --------------------------------------------------
 # CUSTOMER
@@ -665,160 +761,248 @@ def toggle_restaurant_status(restaurant_id):
 
 @app.route("/customer/<restaurant>")
 def customer(restaurant):
-    r = fetchone(
-        sql("SELECT * FROM restaurants WHERE subdomain=?"),
-        (restaurant,)
-    )
+    def load_restaurant():
+        row = fetchone(
+            sql("SELECT id, name FROM restaurants WHERE subdomain=?", name="restaurant_by_subdomain"),
+            (restaurant,)
+        )
+        return {"id": row["id"], "name": row["name"]} if row else None
+
+    # QR scans hit this hardest; both lookups are shared by all workers
+    r = shared_cache.get_or_load("restaurants", f"subdomain:{restaurant}", load_restaurant)
 
-    if not r:
+    if not r or not use_tenant(r["id"]):
         return "Restaurant not found", 404
 
-    menu = fetchall(
-        sql("SELECT * FROM menu WHERE restaurant_id=? AND available=TRUE"),
-        (r["id"],)
-    )
+    # Same staleness bound as the price map /order charges from
+    menu = shared_cache.get_or_load(prices.menu_namespace(r["id"]), "customer", lambda: [
+        serialize_row(m) for m in fetchall(
+            sql("SELECT * FROM menu WHERE restaurant_id=? AND available=TRUE", name="customer_menu"),
+            (r["id"],)
+        )
+    ], ttl=prices.PRICE_MAP_TTL)
 
     return render_template(
         "customer.html",
-        menu=[dict(m) for m in menu],
+        menu=menu,
         restaurant_name=r["name"],
         restaurant_id=r["id"],
         table=request.args.get("table")
     )
 
 
+@app.route("/api/table-status/<int:restaurant_id>/<int:table_no>")
+def table_status_feed(restaurant_id, table_no):
+    # 📡 Long-poll: pass back the last version seen, get an answer when it changes
+    since = request.args.get("since", type=int)
+
+    if not use_tenant(restaurant_id):
+        return jsonify({"error": "Restaurant not found"}), 404
+
+    version, retry_after = table_status.wait(restaurant_id, table_no, since)
+    if retry_after:
+        # Too many polls waiting here; nothing changed, so no snapshot
+        return jsonify({"version": version, "retry_after": retry_after})
+
+    return jsonify({
+        "version": version,
+        "orders": table_status.snapshot(restaurant_id, table_no)
+    })
+
+
 @app.route("/order", methods=["POST"])
+@admit_write
 def place_order():
     data = request.get_json()
 
-    restaurant_id = data["restaurant_id"]
-    table_no = data["table"]
+    restaurant_id = positive_int(data.get("restaurant_id"))
+    table_no = positive_int(data.get("table"))
     items = data["items"]
     customer_name = data.get("customer_name", "")
     customer_phone = data.get("customer_phone", "")
 
+    if restaurant_id is None:
+        return jsonify({"error": "Invalid restaurant"}), 400
+    if table_no is None:
+        return jsonify({"error": "Invalid table number"}), 400
+
+    # 🚦 Per-restaurant / per-table token buckets, before any DB work
+    limited = check_order_rate(restaurant_id, table_no)
+    if limited:
+        return limited
+
+    if not use_tenant(restaurant_id):
+        return jsonify({"error": "Restaurant not found"}), 404
+
+    # 🛡️ Names and prices come from the menu, never from the client
+    new_items, rejected = prices.resolve(restaurant_id, items or [])
+    if rejected:
+        return jsonify({"error": "Some items cannot be ordered", "items": rejected}), 400
+    if not new_items:
+        return jsonify({"error": "No items"}), 400
+
+    def write(db):
+        return write_order(
+            db, restaurant_id, table_no, new_items,
+            customer_name, customer_phone
+        )
+
+    # 🚀 Under a rush, batch concurrent orders into one SQLite commit
+    if GROUP_COMMIT:
+        order_id = writer_for(restaurant_id).submit(write)
+        mark_write()
+    else:
+        order_id = write(get_db())
+        commit()
+
+    table_status.notify(restaurant_id, table_no)
+
+    if order_id:
+        return jsonify({"success": True, "order_id": order_id})
+    return jsonify({"success": True})
+
+
+def write_order(db, restaurant_id, table_no, new_items,
+                customer_name, customer_phone):
+    """
+    Append to the table's open order or create one. Does not commit;
+    returns the order id when appending, None for a new order.
+    """
+
     # 🔎 Find existing OPEN order for table
     existing = fetchone(sql("""
-        SELECT id, items
+        SELECT id
         FROM orders
         WHERE restaurant_id=? AND table_no=? AND status!='Closed'
         ORDER BY id DESC
         LIMIT 1
-    """), (restaurant_id, table_no))
-
-    new_items = [{
-        "name": i["name"],
-        "price": float(i["price"]),
-        "qty": int(i["qty"])
-    } for i in items]
+    """, name="open_order"), (restaurant_id, table_no), db)
 
     # ===============================
     # ✅ CASE 1: APPEND TO EXISTING ORDER
     # ===============================
     if existing:
-        old_items = (
-            existing["items"]
-            if isinstance(existing["items"], list)
-            else json.loads(existing["items"] or "[]")
-        )
-
-        combined_items = old_items + new_items
-
-        # 🔥 Recalculate FULL BILL
-        subtotal, cgst, sgst, total = calculate_bill(combined_items)
-
-        execute(sql("""
+        # Lines are appended in SQL; the stored items are never re-read
+        execute(sql(f"""
             UPDATE orders
-            SET items=?,
-                subtotal=?,
-                cgst=?,
-                sgst=?,
-                total=?,
+            SET items={json_append("items", len(new_items))},
                 customer_name=?,
                 customer_phone=?
             WHERE id=?
         """), (
-            json.dumps(combined_items),
-            subtotal,
-            cgst,
-            sgst,
-            total,
+            *[json.dumps(i) for i in new_items],
             customer_name,
             customer_phone,
             existing["id"]
-        ))
+        ), db)
+
+        # ➕ Running total: add only the new lines (exact paise)
+        add_to_subtotal(existing["id"], billing.items_paise(new_items), db)
 
         # 🔥 Send ONLY new items to kitchen
         for i in new_items:
             execute(sql("""
                 INSERT INTO order_additions
-                (order_id, restaurant_id, table_no, item_name, qty, price, status, created_at)
-                VALUES (?,?,?,?,?,?,'New',CURRENT_TIMESTAMP)
+                (order_id, restaurant_id, table_no, item_name, qty, price, station, status, created_at)
+                VALUES (?,?,?,?,?,?,?,'New',CURRENT_TIMESTAMP)
             """), (
                 existing["id"],
                 restaurant_id,
                 table_no,
                 i["name"],
                 i["qty"],
-                i["price"]
-            ))
+                i["price"],
+                i.get("station") or prices.DEFAULT_STATION
+            ), db)
 
-        commit()
-        return jsonify({"success": True, "order_id": existing["id"]})
+        return existing["id"]
 
     # ===============================
     # ✅ CASE 2: CREATE NEW ORDER
     # ===============================
 
-    subtotal, cgst, sgst, total = calculate_bill(new_items)
+    restaurant = fetchone(sql("""
+        SELECT gst_rate_bp FROM restaurants WHERE id=?
+    """), (restaurant_id,), db)
+    gst_rate_bp = restaurant["gst_rate_bp"]
+    if gst_rate_bp is None:
+        gst_rate_bp = billing.DEFAULT_GST_RATE_BP
 
     execute(sql("""
         INSERT INTO orders
         (restaurant_id, table_no, customer_name, customer_phone,
-         items, subtotal, cgst, sgst, total,
+         items, gst_rate_bp, subtotal_paise, subtotal, cgst, sgst, total,
          status, created_at)
-        VALUES (?,?,?,?,?,?,?,?,?,'Received',CURRENT_TIMESTAMP)
+        VALUES (?,?,?,?,?,?,?,?,?,?,?,'Received',CURRENT_TIMESTAMP)
     """), (
         restaurant_id,
         table_no,
         customer_name,
         customer_phone,
         json.dumps(new_items),
-        subtotal,
-        cgst,
-        sgst,
-        total
-    ))
+        gst_rate_bp,
+        *money_columns(billing.items_paise(new_items), gst_rate_bp)
+    ), db)
 
-    commit()
-    return jsonify({"success": True})
+    return None
 
 @app.route("/api/order/<int:order_id>/close", methods=["POST"])
 @login_required("admin")
+@admit_write
 def close_order(order_id):
 
-    print("CLOSE ORDER ROUTE HIT", order_id)
+    app.logger.info("close order", extra={"order_id": order_id})
 
-    execute(sql("""
-        UPDATE orders
-        SET status='Closed'
-        WHERE id=? AND restaurant_id=?
-    """), (order_id, session["restaurant_id"]))
-    commit()
+    # Side effects (rollup, feedback agent) run on the event workers
+    mark_order_closed(order_id, session["restaurant_id"])
+
+    return jsonify({"success": True})
+
+
+# ====== ORDER CLOSED HANDLERS ========#
+FEEDBACK_AGENT_URL = os.getenv("FEEDBACK_AGENT_URL")
+FEEDBACK_AGENT_TIMEOUT = float(os.getenv("FEEDBACK_AGENT_TIMEOUT", "10"))
 
+
+# Idempotent (rollups.roll_up), so it is retried; events lost before it
+# runs are picked up by the daily `flask archive-orders`
+@events.subscribe("order.closed")
+def rollup_closed_order(event):
+    if use_tenant(event["restaurant_id"]):
+        rollups.roll_up(event["order_id"], event["restaurant_id"])
+
+
+@events.subscribe("order.closed")
+def feedback_agent_on_close(event):
+    use_tenant(event["restaurant_id"])
     order = fetchone(sql("""
         SELECT o.*, r.name AS restaurant_name
         FROM orders o
         JOIN restaurants r ON o.restaurant_id=r.id
         WHERE o.id=? AND o.restaurant_id=?
-    """), (order_id, session["restaurant_id"]))
+    """), (event["order_id"], event["restaurant_id"]))
 
-    restaurant = {"name": order["restaurant_name"]}
+    if order:
+        trigger_feedback_agent(order, {"name": order["restaurant_name"]})
 
-    print("TRIGGERING AI AGENT NOW")
-    trigger_feedback_agent(order, restaurant)
 
-    return jsonify({"success": True})
+def trigger_feedback_agent(order, restaurant):
+    if not FEEDBACK_AGENT_URL:
+        return
+
+    app.logger.info("triggering feedback agent", extra={"order_id": order["id"]})
+
+    import requests
+
+    resp = requests.post(
+        FEEDBACK_AGENT_URL,
+        json={
+            "order": {k: json_safe(v) for k, v in dict(order).items()},
+            "restaurant": restaurant
+        },
+        timeout=FEEDBACK_AGENT_TIMEOUT
+    )
+    resp.raise_for_status()
 
 # --------------------------------------------------
 # ADMIN & KITCHEN
@@ -834,17 +1018,20 @@ def admin():
 
 @app.route("/api/order/<int:order_id>/add-item", methods=["POST"])
 @login_required("admin")
+@admit_write
 def add_item_to_order(order_id):
     data = request.json
     qty = int(data["qty"])
     item_id = data["item_id"]
 
-    # 1️⃣ Fetch menu item
+    # 1️⃣ Fetch menu item (and the station that prepares it)
     item = fetchone(sql("""
-        SELECT name, price
-        FROM menu
-        WHERE id=? AND restaurant_id=?
-    """), (item_id, session["restaurant_id"]))
+        SELECT m.name, m.price, COALESCE(s.station, ?) AS station
+        FROM menu m
+        LEFT JOIN kitchen_stations s
+            ON s.restaurant_id = m.restaurant_id AND s.category = m.category
+        WHERE m.id=? AND m.restaurant_id=?
+    """), (prices.DEFAULT_STATION, item_id, session["restaurant_id"]))
 
     if not item:
         return jsonify({"error": "Menu item not found"}), 404
@@ -853,7 +1040,7 @@ def add_item_to_order(order_id):
 
     # 2️⃣ Fetch order
     order = fetchone(sql("""
-        SELECT items, table_no
+        SELECT table_no
         FROM orders
         WHERE id=? AND restaurant_id=?
     """), (order_id, session["restaurant_id"]))
@@ -861,58 +1048,45 @@ def add_item_to_order(order_id):
     if not order:
         return jsonify({"error": "Order not found"}), 404
 
-    # 3️⃣ Parse items
-    items = order["items"]
-    if isinstance(items, str):
-        items = json.loads(items or "[]")
-    if not items:
-        items = []
-
-    # 4️⃣ Add item
-    items.append({
+    # 3️⃣ New line
+    line = {
         "id": str(uuid.uuid4()),
         "name": item["name"],
         "price": price,
-        "qty": qty
-    })
-
-    # 🔥 Recalculate FULL BILL
-    subtotal, cgst, sgst, total = calculate_bill(items)
+        "qty": qty,
+        "station": item["station"]
+    }
 
-    # 5️⃣ Update order with ALL billing columns
-    execute(sql("""
+    # 4️⃣ Append the line in SQL, then add just this line to the running total
+    execute(sql(f"""
         UPDATE orders
-        SET items=?,
-            subtotal=?,
-            cgst=?,
-            sgst=?,
-            total=?
+        SET items={json_append("items", 1)}
         WHERE id=? AND restaurant_id=?
     """), (
-        json.dumps(items),
-        subtotal,
-        cgst,
-        sgst,
-        total,
+        json.dumps(line),
         order_id,
         session["restaurant_id"]
     ))
+    add_to_subtotal(order_id, billing.line_paise(line))
 
-    # 6️⃣ Kitchen addition (only new item)
+    # 5️⃣ Kitchen addition (only new item)
     execute(sql("""
         INSERT INTO order_additions
-        (order_id, restaurant_id, table_no, item_name, qty, price, status, created_at)
-        VALUES (?,?,?,?,?,?,'New',CURRENT_TIMESTAMP)
+        (order_id, restaurant_id, table_no, item_name, qty, price, station, status, created_at)
+        VALUES (?,?,?,?,?,?,?,'New',CURRENT_TIMESTAMP)
     """), (
         order_id,
         session["restaurant_id"],
         order["table_no"],
         item["name"],
         qty,
-        price
+        price,
+        item["station"]
     ))
 
     commit()
+    bill_cache.invalidate(session["restaurant_id"], order_id)
+    table_status.notify(session["restaurant_id"], order["table_no"])
     return jsonify({"success": True})
 
 # -----------------------
@@ -930,14 +1104,19 @@ def kitchen():
 def api_kitchen_additions():
     rid = session["restaurant_id"]
 
-    rows = fetchall(sql("""
+    station = request.args.get("station")
+
+    # With ?station= this stays on idx_additions_station
+    rows = fetchall(sql(f"""
         SELECT *
         FROM order_additions
         WHERE restaurant_id=?
+        {"AND station=?" if station else ""}
         AND status='New'
         ORDER BY created_at ASC
         LIMIT 50
-    """), (rid,))
+    """, name="kitchen_additions_station" if station else "kitchen_additions"),
+        (rid, *([station] if station else [])))
 
     return jsonify([
         {k: json_safe(v) for k, v in dict(r).items()}
@@ -947,17 +1126,153 @@ def api_kitchen_additions():
 
 @app.route("/api/kitchen/addition/<int:id>/status", methods=["POST"])
 @login_required("kitchen")
+@admit_write
 def update_addition_status(id):
-    execute(sql("""
+    rows = execute(sql("""
         UPDATE order_additions
         SET status='Preparing'
         WHERE id=? AND restaurant_id=?
-    """), (id, session["restaurant_id"]))
+        RETURNING table_no
+    """), (id, session["restaurant_id"])).fetchall()
 
     commit()
+    table_status.notify(session["restaurant_id"], *[r["table_no"] for r in rows])
     return jsonify({"success": True})
 
 
+KITCHEN_LEASE_SECONDS = int(os.getenv("KITCHEN_LEASE_SECONDS", "120"))
+KITCHEN_CLAIM_LIMIT = 50
+
+
+@app.route("/api/kitchen/additions/claim", methods=["POST"])
+@login_required("kitchen")
+@admit_write
+def claim_kitchen_additions():
+    """
+    Lease up to `limit` New additions (optionally of one `station`) to
+    this screen. A screen gets back its own unexpired tickets (lease
+    renewed) plus unclaimed or expired ones, so two screens never show
+    the same ticket.
+    """
+    data = request.get_json() or {}
+    screen = str(data.get("screen") or "").strip()[:64]
+    station = data.get("station")
+    if not screen:
+        return jsonify({"error": "screen required"}), 400
+
+    try:
+        limit = min(int(data.get("limit", KITCHEN_CLAIM_LIMIT)), KITCHEN_CLAIM_LIMIT)
+    except (TypeError, ValueError):
+        return jsonify({"error": "limit must be an integer"}), 400
+    if limit < 1:
+        # SQLite reads LIMIT -1 as "no limit"; Postgres rejects it
+        return jsonify({"error": "limit must be at least 1"}), 400
+
+    now = datetime.utcnow()
+    stamp = lambda t: t.strftime("%Y-%m-%d %H:%M:%S")
+
+    # Postgres: concurrent claims skip rows another screen is taking.
+    # SQLite: the single UPDATE runs under the database write lock.
+    skip_locked = "FOR UPDATE SKIP LOCKED" if DB_TYPE == "postgres" else ""
+
+    rows = fetchall(sql(f"""
+        UPDATE order_additions
+        SET claimed_by=?, claim_expires_at=?
+        WHERE id IN (
+            SELECT id
+            FROM order_additions
+            WHERE restaurant_id=?
+            {"AND station=?" if station else ""}
+            AND status='New'
+            AND (claimed_by IS NULL OR claimed_by=? OR claim_expires_at < ?)
+            ORDER BY created_at ASC
+            LIMIT ?
+            {skip_locked}
+        )
+        RETURNING *
+    """), (
+        screen,
+        stamp(now + timedelta(seconds=KITCHEN_LEASE_SECONDS)),
+        session["restaurant_id"],
+        *([station] if station else []),
+        screen,
+        stamp(now),
+        limit
+    ))
+    commit()
+
+    rows.sort(key=lambda r: (str(r["created_at"]), r["id"]))
+    return jsonify([
+        {k: json_safe(v) for k, v in dict(r).items()}
+        for r in rows
+    ])
+
+
+@app.route("/api/kitchen/stations", methods=["GET", "PUT"])
+@login_required(["admin", "kitchen"])
+def kitchen_stations():
+    """
+    GET: station -> menu categories. PUT (admin): replace the mapping with
+    {"stations": {"grill": ["Starters", "Tandoor"], "bar": ["Beverages"]}}.
+    Unmapped categories go to the default station. Applies to tickets
+    created after the change.
+    """
+    rid = session["restaurant_id"]
+
+    if request.method == "PUT":
+        if session["role"] != "admin":
+            return jsonify({"error": "Admin only"}), 403
+
+        data = request.get_json() or {}
+        stations = data.get("stations") if isinstance(data, dict) else None
+        if not isinstance(stations, dict):
+            return jsonify({"error": "stations must be an object"}), 400
+
+        rows = {}
+        for station, categories in stations.items():
+            station = str(station).strip()
+            if not station or not isinstance(categories, list):
+                return jsonify({"error": "Each station needs a list of categories"}), 400
+            for category in categories:
+                if not isinstance(category, str) or not category:
+                    return jsonify({"error": "Categories must be non-empty strings"}), 400
+                if category in rows:
+                    return jsonify({"error": f"Category '{category}' is on two stations"}), 400
+                rows[category] = station
+
+        execute(sql("DELETE FROM kitchen_stations WHERE restaurant_id=?"), (rid,))
+        for category, station in rows.items():
+            execute(sql("""
+                INSERT INTO kitchen_stations (restaurant_id, category, station)
+                VALUES (?, ?, ?)
+            """), (rid, category, station))
+
+        commit()
+        prices.invalidate(rid)
+
+    mapping = {}
+    for r in fetchall(sql("""
+        SELECT category, station
+        FROM kitchen_stations
+        WHERE restaurant_id=?
+        ORDER BY station, category
+    """), (rid,)):
+        mapping.setdefault(r["station"], []).append(r["category"])
+
+    categories = [r["category"] for r in fetchall(sql("""
+        SELECT DISTINCT category
+        FROM menu
+        WHERE restaurant_id=? AND category IS NOT NULL
+        ORDER BY category
+    """), (rid,))]
+
+    return jsonify({
+        "default": prices.DEFAULT_STATION,
+        "stations": mapping,
+        "categories": categories
+    })
+
+
 # ====== ADMIN PROFILE ========#
 @app.route("/admin/profile", methods=["GET", "POST"])
 @login_required("admin")
@@ -965,23 +1280,31 @@ def admin_profile():
     rid = session["restaurant_id"]
 
     if request.method == "POST":
+        try:
+            gst_rate_bp = billing.rate_bp(request.form.get("gst_rate") or "5")
+        except (ArithmeticError, ValueError):
+            return "GST rate must be a number between 0 and 100", 400
+
         execute(sql("""
             UPDATE restaurants
-            SET name = ?, gstin = ?, address = ?, phone = ?
+            SET name = ?, gstin = ?, address = ?, phone = ?, gst_rate_bp = ?
             WHERE id = ?
         """), (
             request.form["name"],
             request.form["gstin"],
             request.form["address"],
             request.form["phone"],
+            gst_rate_bp,
             rid
         ))
 
         commit()
+        bill_cache.bump_profile(rid)
+        shared_cache.invalidate("restaurants")
         return redirect("/admin/profile")
 
     restaurant = fetchone(sql("""
-        SELECT name, gstin, address, phone
+        SELECT name, gstin, address, phone, gst_rate_bp
         FROM restaurants
         WHERE id=?
     """), (rid,))
@@ -994,6 +1317,7 @@ def admin_profile():
 
 @app.route("/admin/orders/by-date")
 @login_required("admin")
+@replica_safe
 def orders_by_date():
     date = request.args.get("date")  # YYYY-MM-DD
     rid = session["restaurant_id"]
@@ -1003,23 +1327,19 @@ def orders_by_date():
 
     orders = fetchall(sql("""
         SELECT *
-        FROM orders
+        FROM orders_history
         WHERE restaurant_id=?
         AND DATE(created_at)=?
         ORDER BY id DESC
     """), (rid, date))
 
-    revenue_row = fetchone(sql("""
-        SELECT COALESCE(SUM(total), 0) AS revenue
-        FROM orders
-        WHERE restaurant_id=?
-        AND status='Closed'
-        AND DATE(created_at)=?
-    """), (rid, date))
+    revenue = round(sum(
+        float(o["total"] or 0) for o in orders if o["status"] == "Closed"
+    ), 2)
 
     return jsonify({
         "orders": [dict(o) for o in orders],
-        "revenue": revenue_row["revenue"],
+        "revenue": revenue,
         "count": len(orders)
     })
 
@@ -1055,7 +1375,7 @@ def create_kitchen_user():
     if fetchone(sql("SELECT id FROM users WHERE username=?"), (email,)):
         return jsonify({"error": "User already exists"}), 400
 
-    hashed_pw = generate_password_hash(password)
+    hashed_pw = hash_password(password)
 
     execute(sql("""
         INSERT INTO users (restaurant_id, username, password, role)
@@ -1066,15 +1386,9 @@ def create_kitchen_user():
         hashed_pw
     ))
 
-    otp = generate_otp()
-
-    execute(sql("""
-        UPDATE users
-        SET otp_code=?, otp_expires_at=NOW() + INTERVAL '10 minutes'
-        WHERE username=?
-    """), (otp, email))
-
     commit()
+
+    otp = issue_otp(email, "verify")
     send_otp_email(email, otp)
 
     return jsonify({"success": True, "message": "OTP sent to kitchen user"})
@@ -1163,7 +1477,7 @@ def api_add_menu():
 
     try:
         # ☁️ Upload image to Cloudinary
-        result = cloudinary.uploader.upload(
+        result = cloudinary_uploader().upload(
             image,
             folder="menu_images"
         )
@@ -1183,6 +1497,7 @@ def api_add_menu():
         ))
 
         commit()
+        prices.invalidate(session["restaurant_id"])
         return jsonify({"success": True})
 
     except Exception as e:
@@ -1202,6 +1517,7 @@ def toggle_menu(item_id):
         WHERE id=? AND restaurant_id=?
     """), (item_id, session["restaurant_id"]))
     commit()
+    prices.invalidate(session["restaurant_id"])
     return jsonify({"success": True})
 
 
@@ -1213,6 +1529,7 @@ def delete_menu(item_id):
         (item_id, session["restaurant_id"])
     )
     commit()
+    prices.invalidate(session["restaurant_id"])
     return jsonify({"success": True})
 
 @app.route("/api/menu/import", methods=["POST"])
@@ -1256,6 +1573,7 @@ def import_menu_template():
         inserted += 1
 
     commit()
+    prices.invalidate(restaurant_id)
 
     return jsonify({
         "success": True,
@@ -1293,6 +1611,7 @@ def update_menu_item(item_id):
     ))
 
     commit()
+    prices.invalidate(session["restaurant_id"])
     return jsonify({"success": True})
 
 # --------------------------------------------------
@@ -1301,22 +1620,107 @@ def update_menu_item(item_id):
 
 @app.route("/api/order/<int:order_id>/status", methods=["POST"])
 @login_required("kitchen")
+@admit_write
 def update_order_status(order_id):
     status = request.json.get("status")
 
     if status not in ["Preparing", "Ready", "Served"]:
         return jsonify({"error": "Invalid status"}), 400
 
-    execute(sql("""
+    # A Closed order stays closed: reopening it would close (and roll up) twice
+    rows = execute(sql("""
         UPDATE orders
         SET status=?
-        WHERE id=? AND restaurant_id=?
-    """), (status, order_id, session["restaurant_id"]))
+        WHERE id=? AND restaurant_id=? AND status!='Closed'
+        RETURNING table_no
+    """), (status, order_id, session["restaurant_id"])).fetchall()
 
     commit()
+    table_status.notify(session["restaurant_id"], *[r["table_no"] for r in rows])
     return jsonify({"success": True})
 
 
+KITCHEN_STATUSES = ["Preparing", "Ready", "Served"]
+STATUS_BATCH_LIMIT = 200
+
+
+def apply_status_batch(table):
+    """
+    Body: {"ids": [...], "status": "..."} or {"updates": [{"id", "status"}]}.
+    All valid updates go out as ONE set-based UPDATE; returns per-id results.
+    """
+    data = request.get_json() or {}
+    if not isinstance(data, dict):
+        return jsonify({"error": "Expected a JSON object"}), 400
+
+    updates = data.get("updates")
+    if updates is None:
+        ids = data.get("ids", [])
+        if not isinstance(ids, list):
+            return jsonify({"error": "ids must be a list"}), 400
+        updates = [{"id": i, "status": data.get("status")} for i in ids]
+
+    if not isinstance(updates, list) or not all(isinstance(u, dict) for u in updates):
+        return jsonify({"error": "updates must be a list of {id, status}"}), 400
+    if not updates:
+        return jsonify({"error": "No ids given"}), 400
+    if len(updates) > STATUS_BATCH_LIMIT:
+        return jsonify({"error": f"At most {STATUS_BATCH_LIMIT} ids per batch"}), 400
+
+    results, targets = {}, {}
+    for u in updates:
+        try:
+            item_id = int(u["id"])
+        except (KeyError, TypeError, ValueError):
+            return jsonify({"error": "Every update needs an integer id"}), 400
+
+        if u.get("status") in KITCHEN_STATUSES:
+            targets[item_id] = u["status"]
+        else:
+            results[item_id] = "invalid_status"
+
+    if targets:
+        cases = " ".join("WHEN ? THEN ?" for _ in targets)
+        marks = ",".join("?" for _ in targets)
+        params = [v for pair in targets.items() for v in pair]
+
+        # Closed orders are left alone (reported as not_found)
+        rows = fetchall(sql(f"""
+            UPDATE {table}
+            SET status = CASE id {cases} END
+            WHERE restaurant_id=? AND id IN ({marks}) AND status!='Closed'
+            RETURNING id, table_no
+        """), (*params, session["restaurant_id"], *targets))
+        commit()
+
+        updated = {r["id"] for r in rows}
+        table_status.notify(session["restaurant_id"], *[r["table_no"] for r in rows])
+        for item_id in targets:
+            results[item_id] = "updated" if item_id in updated else "not_found"
+
+    return jsonify({
+        "success": True,
+        "results": [
+            {"id": int(u["id"]), "result": results[int(u["id"])]}
+            for u in updates
+        ]
+    })
+
+
+@app.route("/api/kitchen/orders/status", methods=["POST"])
+@login_required("kitchen")
+@admit_write
+def update_order_status_batch():
+    return apply_status_batch("orders")
+
+
+@app.route("/api/kitchen/additions/status", methods=["POST"])
+@login_required("kitchen")
+@admit_write
+def update_addition_status_batch():
+    return apply_status_batch("order_additions")
+
+
 # --------------------------------------------------
 # QR GENERATION
 # --------------------------------------------------
@@ -1338,6 +1742,8 @@ def generate_single_qr(table_no):
     qr_dir = f"{QR_FOLDER}/{r['subdomain']}"
     os.makedirs(qr_dir, exist_ok=True)
 
+    import qrcode
+
     qr_path = f"{qr_dir}/table_{table_no}.png"
     url = f"{BASE_URL}/customer/{r['subdomain']}?table={table_no}"
     qrcode.make(url).save(qr_path)
@@ -1360,6 +1766,8 @@ def auto_generate_qr():
 
     zip_path = f"{qr_dir}/table_qrs.zip"
 
+    import qrcode
+
     with ZipFile(zip_path, "w") as zipf:
         for t in range(1, count + 1):
             url = f"{BASE_URL}/customer/{r['subdomain']}?table={t}"
@@ -1404,53 +1812,30 @@ def edit_order(order_id):
         subtotal=subtotal,
         cgst=cgst,
         sgst=sgst,
-        total=total
+        total=total,
+        gst_half=order["gst_rate_bp"] / 200
     )
 @app.route("/bill/<int:order_id>")
 @login_required("admin")
 def bill(order_id):
+    rid = session["restaurant_id"]
+    variant = "thermal" if request.args.get("thermal") in ("1", "true") else "full"
 
-    order = fetchone(
-        sql("""
-            SELECT 
-                o.*,
-                r.name AS restaurant_name,
-                r.gstin AS restaurant_gstin,
-                r.address AS restaurant_address,
-                r.phone AS restaurant_phone
-            FROM orders o
-            JOIN restaurants r ON o.restaurant_id = r.id
-            WHERE o.id=? AND o.restaurant_id=?
-        """),
-        (order_id, session["restaurant_id"])
-    )
+    # Closed bills never change: reprints skip the database entirely
+    version = bill_cache.profile_version(rid)
+    cached = bill_cache.get(rid, version, order_id, variant)
+    if cached is not None:
+        return cached
+
+    order = bill_order(order_id, rid)
 
     if not order:
         return "Order not found", 404
 
     # 🔥 CLOSE ORDER IF NOT CLOSED
     if order["status"] != "Closed":
-        execute(sql("""
-            UPDATE orders
-            SET status='Closed'
-            WHERE id=? AND restaurant_id=?
-        """), (order_id, session["restaurant_id"]))
-        commit()
-
-        order = fetchone(
-            sql("""
-                SELECT 
-                    o.*,
-                    r.name AS restaurant_name,
-                    r.gstin AS restaurant_gstin,
-                    r.address AS restaurant_address,
-                    r.phone AS restaurant_phone
-                FROM orders o
-                JOIN restaurants r ON o.restaurant_id = r.id
-                WHERE o.id=? AND o.restaurant_id=?
-            """),
-            (order_id, session["restaurant_id"])
-        )
+        mark_order_closed(order_id, session["restaurant_id"])
+        order = bill_order(order_id, rid)
 
     # ✅ SAFE PARSE ITEMS (grouping only for display)
     raw_items = (
@@ -1478,75 +1863,124 @@ def bill(order_id):
     sgst = float(order["sgst"])
     total = float(order["total"])
 
-    return render_template(
-        "bill.html",
-        order=order,
-        items=items,
-        subtotal=subtotal,
-        cgst=cgst,
-        sgst=sgst,
-        total=total,
-        restaurant_name=order["restaurant_name"],
-        gstin=order["restaurant_gstin"],
-        address=order["restaurant_address"],
-        phone=order["restaurant_phone"]
+    if variant == "thermal":
+        html = render_template(
+            "bill_thermal.html",
+            order=dict(
+                order,
+                name=order["restaurant_name"],
+                gstin=order["restaurant_gstin"],
+                address=order["restaurant_address"],
+                phone=order["restaurant_phone"]
+            ),
+            items=items,
+            subtotal=subtotal,
+            cgst=cgst,
+            sgst=sgst,
+            total=total,
+            gst_half=order["gst_rate_bp"] / 200
+        )
+    else:
+        html = render_template(
+            "bill.html",
+            order=order,
+            items=items,
+            subtotal=subtotal,
+            cgst=cgst,
+            sgst=sgst,
+            total=total,
+            gst_half=order["gst_rate_bp"] / 200,
+            restaurant_name=order["restaurant_name"],
+            gstin=order["restaurant_gstin"],
+            address=order["restaurant_address"],
+            phone=order["restaurant_phone"]
+        )
+
+    if order["status"] == "Closed":
+        # Writers invalidate after they commit, so a change that raced
+        # with this render either shows up in the re-read or removes the
+        # file itself
+        bill_cache.put(rid, version, order_id, variant, html)
+        if bill_order(order_id, rid) != order:
+            bill_cache.invalidate(rid, order_id)
+
+    return html
+
+
+def bill_order(order_id, restaurant_id):
+    """
+    The order with its restaurant's bill header, as a dict (or None)
+    """
+    order = fetchone(
+        sql("""
+            SELECT 
+                o.*,
+                r.name AS restaurant_name,
+                r.gstin AS restaurant_gstin,
+                r.address AS restaurant_address,
+                r.phone AS restaurant_phone
+            FROM orders_history o
+            JOIN restaurants r ON o.restaurant_id = r.id
+            WHERE o.id=? AND o.restaurant_id=?
+        """),
+        (order_id, restaurant_id)
     )
+    if not order:
+        return None
+
+    order = dict(order)
+    order.pop("rolled_up", None)   # set by the rollup worker; not on the bill
+    return order
+
+
 @app.route("/api/order/<int:order_id>/remove-item", methods=["POST"])
 @login_required("admin")
+@admit_write
 def remove_item_from_order(order_id):
     data = request.json
     item_name = data.get("item_name")
 
-    order = fetchone(sql("""
-        SELECT items
-        FROM orders
-        WHERE id=? AND restaurant_id=?
-    """), (order_id, session["restaurant_id"]))
+    # 🔒 Items are rewritten whole, so hold the row until commit
+    with transaction() as db:
+        order = fetchone(sql(f"""
+            SELECT table_no, items
+            FROM orders
+            WHERE id=? AND restaurant_id=?{FOR_UPDATE}
+        """), (order_id, session["restaurant_id"]), db)
 
-    if not order:
-        return jsonify({"error": "Order not found"}), 404
+        if not order:
+            return jsonify({"error": "Order not found"}), 404
 
-    items = order["items"]
-    if isinstance(items, str):
-        items = json.loads(items or "[]")
-    if not items:
-        items = []
+        items = order["items"]
+        if isinstance(items, str):
+            items = json.loads(items or "[]")
+        if not items:
+            items = []
 
-    # 🔥 REMOVE ONLY ONE ITEM
-    removed = False
-    new_items = []
+        # 🔥 REMOVE ONLY ONE ITEM
+        removed = None
+        new_items = []
 
-    for i in items:
-        if i["name"] == item_name and not removed:
-            removed = True
-            continue
-        new_items.append(i)
+        for i in items:
+            if i["name"] == item_name and removed is None:
+                removed = i
+                continue
+            new_items.append(i)
 
-    if not removed:
-        return jsonify({"error": "Item not found"}), 400
+        if removed is None:
+            return jsonify({"error": "Item not found"}), 400
 
-    # 🔥 Recalculate FULL BILL
-    subtotal, cgst, sgst, total = calculate_bill(new_items)
+        execute(sql("""
+            UPDATE orders
+            SET items=?
+            WHERE id=? AND restaurant_id=?
+        """), (json.dumps(new_items), order_id, session["restaurant_id"]), db)
 
-    execute(sql("""
-        UPDATE orders
-        SET items=?,
-            subtotal=?,
-            cgst=?,
-            sgst=?,
-            total=?
-        WHERE id=? AND restaurant_id=?
-    """), (
-        json.dumps(new_items),
-        subtotal,
-        cgst,
-        sgst,
-        total,
-        order_id,
-        session["restaurant_id"]
-    ))
+        # ➖ Running total: subtract just this line
+        add_to_subtotal(order_id, -billing.line_paise(removed), db)
 
-    commit()
+    bill_cache.invalidate(session["restaurant_id"], order_id)
+    table_status.notify(session["restaurant_id"], order["table_no"])
     return jsonify({"success": True})
 
 @app.route("/api/orders")
@@ -1573,18 +2007,372 @@ def api_orders():
 def kitchen_orders():
     rid = session["restaurant_id"]
 
-    orders = fetchall(sql("""
-        SELECT *
-        FROM orders
-        WHERE restaurant_id=?
-        AND status NOT IN ('Served', 'Closed')
-        ORDER BY created_at ASC
-    """), (rid,))
+    station = request.args.get("station")
 
-    return jsonify([
-        {k: json_safe(v) for k, v in dict(o).items()}
-        for o in orders
-    ])
+    if not station:
+        orders = fetchall(sql("""
+            SELECT *
+            FROM orders
+            WHERE restaurant_id=?
+            AND status!='Closed' AND status!='Served'
+            ORDER BY created_at ASC
+        """, name="kitchen_orders"), (rid,))
+
+        return jsonify([{k: json_safe(v) for k, v in dict(o).items()} for o in orders])
+
+    # 🍳 A station screen only sees its own lines (and orders that have
+    # any), sliced in SQL over the open-orders index
+    line_station = f"COALESCE({json_field('line', 'station')}, ?)"
+    orders = fetchall(sql(f"""
+        SELECT o.*, (
+            SELECT {json_group("line")}
+            FROM {json_elements("o.items", "line")}
+            WHERE {line_station} = ?
+        ) AS station_items
+        FROM orders o
+        WHERE o.restaurant_id=?
+        AND o.status!='Closed' AND o.status!='Served'
+        AND EXISTS (
+            SELECT 1
+            FROM {json_elements("o.items", "line")}
+            WHERE {line_station} = ?
+        )
+        ORDER BY o.created_at ASC
+    """, name="kitchen_orders_station"), (
+        prices.DEFAULT_STATION, station,
+        rid,
+        prices.DEFAULT_STATION, station
+    ))
+
+    sliced = []
+    for o in orders:
+        o = {k: json_safe(v) for k, v in dict(o).items()}
+        items = o.pop("station_items")
+        o["items"] = items if isinstance(items, list) else json.loads(items)
+        sliced.append(o)
+
+    return jsonify(sliced)
+
+# --------------------------------------------------
+# REPORTS
+# --------------------------------------------------
+
+REPORT_MAX_DAYS = 366
+
+
+def report_range(max_days=REPORT_MAX_DAYS):
+    """
+    Parse ?from=YYYY-MM-DD&to=YYYY-MM-DD (both default to today)
+    """
+    today = date.today()
+
+    try:
+        start = date.fromisoformat(request.args.get("from") or today.isoformat())
+        end = date.fromisoformat(request.args.get("to") or start.isoformat())
+    except ValueError:
+        return None, None, "Dates must be YYYY-MM-DD"
+
+    if end < start:
+        return None, None, "'to' must not be before 'from'"
+
+    if max_days and (end - start).days >= max_days:
+        return None, None, f"Range cannot exceed {max_days} days"
+
+    return start, end, None
+
+
+@app.route("/api/daily-report", methods=["GET"])
+@login_required("admin")
+@replica_safe
+def daily_report():
+    import ai
+
+    return jsonify(ai.daily_report(session["restaurant_id"]))
+
+
+@app.route("/api/reports/summary")
+@login_required("admin")
+@replica_safe
+def report_summary():
+    import analytics
+
+    start, end, error = report_range()
+    if error:
+        return jsonify({"error": error}), 400
+
+    cols = analytics.load_orders(session["restaurant_id"], start, end)
+
+    return jsonify({
+        "from": start.isoformat(),
+        "to": end.isoformat(),
+        **analytics.summary(cols),
+        "top_dishes": analytics.top_dishes(cols, limit=5)
+    })
+
+
+@app.route("/api/reports/revenue-by-hour")
+@login_required("admin")
+@replica_safe
+def report_revenue_by_hour():
+    import analytics
+
+    start, end, error = report_range()
+    if error:
+        return jsonify({"error": error}), 400
+
+    cols = analytics.load_orders(session["restaurant_id"], start, end)
+    return jsonify(analytics.revenue_by_hour(cols))
+
+
+@app.route("/api/reports/top-dishes")
+@login_required("admin")
+@replica_safe
+def report_top_dishes():
+    import analytics
+
+    start, end, error = report_range()
+    if error:
+        return jsonify({"error": error}), 400
+
+    by = request.args.get("by", "qty")
+    if by not in ("qty", "revenue"):
+        return jsonify({"error": "by must be qty or revenue"}), 400
+
+    limit = min(max(request.args.get("limit", 10, type=int), 1), 100)
+
+    return jsonify(analytics.item_totals(
+        session["restaurant_id"], start, end, limit=limit, by=by
+    ))
+
+
+@app.route("/api/reports/items")
+@login_required("admin")
+@replica_safe
+def report_items():
+    import analytics
+
+    start, end, error = report_range()
+    if error:
+        return jsonify({"error": error}), 400
+
+    return jsonify(analytics.item_totals(session["restaurant_id"], start, end))
+
+
+@app.route("/api/reports/tables")
+@login_required("admin")
+@replica_safe
+def report_tables():
+    import analytics
+
+    start, end, error = report_range()
+    if error:
+        return jsonify({"error": error}), 400
+
+    cols = analytics.load_orders(session["restaurant_id"], start, end)
+    return jsonify(analytics.table_turnover(cols))
+
+
+# Streams any range; memory stays flat however many orders match
+@app.route("/admin/export")
+@login_required("admin")
+def export_orders():
+    start, end, error = report_range(max_days=None)
+    if error:
+        return jsonify({"error": error}), 400
+
+    fmt = request.args.get("format", "csv")
+    if fmt not in exports.FORMATS:
+        return jsonify({"error": "format must be csv or ndjson"}), 400
+
+    # Accountants want settled bills; ?status=all includes open orders
+    status = request.args.get("status", "Closed")
+    rows = exports.orders(
+        session["restaurant_id"], start, end,
+        status=None if status == "all" else status
+    )
+    body = exports.to_csv(rows) if fmt == "csv" else exports.to_ndjson(rows)
+
+    filename = f"orders_{start.isoformat()}_{end.isoformat()}.{fmt}"
+    return Response(
+        stream_with_context(body),
+        mimetype=exports.FORMATS[fmt],
+        headers={
+            "Content-Disposition": f"attachment; filename={filename}",
+            "Cache-Control": "no-store"
+        }
+    )
+
+# Charts read only the sales rollup, never the orders table
+
+@app.route("/api/charts/today")
+@login_required("admin")
+@replica_safe
+def chart_today():
+    today = datetime.utcnow().date()
+
+    return jsonify({
+        "date": today.isoformat(),
+        "bucket_minutes": rollups.BUCKET_MINUTES,
+        "series": rollups.day_series(session["restaurant_id"], today)
+    })
+
+
+@app.route("/api/charts/week-over-week")
+@login_required("admin")
+@replica_safe
+def chart_week_over_week():
+    today = datetime.utcnow().date()
+    start = today - timedelta(days=13)
+
+    totals = rollups.daily_totals(session["restaurant_id"], start, today)
+
+    days = []
+    for offset in range(7):
+        day = today - timedelta(days=6 - offset)
+        prev = day - timedelta(days=7)
+        orders, revenue = totals.get(day.isoformat(), (0, 0.0))
+        prev_orders, prev_revenue = totals.get(prev.isoformat(), (0, 0.0))
+
+        days.append({
+            "date": day.isoformat(),
+            "orders": orders,
+            "revenue": revenue,
+            "previous_date": prev.isoformat(),
+            "previous_orders": prev_orders,
+            "previous_revenue": prev_revenue
+        })
+
+    return jsonify(days)
+
+
+@app.cli.command("rebuild-rollups")
+@click.option("--restaurant", type=int, default=None, help="Only this restaurant id")
+@click.option("--check", is_flag=True, help="Report mismatches without rebuilding")
+def rebuild_rollups_command(restaurant, check):
+    """Rebuild (or verify) the sales rollup from closed orders."""
+    if restaurant is not None:
+        tenants = [restaurant]
+    else:
+        tenants = restaurant_ids() if TENANT_SHARDED else [None]
+
+    if check:
+        mismatches = []
+        for rid in tenants:
+            use_tenant(rid)
+            mismatches += rollups.check(rid)
+        for m in mismatches:
+            click.echo(json.dumps(m))
+        click.echo(f"{len(mismatches)} mismatched bucket(s)")
+        if mismatches:
+            raise SystemExit(1)
+        return
+
+    buckets = lines = 0
+    for rid in tenants:
+        use_tenant(rid)
+        b, l = rollups.rebuild(rid)
+        commit()
+        buckets, lines = buckets + b, lines + l
+
+    click.echo(f"Rebuilt {buckets} bucket(s), {lines} item row(s)")
+
+
+@app.cli.command("verify-totals")
+@click.option("--fix", is_flag=True, help="Rewrite mismatched totals from the items")
+def verify_totals_command(fix):
+    """Recompute every live order's totals from its items and compare."""
+    checked = bad = 0
+    for rid in (restaurant_ids() if TENANT_SHARDED else [None]):
+        use_tenant(rid)
+        orders = fetchall(sql("""
+            SELECT id, restaurant_id, items, gst_rate_bp,
+                   subtotal_paise, subtotal, cgst, sgst, total
+            FROM orders
+        """))
+
+        for order in orders:
+            checked += 1
+            mismatch = billing.check(order)
+            if mismatch is None:
+                continue
+
+            bad += 1
+            click.echo(json.dumps({"order_id": order["id"], **mismatch}))
+            if fix:
+                execute(sql("""
+                    UPDATE orders
+                    SET subtotal_paise=?, subtotal=?, cgst=?, sgst=?, total=?
+                    WHERE id=?
+                """), (*money_columns(mismatch["expected"][0], order["gst_rate_bp"]),
+                       order["id"]))
+                bill_cache.invalidate(order["restaurant_id"], order["id"])
+
+        if fix:
+            commit()
+
+    click.echo(f"{bad} of {checked} order(s) mismatched" + (" (fixed)" if fix and bad else ""))
+    if bad and not fix:
+        raise SystemExit(1)
+
+
+@app.cli.command("split-tenants")
+@click.option("--drop-source", is_flag=True,
+              help="Drop the operational tables from the catalog afterwards")
+def split_tenants_command(drop_source):
+    """Split restaurant.db into per-restaurant files (SQLITE_SHARDING=tenant)."""
+    restaurants, copied = split_tenants(drop_source=drop_source)
+
+    click.echo(f"Split {restaurants} restaurant(s) into {TENANT_DIR}")
+    for table, count in copied.items():
+        click.echo(f"  {table}: {count} row(s)")
+
+    if not TENANT_SHARDED:
+        click.echo("Set SQLITE_SHARDING=tenant to serve from the tenant files")
+
+
+@app.cli.command("archive-orders")
+@click.option("--days", type=int, default=archive.ARCHIVE_AFTER_DAYS,
+              help="Archive closed orders older than this many days")
+def archive_orders_command(days):
+    """Move old closed orders out of the hot tables (run daily)."""
+    pending = 0
+    for rid in (restaurant_ids() if TENANT_SHARDED else [None]):
+        use_tenant(rid)
+        pending += rollups.roll_up_pending(rid)
+    click.echo(f"Rolled up {pending} closed order(s) missed by the close handler")
+
+    if DB_TYPE == "postgres":
+        if not archive.is_partitioned():
+            click.echo("orders is not partitioned yet; run `flask partition-orders`")
+            return
+
+        ensured, stuck = archive.ensure_partitions()
+        click.echo(f"Ensured {len(ensured)} monthly partition(s) of orders")
+        for month, error in stuck.items():
+            click.echo(f"Could not create the {month} partition: {error}", err=True)
+        if stuck:
+            raise SystemExit(1)
+        return
+
+    moved = 0
+    for rid in (restaurant_ids() if TENANT_SHARDED else [None]):
+        use_tenant(rid)
+        moved += archive.archive_closed_orders(get_db(), days)
+
+    click.echo(f"Archived {moved} closed order(s) older than {days} day(s)")
+
+
+@app.cli.command("partition-orders")
+def partition_orders_command():
+    """Convert the Postgres orders table to monthly range partitions."""
+    if DB_TYPE != "postgres":
+        click.echo("Partitioning is Postgres-only; use `flask archive-orders` on SQLite")
+        return
+
+    if not archive.partition_orders():
+        click.echo("orders is already partitioned")
+    for name in archive.partitions():
+        click.echo(f"  {name}")
 
 # --------------------------------------------------
 # ROOT
@@ -1600,5 +2388,6 @@ def home():
 #     app.run()
 
 if __name__ == "__main__":
+    init_db()
     app.run(host="0.0.0.0", port=int(os.getenv("PORT", 5000)))
 
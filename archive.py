@@ -0,0 +1,243 @@
+import os
+from datetime import datetime, timedelta
+
+import psycopg2
+
+from db import DATABASE_URL, common_columns, fetchall, fetchone, sql
+
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "90"))
+ARCHIVE_BATCH = int(os.getenv("ARCHIVE_BATCH", "1000"))
+PARTITION_MONTHS_AHEAD = int(os.getenv("PARTITION_MONTHS_AHEAD", "3"))
+
+# --------------------------------------------------
+# SQLITE: MOVE OLD CLOSED ORDERS TO THE ARCHIVE
+# --------------------------------------------------
+
+def archive_closed_orders(db, days=ARCHIVE_AFTER_DAYS):
+    """
+    Move Closed orders created more than `days` ago, with their kitchen
+    additions, into the archive tables. Commits per batch so the writer
+    lock is only held briefly. Returns the number of orders moved.
+    """
+    cutoff = (datetime.utcnow() - timedelta(days=days)).strftime("%Y-%m-%d %H:%M:%S")
+    order_cols = ", ".join(common_columns(db, "orders", "orders_archive"))
+    addition_cols = ", ".join(
+        common_columns(db, "order_additions", "order_additions_archive")
+    )
+
+    moved = 0
+    while True:
+        ids = [r[0] for r in db.execute("""
+            SELECT id FROM orders
+            WHERE status='Closed' AND created_at < ?
+            ORDER BY id
+            LIMIT ?
+        """, (cutoff, ARCHIVE_BATCH)).fetchall()]
+
+        if not ids:
+            return moved
+
+        marks = ",".join("?" for _ in ids)
+
+        db.execute("BEGIN IMMEDIATE")
+        db.execute(f"""
+            INSERT OR IGNORE INTO orders_archive ({order_cols})
+            SELECT {order_cols} FROM orders WHERE id IN ({marks})
+        """, ids)
+        db.execute(f"""
+            INSERT INTO order_additions_archive ({addition_cols})
+            SELECT {addition_cols} FROM order_additions WHERE order_id IN ({marks})
+        """, ids)
+        db.execute(f"DELETE FROM order_additions WHERE order_id IN ({marks})", ids)
+        db.execute(f"DELETE FROM orders WHERE id IN ({marks})", ids)
+        db.execute("COMMIT")
+
+        moved += len(ids)
+
+
+# --------------------------------------------------
+# POSTGRES: MONTHLY RANGE PARTITIONS
+# --------------------------------------------------
+
+def _month(d):
+    return d.replace(day=1)
+
+
+def _next_month(d):
+    return (d.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+
+def ensure_partitions(months_ahead=PARTITION_MONTHS_AHEAD):
+    """
+    Create monthly partitions of orders from this month through
+    `months_ahead` months from now (run from the daily job). Returns
+    (partitions checked, {month: error} for any that could not be made).
+    """
+    month = _month(datetime.utcnow().date())
+    last = _month(datetime.utcnow().date())
+    for _ in range(months_ahead):
+        last = _next_month(last)
+
+    db = psycopg2.connect(DATABASE_URL)
+    try:
+        ensured, stuck = [], {}
+        while month <= last:
+            try:
+                ensured.append(_ensure_partition(db, month))
+            except psycopg2.Error as e:
+                stuck[f"{month:%Y-%m}"] = str(e).strip()
+            month = _next_month(month)
+        return ensured, stuck
+    finally:
+        db.close()
+
+
+def _ensure_partition(db, month):
+    """
+    One month's partition, in one transaction. Rows already in
+    orders_default for that month (the daily job was skipped for a while)
+    would make CREATE ... PARTITION OF fail, so the default partition is
+    detached, those rows moved into the new partition, and reattached.
+    """
+    name = f"orders_p{month:%Y%m}"
+    start, end = month, _next_month(month)
+
+    with db, db.cursor() as c:
+        c.execute("SELECT to_regclass(%s), to_regclass('orders_default')", (name,))
+        exists, default = c.fetchone()
+        if exists:
+            return name
+
+        moving = False
+        if default:
+            c.execute("""
+                SELECT EXISTS (
+                    SELECT 1 FROM orders_default
+                    WHERE created_at >= %s AND created_at < %s
+                )
+            """, (start, end))
+            moving = c.fetchone()[0]
+
+        if moving:
+            c.execute("ALTER TABLE orders DETACH PARTITION orders_default")
+
+        c.execute(f"""
+            CREATE TABLE {name}
+            PARTITION OF orders
+            FOR VALUES FROM ('{start}') TO ('{end}')
+        """)
+
+        if moving:
+            c.execute("""
+                WITH moved AS (
+                    DELETE FROM orders_default
+                    WHERE created_at >= %s AND created_at < %s
+                    RETURNING *
+                )
+                INSERT INTO orders SELECT * FROM moved
+            """, (start, end))
+            c.execute("ALTER TABLE orders ATTACH PARTITION orders_default DEFAULT")
+
+    return name
+
+
+def is_partitioned():
+    return fetchone(sql("""
+        SELECT relkind FROM pg_class
+        WHERE oid = 'orders'::regclass
+    """))["relkind"] == "p"
+
+
+def partition_orders():
+    """
+    One-time conversion of a plain Postgres `orders` table into one
+    range-partitioned by created_at, in a single transaction
+    """
+    db = psycopg2.connect(DATABASE_URL)
+    try:
+        return _partition_orders(db)
+    finally:
+        db.close()
+
+
+def _partition_orders(db):
+    with db, db.cursor() as c:
+        c.execute("""
+            SELECT relkind FROM pg_class
+            WHERE oid = 'orders'::regclass
+        """)
+        if c.fetchone()[0] == "p":
+            return False
+
+        # A foreign key cannot target (id) alone once the key includes
+        # created_at; additions keep order_id and restaurant_id checks in SQL
+        c.execute("""
+            SELECT conrelid::regclass, conname
+            FROM pg_constraint
+            WHERE confrelid = 'orders'::regclass AND contype = 'f'
+        """)
+        for table, constraint in c.fetchall():
+            c.execute(f'ALTER TABLE {table} DROP CONSTRAINT "{constraint}"')
+
+        c.execute("DROP VIEW IF EXISTS orders_history")
+        c.execute("UPDATE orders SET created_at = NOW() WHERE created_at IS NULL")
+        c.execute("ALTER TABLE orders RENAME TO orders_legacy")
+
+        c.execute("""
+            CREATE TABLE orders (LIKE orders_legacy INCLUDING DEFAULTS)
+            PARTITION BY RANGE (created_at)
+        """)
+
+        c.execute("SELECT pg_get_serial_sequence('orders_legacy', 'id')")
+        sequence = c.fetchone()[0]
+        c.execute("""
+            SELECT attidentity FROM pg_attribute
+            WHERE attrelid = 'orders_legacy'::regclass AND attname = 'id'
+        """)
+        if c.fetchone()[0]:
+            c.execute("ALTER TABLE orders ALTER COLUMN id ADD GENERATED BY DEFAULT AS IDENTITY")
+        elif sequence:
+            c.execute(f"ALTER SEQUENCE {sequence} OWNED BY orders.id")
+
+        c.execute("SELECT MIN(created_at)::date FROM orders_legacy")
+        first = c.fetchone()[0] or datetime.utcnow().date()
+
+        month, last = _month(first), _month(datetime.utcnow().date())
+        for _ in range(PARTITION_MONTHS_AHEAD):
+            last = _next_month(last)
+        while month <= last:
+            c.execute(f"""
+                CREATE TABLE orders_p{month:%Y%m}
+                PARTITION OF orders
+                FOR VALUES FROM ('{month}') TO ('{_next_month(month)}')
+            """)
+            month = _next_month(month)
+        c.execute("CREATE TABLE orders_default PARTITION OF orders DEFAULT")
+
+        c.execute("INSERT INTO orders SELECT * FROM orders_legacy")
+        c.execute("""
+            SELECT setval(pg_get_serial_sequence('orders', 'id'),
+                          COALESCE((SELECT MAX(id) FROM orders), 1))
+        """)
+
+        # Constraint/index names are freed once the legacy table is gone
+        c.execute("DROP TABLE orders_legacy")
+        c.execute("ALTER TABLE orders ADD PRIMARY KEY (id, created_at)")
+        c.execute("CREATE INDEX idx_orders_restaurant_created ON orders(restaurant_id, created_at)")
+        c.execute("CREATE INDEX idx_orders_restaurant_status ON orders(restaurant_id, status)")
+        c.execute("CREATE INDEX idx_orders_open ON orders(restaurant_id, table_no) WHERE status != 'Closed'")
+        c.execute("CREATE INDEX idx_orders_items ON orders USING GIN (items jsonb_path_ops)")
+
+        c.execute("CREATE VIEW orders_history AS SELECT * FROM orders")
+
+    return True
+
+
+def partitions():
+    return [r["relname"] for r in fetchall(sql("""
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'orders'::regclass
+        ORDER BY c.relname
+    """))]
@@ -0,0 +1,120 @@
+"""
+Fingerprinted static assets, no build step.
+
+At startup every file under static/ (except user uploads and generated
+QR codes) is content-hashed, and url_for("static", filename=...) emits
+e.g. js/kitchen.3f2a1b9c0d12.js. Hashed URLs never change content, so
+they are served with a one-year immutable Cache-Control and tablets stop
+revalidating them. Text assets are gzip- (and, with the optional
+`brotli` package, br-) compressed once in memory and served to clients
+that accept it.
+
+Anything else under /static is served from disk as before; a hash from
+a previous deploy gets today's file with a short max-age.
+"""
+import os
+import re
+import gzip
+import hashlib
+import mimetypes
+
+from flask import request, send_from_directory, current_app
+
+try:
+    import brotli
+except ImportError:   # optional; gzip only
+    brotli = None
+
+ASSET_FINGERPRINT = os.getenv("ASSET_FINGERPRINT", "on") == "on"
+ASSET_MAX_AGE = 365 * 24 * 3600
+STALE_MAX_AGE = 300
+
+# User content changes without its name changing
+SKIP_DIRS = ("uploads", "qr")
+COMPRESSIBLE = (".js", ".css", ".svg", ".json", ".txt", ".html", ".map")
+
+_HASHED_NAME = re.compile(r"^(.*)\.[0-9a-f]{12}(\.[^./]+)$")
+
+manifest = {}   # "js/kitchen.js" -> "js/kitchen.3f2a1b9c0d12.js"
+_assets = {}    # hashed name -> (original name, etag, {"br": bytes, "gzip": bytes})
+
+
+def _hashed(name, digest):
+    root, ext = os.path.splitext(name)
+    return f"{root}.{digest}{ext}"
+
+
+def build(static_folder):
+    manifest.clear()
+    _assets.clear()
+
+    for folder, dirs, files in os.walk(static_folder):
+        if folder == static_folder:
+            dirs[:] = [d for d in dirs if d not in SKIP_DIRS]
+
+        for file in files:
+            path = os.path.join(folder, file)
+            name = os.path.relpath(path, static_folder).replace(os.sep, "/")
+            with open(path, "rb") as f:
+                data = f.read()
+
+            digest = hashlib.sha256(data).hexdigest()[:12]
+            hashed = _hashed(name, digest)
+
+            encoded = {}
+            if name.endswith(COMPRESSIBLE):
+                if brotli is not None:
+                    encoded["br"] = brotli.compress(data, quality=11)
+                encoded["gzip"] = gzip.compress(data, compresslevel=9, mtime=0)
+                encoded = {k: v for k, v in encoded.items() if len(v) < len(data)}
+
+            manifest[name] = hashed
+            _assets[hashed] = (name, digest, encoded)
+
+
+def serve_static(filename):
+    asset = _assets.get(filename)
+
+    if asset is None:
+        match = _HASHED_NAME.match(filename)
+        if match is None:
+            return send_from_directory(current_app.static_folder, filename)
+
+        # A fingerprint from an older deploy: serve today's file, briefly
+        return send_from_directory(
+            current_app.static_folder, match.group(1) + match.group(2),
+            max_age=STALE_MAX_AGE
+        )
+
+    name, digest, encoded = asset
+    encoding = next(
+        (e for e in ("br", "gzip") if e in encoded and e in request.accept_encodings),
+        None
+    )
+
+    if encoding:
+        response = current_app.response_class(
+            encoded[encoding],
+            mimetype=mimetypes.guess_type(name)[0] or "application/octet-stream"
+        )
+        response.headers["Content-Encoding"] = encoding
+    else:
+        response = send_from_directory(current_app.static_folder, name)
+
+    response.set_etag(f"{digest}-{encoding or 'identity'}")
+    response.headers["Cache-Control"] = f"public, max-age={ASSET_MAX_AGE}, immutable"
+    response.vary.add("Accept-Encoding")
+    return response.make_conditional(request)
+
+
+def init_app(app):
+    if not ASSET_FINGERPRINT:
+        return
+
+    build(app.static_folder)
+    app.view_functions["static"] = serve_static
+
+    @app.url_defaults
+    def fingerprint_static(endpoint, values):
+        if endpoint == "static" and "filename" in values:
+            values["filename"] = manifest.get(values["filename"], values["filename"])
@@ -0,0 +1,113 @@
+"""
+Order burst: N tables each POST /order at once, with and without
+SQLITE_GROUP_COMMIT.
+
+    python benchmarks/bench_group_commit.py --tables 50 --orders 20
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import threading
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run_burst(tables, orders):
+    sys.path.insert(0, ROOT)
+    from app import app
+    from db import init_db, SQLITE_PATH
+    import sqlite3
+
+    init_db()
+    db = sqlite3.connect(SQLITE_PATH)
+    db.execute("INSERT INTO restaurants (name, subdomain) VALUES ('Bench', 'bench')")
+    rid = db.execute("SELECT id FROM restaurants WHERE subdomain='bench'").fetchone()[0]
+    db.execute("INSERT INTO menu (restaurant_id, name, price) VALUES (?, 'Naan', 40)", (rid,))
+    item_id = db.execute("SELECT id FROM menu WHERE restaurant_id=?", (rid,)).fetchone()[0]
+    db.commit()
+    db.close()
+
+    barrier = threading.Barrier(tables)
+    latencies, errors = [], []
+    lock = threading.Lock()
+
+    def table(no):
+        client = app.test_client()
+        payload = {
+            "restaurant_id": rid,
+            "table": no,
+            "customer_name": "Bench",
+            "customer_phone": "9999999999",
+            "items": [{"id": item_id, "name": "Naan", "price": 40, "qty": 2}]
+        }
+        barrier.wait()
+
+        for _ in range(orders):
+            t0 = time.perf_counter()
+            resp = client.post("/order", json=payload)
+            elapsed = time.perf_counter() - t0
+
+            with lock:
+                latencies.append(elapsed)
+                if resp.status_code != 200:
+                    errors.append(resp.status_code)
+
+    threads = [threading.Thread(target=table, args=(n,)) for n in range(1, tables + 1)]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - started
+
+    latencies.sort()
+    pct = lambda p: latencies[min(int(len(latencies) * p), len(latencies) - 1)] * 1000
+
+    print(json.dumps({
+        "requests": len(latencies),
+        "errors": len(errors),
+        "wall_s": round(wall, 3),
+        "req_per_s": round(len(latencies) / wall, 1),
+        "p50_ms": round(pct(0.50), 2),
+        "p95_ms": round(pct(0.95), 2),
+        "p99_ms": round(pct(0.99), 2),
+        "max_ms": round(latencies[-1] * 1000, 2)
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tables", type=int, default=50)
+    parser.add_argument("--orders", type=int, default=20)
+    parser.add_argument("--child", action="store_true")
+    args = parser.parse_args()
+
+    if args.child:
+        run_burst(args.tables, args.orders)
+        return
+
+    for label, group_commit in (("per-request commit", "0"), ("group commit", "1")):
+        with tempfile.TemporaryDirectory() as tmp:
+            env = dict(
+                os.environ,
+                DB_TYPE="sqlite",
+                SQLITE_PATH=os.path.join(tmp, "bench.db"),
+                SQLITE_GROUP_COMMIT=group_commit,
+                ADMISSION_CONTROL="off",
+                EVENT_BACKEND="inline"
+            )
+            out = subprocess.run(
+                [sys.executable, __file__, "--child",
+                 "--tables", str(args.tables), "--orders", str(args.orders)],
+                env=env, capture_output=True, text=True, check=True
+            ).stdout.strip().splitlines()[-1]
+
+        print(f"{label:20s} {out}")
+
+
+if __name__ == "__main__":
+    main()
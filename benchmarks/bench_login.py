@@ -0,0 +1,116 @@
+"""
+Shift-change login burst: N users POST /login at once. Reports logins/s
+and logins/s per core for each PASSWORD_HASH_METHOD.
+
+    python benchmarks/bench_login.py --users 32 --logins 4
+    python benchmarks/bench_login.py --methods pbkdf2:sha256:600000 scrypt:32768:8:1
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import threading
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run_burst(users, logins):
+    sys.path.insert(0, ROOT)
+    from app import app
+    from db import init_db, SQLITE_PATH
+    from passwords import hash_password
+    import sqlite3
+
+    init_db()
+    hashed = hash_password("shift-change")
+    db = sqlite3.connect(SQLITE_PATH)
+    db.execute("INSERT INTO restaurants (name, subdomain) VALUES ('Bench', 'bench')")
+    db.executemany(
+        "INSERT INTO users (restaurant_id, username, password, role, is_verified) "
+        "VALUES (1, ?, ?, 'kitchen', 1)",
+        [(f"cook{n}@bench", hashed) for n in range(users)]
+    )
+    db.commit()
+    db.close()
+
+    barrier = threading.Barrier(users)
+    latencies, errors = [], []
+    lock = threading.Lock()
+
+    def user(n):
+        client = app.test_client()
+        barrier.wait()
+
+        for _ in range(logins):
+            t0 = time.perf_counter()
+            resp = client.post("/login", data={
+                "username": f"cook{n}@bench", "password": "shift-change"
+            })
+            elapsed = time.perf_counter() - t0
+
+            with lock:
+                latencies.append(elapsed)
+                if resp.status_code != 302:
+                    errors.append(resp.status_code)
+
+    threads = [threading.Thread(target=user, args=(n,)) for n in range(users)]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - started
+
+    latencies.sort()
+    pct = lambda p: latencies[min(int(len(latencies) * p), len(latencies) - 1)] * 1000
+    cores = os.cpu_count() or 1
+
+    print(json.dumps({
+        "logins": len(latencies),
+        "errors": len(errors),
+        "cores": cores,
+        "logins_per_s": round(len(latencies) / wall, 1),
+        "logins_per_s_per_core": round(len(latencies) / wall / cores, 1),
+        "p50_ms": round(pct(0.50), 1),
+        "p95_ms": round(pct(0.95), 1),
+        "max_ms": round(latencies[-1] * 1000, 1)
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=32)
+    parser.add_argument("--logins", type=int, default=4)
+    parser.add_argument("--methods", nargs="+", default=["pbkdf2:sha256:600000"])
+    parser.add_argument("--child", action="store_true")
+    args = parser.parse_args()
+
+    if args.child:
+        run_burst(args.users, args.logins)
+        return
+
+    for method in args.methods:
+        with tempfile.TemporaryDirectory() as tmp:
+            env = dict(
+                os.environ,
+                DB_TYPE="sqlite",
+                SQLITE_PATH=os.path.join(tmp, "bench.db"),
+                PASSWORD_HASH_METHOD=method,
+                PASSWORD_HASH_QUEUE=str(args.users),
+                RATE_LIMIT_BACKEND="memory",
+                LOGIN_BURST_PER_IP=str(args.users * args.logins)
+            )
+            out = subprocess.run(
+                [sys.executable, __file__, "--child",
+                 "--users", str(args.users), "--logins", str(args.logins)],
+                env=env, capture_output=True, text=True, check=True
+            ).stdout.strip().splitlines()[-1]
+
+        print(f"{method:24s} {out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+Kitchen polling: N screens GET the kitchen feeds in a loop, with a fresh
+SQLite connection per request and with the persistent pool.
+
+    python benchmarks/bench_sqlite_connections.py --screens 8 --polls 200
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import threading
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+ENDPOINTS = ("/api/kitchen/orders", "/api/kitchen/additions")
+
+
+def run_polls(screens, polls, orders):
+    sys.path.insert(0, ROOT)
+    from app import app
+    from db import init_db, SQLITE_PATH
+    import sqlite3
+
+    init_db()
+    db = sqlite3.connect(SQLITE_PATH)
+    db.execute("INSERT INTO restaurants (name, subdomain) VALUES ('Bench', 'bench')")
+    rid = db.execute("SELECT id FROM restaurants WHERE subdomain='bench'").fetchone()[0]
+    items = json.dumps([{"name": "Naan", "price": 40, "qty": 2, "station": "main"}])
+    db.executemany("""
+        INSERT INTO orders (restaurant_id, table_no, items, subtotal_paise, subtotal,
+                            cgst, sgst, total, status, created_at)
+        VALUES (?, ?, ?, 8000, 80, 2, 2, 84, ?, datetime('now'))
+    """, [(rid, n % 40, items, "Closed" if n % 10 else "Received") for n in range(orders)])
+    db.executemany("""
+        INSERT INTO order_additions (order_id, restaurant_id, table_no, item_name,
+                                     qty, price, station, status, created_at)
+        VALUES (?, ?, ?, 'Naan', 2, 40, 'main', ?, datetime('now'))
+    """, [(n + 1, rid, n % 40, "Done" if n % 10 else "New") for n in range(orders)])
+    db.commit()
+    db.close()
+
+    latencies = {path: [] for path in ENDPOINTS}
+    errors = []
+    lock = threading.Lock()
+    barrier = threading.Barrier(screens)
+
+    def screen():
+        client = app.test_client()
+        with client.session_transaction() as s:
+            s["user"], s["role"], s["restaurant_id"] = "bench", "kitchen", rid
+        barrier.wait()
+
+        for _ in range(polls):
+            for path in ENDPOINTS:
+                t0 = time.perf_counter()
+                resp = client.get(path)
+                elapsed = time.perf_counter() - t0
+
+                with lock:
+                    latencies[path].append(elapsed)
+                    if resp.status_code != 200:
+                        errors.append(resp.status_code)
+
+    threads = [threading.Thread(target=screen) for _ in range(screens)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    result = {"errors": len(errors)}
+    for path, lat in latencies.items():
+        lat.sort()
+        pct = lambda p: lat[min(int(len(lat) * p), len(lat) - 1)] * 1000
+        result[path] = {
+            "p50_ms": round(pct(0.50), 2),
+            "p95_ms": round(pct(0.95), 2),
+            "p99_ms": round(pct(0.99), 2)
+        }
+    print(json.dumps(result))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--screens", type=int, default=8)
+    parser.add_argument("--polls", type=int, default=200)
+    parser.add_argument("--orders", type=int, default=5000)
+    parser.add_argument("--child", action="store_true")
+    args = parser.parse_args()
+
+    if args.child:
+        run_polls(args.screens, args.polls, args.orders)
+        return
+
+    for label, persistent in (("connect per request", "off"), ("pooled", "on")):
+        with tempfile.TemporaryDirectory() as tmp:
+            env = dict(
+                os.environ,
+                DB_TYPE="sqlite",
+                SQLITE_PATH=os.path.join(tmp, "bench.db"),
+                SQLITE_PERSISTENT=persistent,
+                ADMISSION_CONTROL="off",
+                LOG_LEVEL="WARNING"
+            )
+            out = subprocess.run(
+                [sys.executable, __file__, "--child",
+                 "--screens", str(args.screens), "--polls", str(args.polls),
+                 "--orders", str(args.orders)],
+                env=env, capture_output=True, text=True, check=True
+            ).stdout.strip().splitlines()[-1]
+
+        print(f"{label:20s} {out}")
+
+
+if __name__ == "__main__":
+    main()
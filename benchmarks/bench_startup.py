@@ -0,0 +1,86 @@
+"""
+Worker cold start: import time of `app`, per module (python -X importtime).
+
+    python benchmarks/bench_startup.py            # top modules + total
+    python benchmarks/bench_startup.py --check    # fail on a regression
+
+--check exits 1 if the import takes longer than --budget-ms or if any
+module that should only load on first use is imported at startup.
+"""
+import os
+import sys
+import argparse
+import tempfile
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Loaded lazily by the routes that need them
+LAZY_MODULES = (
+    "numpy", "cloudinary", "sendgrid", "reportlab", "qrcode",
+    "requests", "flask_dance"
+)
+
+
+def import_times(runs):
+    """
+    {module: (self_us, cumulative_us)}, best of `runs` fresh interpreters
+    """
+    best = {}
+
+    for _ in range(runs):
+        with tempfile.TemporaryDirectory() as tmp:
+            env = dict(
+                os.environ,
+                SQLITE_PATH=os.path.join(tmp, "startup.db"),
+                PYTHONDONTWRITEBYTECODE="1"
+            )
+            env.pop("GOOGLE_CLIENT_ID", None)
+
+            stderr = subprocess.run(
+                [sys.executable, "-X", "importtime", "-c", "import app"],
+                cwd=ROOT, env=env, capture_output=True, text=True, check=True
+            ).stderr
+
+        for line in stderr.splitlines():
+            if not line.startswith("import time:") or "|" not in line:
+                continue
+            fields = line[len("import time:"):].split("|")
+            try:
+                self_us, cum_us = int(fields[0]), int(fields[1])
+            except ValueError:
+                continue   # header line
+            name = fields[2].strip()
+
+            if name not in best or cum_us < best[name][1]:
+                best[name] = (self_us, cum_us)
+
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=20)
+    parser.add_argument("--budget-ms", type=float, default=400)
+    parser.add_argument("--check", action="store_true")
+    args = parser.parse_args()
+
+    times = import_times(args.runs)
+    total_ms = times["app"][1] / 1000
+
+    print(f"{'cumulative ms':>14} {'self ms':>9}  module")
+    ranked = sorted(times.items(), key=lambda kv: kv[1][1], reverse=True)
+    for name, (self_us, cum_us) in ranked[:args.top]:
+        print(f"{cum_us / 1000:14.1f} {self_us / 1000:9.1f}  {name}")
+
+    eager = sorted(m for m in LAZY_MODULES if m in times)
+    print(f"\nimport app: {total_ms:.1f} ms (budget {args.budget_ms:.0f} ms)")
+    print(f"lazy modules imported at startup: {', '.join(eager) or 'none'}")
+
+    if args.check and (total_ms > args.budget_ms or eager):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
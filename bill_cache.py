@@ -0,0 +1,94 @@
+"""
+Rendered bills for closed orders, cached on disk so every gunicorn worker
+can serve a reprint without touching the database.
+
+Layout: BILL_CACHE_DIR/<restaurant_id>/<profile version>/<order_id>-<variant>.html
+
+The profile version changes whenever the restaurant edits its name,
+GSTIN, address or phone, so bills printed after an edit pick up the
+new header. Anything that changes an order's items or reopens it must
+call invalidate() after it commits; bill() re-reads the order after put()
+and drops the file if it changed meanwhile.
+"""
+import os
+import uuid
+import shutil
+import tempfile
+
+BILL_CACHE = os.getenv("BILL_CACHE", "on") == "on"
+BILL_CACHE_DIR = os.getenv(
+    "BILL_CACHE_DIR", os.path.join(tempfile.gettempdir(), "qr_restaurant_bills")
+)
+
+VARIANTS = ("full", "thermal")
+
+
+def _restaurant_dir(restaurant_id):
+    return os.path.join(BILL_CACHE_DIR, str(int(restaurant_id)))
+
+
+def _path(restaurant_id, version, order_id, variant):
+    return os.path.join(
+        _restaurant_dir(restaurant_id), version, f"{int(order_id)}-{variant}.html"
+    )
+
+
+def _write(path, text):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp, path)   # readers never see a half-written file
+
+
+def profile_version(restaurant_id):
+    try:
+        with open(os.path.join(_restaurant_dir(restaurant_id), "VERSION")) as f:
+            return f.read().strip() or "0"
+    except FileNotFoundError:
+        return "0"
+
+
+def bump_profile(restaurant_id):
+    """
+    Start a new profile version and drop every bill cached under the old one
+    """
+    if not BILL_CACHE:
+        return
+
+    root = _restaurant_dir(restaurant_id)
+    version = uuid.uuid4().hex
+    _write(os.path.join(root, "VERSION"), version)
+
+    for name in os.listdir(root):
+        path = os.path.join(root, name)
+        if name != version and os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def get(restaurant_id, version, order_id, variant):
+    if not BILL_CACHE:
+        return None
+    try:
+        with open(_path(restaurant_id, version, order_id, variant), encoding="utf-8") as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+def put(restaurant_id, version, order_id, variant, html):
+    if BILL_CACHE:
+        _write(_path(restaurant_id, version, order_id, variant), html)
+
+
+def invalidate(restaurant_id, *order_ids):
+    if not BILL_CACHE:
+        return
+
+    version = profile_version(restaurant_id)
+    for order_id in order_ids:
+        for variant in VARIANTS:
+            try:
+                os.remove(_path(restaurant_id, version, order_id, variant))
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,73 @@
+"""
+Order money as exact integer paise.
+
+orders.subtotal_paise is kept as a running total: each line added or
+removed applies its own delta, so a long tab costs O(1) per tap and never
+accumulates float rounding. Tax is derived from the subtotal with the
+order's GST rate (basis points, 500 = 5%) and split evenly into CGST and
+SGST; the rupee columns (subtotal, cgst, sgst, total) are written from
+these integers for the templates and reports.
+"""
+import os
+import json
+from decimal import Decimal, ROUND_HALF_UP
+
+DEFAULT_GST_RATE_BP = int(os.getenv("DEFAULT_GST_RATE_BP", "500"))
+
+
+def to_paise(amount):
+    return int((Decimal(str(amount)) * 100).quantize(Decimal(1), ROUND_HALF_UP))
+
+
+def line_paise(item):
+    return to_paise(item["price"]) * int(item["qty"])
+
+
+def items_paise(items):
+    return sum(line_paise(i) for i in items)
+
+
+def totals(subtotal_paise, gst_rate_bp):
+    """
+    (subtotal, cgst, sgst, total) in rupees; each GST half rounds half-up
+    to the paisa
+    """
+    half = (subtotal_paise * gst_rate_bp + 10000) // 20000
+    return (
+        subtotal_paise / 100,
+        half / 100,
+        half / 100,
+        (subtotal_paise + 2 * half) / 100
+    )
+
+
+def rate_bp(percent):
+    """
+    GST percent as entered by the restaurant ("5", "18", "2.5") to basis points
+    """
+    bp = int((Decimal(str(percent)) * 100).quantize(Decimal(1), ROUND_HALF_UP))
+    if not 0 <= bp <= 10000:
+        raise ValueError("GST rate must be between 0 and 100")
+    return bp
+
+
+def check(order):
+    """
+    Recompute an order from its items; returns None when the stored
+    totals match, else {"stored": ..., "expected": ...}
+    """
+    items = order["items"]
+    if isinstance(items, str):
+        items = json.loads(items or "[]")
+
+    subtotal_paise = items_paise(items or [])
+    expected = (subtotal_paise, *totals(subtotal_paise, order["gst_rate_bp"]))
+    stored = (
+        order["subtotal_paise"],
+        *(float(order[c]) if order[c] is not None else None
+          for c in ("subtotal", "cgst", "sgst", "total"))
+    )
+
+    if stored == expected:
+        return None
+    return {"stored": stored, "expected": expected}
@@ -1,14 +1,83 @@
 import os
+import re
+import time
+import uuid
 import sqlite3
+import functools
+import itertools
+import threading
+import contextlib
 import psycopg2
 from psycopg2.extras import RealDictCursor
-from flask import g
+from flask import g, session, has_request_context
 
 DB_TYPE = os.getenv("DB_TYPE", "sqlite")
 DATABASE_URL = os.getenv("DATABASE_URL")
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-SQLITE_PATH = os.path.join(BASE_DIR, "restaurant.db")
+SQLITE_PATH = os.getenv("SQLITE_PATH", os.path.join(BASE_DIR, "restaurant.db"))
+
+# SQLITE_SHARDING=tenant keeps restaurants/users in SQLITE_PATH (the
+# catalog) and every restaurant's operational tables in its own file, so
+# writes for different restaurants never share a WAL writer lock.
+TENANT_SHARDED = (
+    DB_TYPE == "sqlite" and os.getenv("SQLITE_SHARDING", "off") == "tenant"
+)
+TENANT_DIR = os.getenv("SQLITE_TENANT_DIR", os.path.join(BASE_DIR, "tenants"))
+TENANT_TABLES = (
+    "menu", "orders", "order_additions", "sales_buckets", "sales_rollup",
+    "orders_archive", "order_additions_archive", "kitchen_stations"
+)
+
+_initialized_tenants = set()
+
+# Read replica for replica_safe routes: DATABASE_REPLICA_URL on Postgres,
+# SQLITE_REPLICA_PATH (a second file, e.g. a litestream/rsync copy) on SQLite.
+REPLICA_URL = os.getenv("DATABASE_REPLICA_URL")
+SQLITE_REPLICA_PATH = os.getenv("SQLITE_REPLICA_PATH")
+REPLICA_ENABLED = not TENANT_SHARDED and bool(
+    REPLICA_URL if DB_TYPE == "postgres" else SQLITE_REPLICA_PATH
+)
+# After a write, the same session reads from the primary for this long
+REPLICA_STICKY_SECONDS = float(os.getenv("REPLICA_STICKY_SECONDS", "5"))
+# After a replica error, skip the replica for this long
+REPLICA_RETRY_SECONDS = float(os.getenv("REPLICA_RETRY_SECONDS", "30"))
+
+_replica_down_until = 0.0
+
+# SQLite performance profile, applied to every connection. cache_size is
+# in pages, or KiB when negative; it is private to each connection, so a
+# worker can hold up to SQLITE_POOL_SIZE x |SQLITE_CACHE_SIZE| KiB of
+# page cache (16 x 8 MB by default). mmap pages are the OS file cache,
+# shared by every connection and process.
+SQLITE_CACHE_SIZE = int(os.getenv("SQLITE_CACHE_SIZE", "-8000"))
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+SQLITE_TEMP_STORE = os.getenv("SQLITE_TEMP_STORE", "MEMORY")
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "10000"))
+
+# Request connections stay open in a per-process pool of at most
+# SQLITE_POOL_SIZE (open files across all tenants, however many threads;
+# SQLITE_PERSISTENT=off reopens the file every request). A request waits
+# up to SQLITE_POOL_TIMEOUT seconds when all are busy. Checkpoint +
+# optimize run every SQLITE_MAINTENANCE_SECONDS on each connection.
+SQLITE_PERSISTENT = os.getenv("SQLITE_PERSISTENT", "on") == "on"
+SQLITE_POOL_SIZE = int(os.getenv("SQLITE_POOL_SIZE", "16"))
+SQLITE_POOL_TIMEOUT = float(os.getenv("SQLITE_POOL_TIMEOUT", "10"))
+SQLITE_MAINTENANCE_SECONDS = float(os.getenv("SQLITE_MAINTENANCE_SECONDS", "300"))
+
+# Postgres: each worker process keeps a pool of at most PG_POOL_SIZE
+# connections, however many threads it runs (server connections =
+# workers x PG_POOL_SIZE). A request holds one from its first query to
+# teardown, waiting up to PG_POOL_TIMEOUT seconds when all are busy.
+# Hot queries stay PREPAREd per pooled connection (PG_PREPARE=off behind
+# a transaction-pooling PgBouncer).
+PG_PERSISTENT = os.getenv("PG_PERSISTENT", "on") == "on"
+PG_POOL_SIZE = int(os.getenv("PG_POOL_SIZE", "8"))
+PG_POOL_TIMEOUT = float(os.getenv("PG_POOL_TIMEOUT", "10"))
+PG_PREPARE = PG_PERSISTENT and os.getenv("PG_PREPARE", "on") == "on"
+
+# Rows per round trip for stream()
+STREAM_BATCH = int(os.getenv("STREAM_BATCH", "1000"))
 
 
 # --------------------------------------------------
@@ -18,29 +87,431 @@ SQLITE_PATH = os.path.join(BASE_DIR, "restaurant.db")
 def get_db():
     if "db" not in g:
         if DB_TYPE == "postgres":
-            g.db = psycopg2.connect(
-                DATABASE_URL,
-                cursor_factory=RealDictCursor
+            g.db = pooled_pg()
+        elif TENANT_SHARDED and g.get("tenant_id") is not None:
+            g.db = pooled_sqlite(tenant_path(g.tenant_id), lambda: connect_tenant(g.tenant_id))
+        else:
+            g.db = pooled_sqlite(SQLITE_PATH, lambda: connect_sqlite(SQLITE_PATH))
+
+    return g.db
+
+
+def close_db(e=None):
+    db = g.pop("db", None)
+    if db and not (release_pg(db) or release_sqlite(db)):
+        db.close()
+
+    replica = g.pop("read_db", None)
+    if replica:
+        replica.close()
+
+
+def connect_sqlite(path):
+    db = sqlite3.connect(
+        path,
+        timeout=SQLITE_BUSY_TIMEOUT_MS / 1000,
+        check_same_thread=False
+    )
+    db.row_factory = sqlite3.Row
+    db.execute("PRAGMA journal_mode=WAL;")
+    db.execute("PRAGMA synchronous=NORMAL;")
+    db.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS};")
+    db.execute(f"PRAGMA cache_size={SQLITE_CACHE_SIZE};")
+    db.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE};")
+    db.execute(f"PRAGMA temp_store={SQLITE_TEMP_STORE};")
+    return db
+
+
+class PreparingConnection(psycopg2.extensions.connection):
+    """
+    Remembers which named statements have been PREPAREd on it
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+
+
+def connect_pg():
+    db = psycopg2.connect(
+        DATABASE_URL,
+        cursor_factory=RealDictCursor,
+        connection_factory=PreparingConnection
+    )
+    db.autocommit = True
+    return db
+
+
+# --------------------------------------------------
+# CONNECTION POOLS
+# --------------------------------------------------
+
+class PgPoolTimeout(Exception):
+    pass
+
+
+_pg_pool = None   # (pid, idle connections, free slots)
+_pg_pool_lock = threading.Lock()
+
+
+def _pool():
+    global _pg_pool
+    # Pooled connections must not cross a gunicorn fork
+    if _pg_pool is None or _pg_pool[0] != os.getpid():
+        with _pg_pool_lock:
+            if _pg_pool is None or _pg_pool[0] != os.getpid():
+                _pg_pool = (os.getpid(), [], threading.BoundedSemaphore(PG_POOL_SIZE))
+    return _pg_pool
+
+
+def pooled_pg():
+    """
+    A connection from this process's pool (opened on demand, at most
+    PG_POOL_SIZE at once); waits PG_POOL_TIMEOUT seconds when all are out
+    """
+    if not PG_PERSISTENT:
+        return connect_pg()
+
+    _, idle, slots = _pool()
+    if not slots.acquire(timeout=PG_POOL_TIMEOUT):
+        raise PgPoolTimeout(f"no Postgres connection free after {PG_POOL_TIMEOUT}s")
+
+    try:
+        with _pg_pool_lock:
+            db = idle.pop() if idle else None
+        if db is None or db.closed:
+            db = connect_pg()
+    except Exception:
+        slots.release()
+        raise
+    return db
+
+
+def release_pg(db):
+    """
+    End of request: roll back anything left open and return `db` to the
+    pool (a broken one is dropped). False if `db` is not a pooled one.
+    """
+    if not PG_PERSISTENT or not isinstance(db, PreparingConnection):
+        return False
+
+    _, idle, slots = _pool()
+    try:
+        if not db.closed and (
+            not db.autocommit or db.status != psycopg2.extensions.STATUS_READY
+        ):
+            db.rollback()
+            db.autocommit = True
+    except psycopg2.Error:
+        db.close()
+
+    if not db.closed:
+        with _pg_pool_lock:
+            idle.append(db)
+    slots.release()
+    return True
+
+
+class SQLitePoolTimeout(Exception):
+    pass
+
+
+class _SQLitePool:
+
+    def __init__(self):
+        self.pid = os.getpid()
+        self.lock = threading.Lock()
+        self.slots = threading.BoundedSemaphore(SQLITE_POOL_SIZE)
+        self.idle = []    # [path, connection, last maintenance], least recently used first
+        self.busy = {}    # id(connection) -> entry
+
+
+_sqlite_pool = None
+_sqlite_pool_lock = threading.Lock()
+
+
+def _sqlite():
+    global _sqlite_pool
+    # Connections must not cross a gunicorn fork
+    if _sqlite_pool is None or _sqlite_pool.pid != os.getpid():
+        with _sqlite_pool_lock:
+            if _sqlite_pool is None or _sqlite_pool.pid != os.getpid():
+                _sqlite_pool = _SQLitePool()
+    return _sqlite_pool
+
+
+def pooled_sqlite(path, connect):
+    """
+    A long-lived connection to `path` from this process's pool, opened
+    with `connect` if none is idle, so the page cache and mmap survive
+    between requests
+    """
+    if not SQLITE_PERSISTENT:
+        return connect()
+
+    pool = _sqlite()
+    if not pool.slots.acquire(timeout=SQLITE_POOL_TIMEOUT):
+        raise SQLitePoolTimeout(f"no SQLite connection free after {SQLITE_POOL_TIMEOUT}s")
+
+    try:
+        with pool.lock:
+            entry = next((e for e in reversed(pool.idle) if e[0] == path), None)
+            if entry is not None:
+                pool.idle.remove(entry)
+            elif len(pool.idle) + len(pool.busy) >= SQLITE_POOL_SIZE:
+                # Full of other tenants' files: close the least recently used
+                pool.idle.pop(0)[1].close()
+
+        if entry is None:
+            entry = [path, connect(), time.monotonic()]
+    except Exception:
+        pool.slots.release()
+        raise
+
+    with pool.lock:
+        pool.busy[id(entry[1])] = entry
+    return entry[1]
+
+
+def release_sqlite(db):
+    """
+    End of request for a pooled connection: drop anything left
+    uncommitted, every SQLITE_MAINTENANCE_SECONDS checkpoint the WAL and
+    refresh planner stats, and return it to the pool. False if `db` is
+    not one of ours.
+    """
+    if not SQLITE_PERSISTENT:
+        return False
+
+    pool = _sqlite()
+    with pool.lock:
+        entry = pool.busy.pop(id(db), None)
+    if entry is None:
+        return False
+
+    try:
+        if db.in_transaction:
+            db.rollback()
+
+        now = time.monotonic()
+        if now - entry[2] >= SQLITE_MAINTENANCE_SECONDS:
+            entry[2] = now
+            try:
+                db.execute("PRAGMA wal_checkpoint(PASSIVE);")
+                db.execute("PRAGMA optimize;")
+            except sqlite3.OperationalError:
+                pass   # busy; next time
+    except sqlite3.Error:
+        db.close()   # unusable; not pooled again
+    else:
+        with pool.lock:
+            pool.idle.append(entry)
+    finally:
+        pool.slots.release()
+    return True
+
+
+# --------------------------------------------------
+# READ REPLICA
+# --------------------------------------------------
+
+def replica_safe(func):
+    """
+    Let fetchone/fetchall in this route read from the replica
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        g.replica_ok = True
+        try:
+            return func(*args, **kwargs)
+        finally:
+            g.replica_ok = False
+    return wrapper
+
+
+def get_read_db():
+    if "read_db" not in g:
+        if DB_TYPE == "postgres":
+            g.read_db = psycopg2.connect(
+                REPLICA_URL,
+                cursor_factory=RealDictCursor,
+                connect_timeout=2
             )
-            g.db.autocommit = True
+            g.read_db.autocommit = True
+            g.read_db.set_session(readonly=True)
         else:
-            g.db = sqlite3.connect(
-                SQLITE_PATH,
+            g.read_db = sqlite3.connect(
+                f"file:{SQLITE_REPLICA_PATH}?mode=ro",
+                uri=True,
                 timeout=10,
                 check_same_thread=False
             )
-            g.db.row_factory = sqlite3.Row
-            g.db.execute("PRAGMA journal_mode=WAL;")
-            g.db.execute("PRAGMA synchronous=NORMAL;")
+            g.read_db.row_factory = sqlite3.Row
 
-    return g.db
+    return g.read_db
 
 
-def close_db(e=None):
-    db = g.pop("db", None)
-    if db:
+def mark_write():
+    g.db_wrote = True
+    if REPLICA_ENABLED and has_request_context():
+        session["db_write_at"] = time.time()
+
+
+def use_replica():
+    if not (REPLICA_ENABLED and g.get("replica_ok")):
+        return False
+
+    if g.get("db_wrote") or time.time() < _replica_down_until:
+        return False
+
+    # Read-your-writes: stay on the primary right after this session wrote
+    if has_request_context():
+        wrote_at = session.get("db_write_at", 0)
+        if time.time() - wrote_at < REPLICA_STICKY_SECONDS:
+            return False
+
+    return True
+
+
+def replica_execute(query, params=()):
+    """
+    Run a read on the replica; None if it is unavailable (caller falls
+    back to the primary)
+    """
+    global _replica_down_until
+
+    try:
+        db = get_read_db()
+        if DB_TYPE == "postgres":
+            cur = db.cursor()
+            cur.execute(query, params)
+            return cur
+        return db.execute(query, params)
+
+    except (psycopg2.OperationalError, psycopg2.InterfaceError,
+            sqlite3.OperationalError):
+        _replica_down_until = time.time() + REPLICA_RETRY_SECONDS
+        replica = g.pop("read_db", None)
+        if replica:
+            try:
+                replica.close()
+            except Exception:
+                pass
+        return None
+
+
+# --------------------------------------------------
+# TENANT ROUTING (SQLITE_SHARDING=tenant)
+# --------------------------------------------------
+
+def tenant_path(restaurant_id):
+    return os.path.join(TENANT_DIR, f"restaurant_{int(restaurant_id)}.db")
+
+
+def connect_tenant(restaurant_id):
+    """
+    Tenant file as `main`, catalog attached so restaurants/users still
+    resolve (and join) unqualified
+    """
+    path = tenant_path(restaurant_id)
+    db = connect_sqlite(path)
+
+    if path not in _initialized_tenants:
+        create_tenant_tables(db)
+        db.commit()
+        _initialized_tenants.add(path)
+
+    db.execute("ATTACH DATABASE ? AS catalog", (SQLITE_PATH,))
+    db.execute("PRAGMA catalog.journal_mode=WAL;")
+    return db
+
+
+def use_tenant(restaurant_id):
+    """
+    Route this context's queries to a restaurant's database (None = catalog).
+    Commit before switching; returns False for an unknown tenant.
+    """
+    if not TENANT_SHARDED:
+        return True
+
+    if restaurant_id is not None:
+        restaurant_id = int(restaurant_id)
+        if not os.path.exists(tenant_path(restaurant_id)):
+            return False
+
+    if g.get("tenant_id") != restaurant_id:
+        close_db()
+        g.tenant_id = restaurant_id
+
+    return True
+
+
+def create_tenant(restaurant_id):
+    """
+    Create the database file for a new restaurant (no-op unless sharded)
+    """
+    if not TENANT_SHARDED:
+        return
+
+    os.makedirs(TENANT_DIR, exist_ok=True)
+    connect_tenant(restaurant_id).close()
+
+
+def restaurant_ids():
+    use_tenant(None)
+    return [r["id"] for r in fetchall("SELECT id FROM restaurants ORDER BY id")]
+
+
+def split_tenants(drop_source=False):
+    """
+    Copy each restaurant's rows out of SQLITE_PATH into its tenant file.
+    Safe to re-run; existing rows are kept.
+    """
+    os.makedirs(TENANT_DIR, exist_ok=True)
+
+    source = sqlite3.connect(SQLITE_PATH)
+    create_tenant_tables(source)
+    source.commit()
+    ids = [r[0] for r in source.execute("SELECT id FROM restaurants ORDER BY id")]
+    source.close()
+
+    copied = {}
+
+    for rid in ids:
+        db = sqlite3.connect(tenant_path(rid), timeout=10)
+        db.execute("PRAGMA journal_mode=WAL;")
+        create_tenant_tables(db)
+        db.commit()
+
+        db.execute("ATTACH DATABASE ? AS src", (SQLITE_PATH,))
+
+        for table in TENANT_TABLES:
+            target = [r[1] for r in db.execute(f"PRAGMA main.table_info({table})")]
+            cols = ", ".join(
+                r[1] for r in db.execute(f"PRAGMA src.table_info({table})")
+                if r[1] in target
+            )
+
+            cur = db.execute(f"""
+                INSERT OR IGNORE INTO main.{table} ({cols})
+                SELECT {cols} FROM src.{table}
+                WHERE restaurant_id=?
+            """, (rid,))
+            copied[table] = copied.get(table, 0) + cur.rowcount
+
+        db.commit()
+        db.execute("DETACH DATABASE src")
         db.close()
 
+    if drop_source:
+        source = sqlite3.connect(SQLITE_PATH)
+        source.execute("DROP VIEW IF EXISTS orders_history")
+        for table in TENANT_TABLES:
+            source.execute(f"DROP TABLE IF EXISTS {table}")
+        source.commit()
+        source.close()
+
+    return len(ids), copied
+
 
 # --------------------------------------------------
 # SQLITE INIT (LOCAL DEV ONLY)
@@ -48,10 +519,78 @@ def close_db(e=None):
 
 def init_db():
     if DB_TYPE != "sqlite":
+        db = psycopg2.connect(DATABASE_URL)
+        db.autocommit = True
+        c = db.cursor()
+        create_reporting_tables(c)
+        create_otp_tables(c)
+
+        c.execute("ALTER TABLE restaurants ADD COLUMN IF NOT EXISTS gst_rate_bp INTEGER DEFAULT 500")
+        c.execute("ALTER TABLE orders ADD COLUMN IF NOT EXISTS gst_rate_bp INTEGER DEFAULT 500")
+        c.execute("ALTER TABLE orders ADD COLUMN IF NOT EXISTS subtotal_paise BIGINT")
+        c.execute("""
+            UPDATE orders
+            SET subtotal_paise = CAST(ROUND(COALESCE(subtotal, 0) * 100) AS BIGINT)
+            WHERE subtotal_paise IS NULL
+        """)
+
+        # Set once an order is counted in the sales rollup; orders closed
+        # before the flag existed were counted already
+        c.execute("""
+            SELECT 1 FROM information_schema.columns
+            WHERE table_schema = current_schema()
+            AND table_name = 'orders' AND column_name = 'rolled_up'
+        """)
+        if not c.fetchone():
+            c.execute("ALTER TABLE orders ADD COLUMN rolled_up INTEGER DEFAULT 0")
+            c.execute("UPDATE orders SET rolled_up=1 WHERE status='Closed'")
+
+        # Kitchen screens lease tickets (`/api/kitchen/additions/claim`)
+        c.execute("ALTER TABLE order_additions ADD COLUMN IF NOT EXISTS claimed_by TEXT")
+        c.execute("ALTER TABLE order_additions ADD COLUMN IF NOT EXISTS claim_expires_at TIMESTAMP")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_additions_restaurant_status_created ON order_additions(restaurant_id, status, created_at)")
+
+        # Tickets are routed to a station by menu category at insert
+        create_kitchen_tables(c)
+        c.execute("ALTER TABLE order_additions ADD COLUMN IF NOT EXISTS station TEXT")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_additions_station ON order_additions(restaurant_id, station, status, created_at)")
+
+        # Items as JSONB: appended in SQL, aggregated with jsonb functions,
+        # GIN-indexed for containment (`items @> '[{"name": "Dal"}]'`)
+        c.execute("""
+            SELECT data_type FROM information_schema.columns
+            WHERE table_schema = current_schema()
+            AND table_name = 'orders' AND column_name = 'items'
+        """)
+        if c.fetchone()[0] != "jsonb":
+            c.execute("DROP VIEW IF EXISTS orders_history")
+            c.execute("""
+                ALTER TABLE orders ALTER COLUMN items TYPE JSONB
+                USING COALESCE(NULLIF(items, ''), '[]')::jsonb
+            """)
+        c.execute("CREATE INDEX IF NOT EXISTS idx_orders_items ON orders USING GIN (items jsonb_path_ops)")
+
+        # Open orders only: the table lookup and the kitchen feed never
+        # scan closed history, however old an open tab gets
+        c.execute("CREATE INDEX IF NOT EXISTS idx_orders_open ON orders(restaurant_id, table_no) WHERE status != 'Closed'")
+
+        # orders is (or becomes, via `flask partition-orders`) partitioned
+        # by month, so history is the table itself
+        c.execute("CREATE OR REPLACE VIEW orders_history AS SELECT * FROM orders")
+        db.close()
         return
 
     db = sqlite3.connect(SQLITE_PATH)
-    c = db.cursor()
+    create_catalog_tables(db)
+
+    if not TENANT_SHARDED:
+        create_tenant_tables(db)
+
+    db.commit()
+    db.close()
+
+
+def create_catalog_tables(c):
 
     # ---------------- RESTAURANTS ----------------
     c.execute("""
@@ -64,9 +603,11 @@ def init_db():
         phone TEXT,
         created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
         trial_start DATETIME,
-        trial_expires_at DATETIME
+        trial_expires_at DATETIME,
+        gst_rate_bp INTEGER DEFAULT 500
     )
     """)
+    add_column(c, "restaurants", "gst_rate_bp", "INTEGER DEFAULT 500")
 
     # ---------------- USERS ----------------
     c.execute("""
@@ -85,6 +626,36 @@ def init_db():
     )
     """)
 
+    c.execute("CREATE INDEX IF NOT EXISTS idx_users_restaurant ON users(restaurant_id)")
+
+    create_otp_tables(c)
+
+
+def create_otp_tables(c):
+    """
+    One-time codes (otp_utils), kept off the users table (portable DDL only)
+    """
+
+    # ---------------- OTP CODES ----------------
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS otp_codes (
+        email TEXT NOT NULL,
+        purpose TEXT NOT NULL,
+        code_hash TEXT NOT NULL,
+        expires_at BIGINT NOT NULL,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (email, purpose)
+    )
+    """)
+    c.execute("CREATE INDEX IF NOT EXISTS idx_otp_codes_expires ON otp_codes(expires_at)")
+
+
+def create_tenant_tables(c):
+    """
+    Restaurant-scoped tables (SQLite); FOREIGN KEYs to restaurants are
+    not enforced and stay valid when the catalog is a separate file
+    """
+
     # ---------------- MENU ----------------
     c.execute("""
     CREATE TABLE IF NOT EXISTS menu (
@@ -115,9 +686,14 @@ def init_db():
         total REAL,
         status TEXT DEFAULT 'Received',
         created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        gst_rate_bp INTEGER DEFAULT 500,
+        subtotal_paise INTEGER,
+        rolled_up INTEGER DEFAULT 0,
         FOREIGN KEY (restaurant_id) REFERENCES restaurants(id)
     )
     """)
+    add_order_money_columns(c, "orders")
+    add_rollup_flag(c, "orders")
 
     # ---------------- ORDER ADDITIONS ----------------
     c.execute("""
@@ -131,20 +707,145 @@ def init_db():
         price REAL NOT NULL,
         status TEXT DEFAULT 'New',
         created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        claimed_by TEXT,
+        claim_expires_at TIMESTAMP,
+        station TEXT,
         FOREIGN KEY (order_id) REFERENCES orders(id),
         FOREIGN KEY (restaurant_id) REFERENCES restaurants(id)
     )
     """)
+    add_column(c, "order_additions", "claimed_by", "TEXT")
+    add_column(c, "order_additions", "claim_expires_at", "TIMESTAMP")
+    add_column(c, "order_additions", "station", "TEXT")
 
     # ---------------- INDEXES ----------------
     c.execute("CREATE INDEX IF NOT EXISTS idx_orders_restaurant ON orders(restaurant_id)")
     c.execute("CREATE INDEX IF NOT EXISTS idx_orders_status ON orders(status)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_orders_restaurant_created ON orders(restaurant_id, created_at)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_orders_open ON orders(restaurant_id, table_no) WHERE status != 'Closed'")
     c.execute("CREATE INDEX IF NOT EXISTS idx_additions_restaurant ON order_additions(restaurant_id)")
     c.execute("CREATE INDEX IF NOT EXISTS idx_additions_status ON order_additions(status)")
-    c.execute("CREATE INDEX IF NOT EXISTS idx_users_restaurant ON users(restaurant_id)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_additions_restaurant_status_created ON order_additions(restaurant_id, status, created_at)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_additions_station ON order_additions(restaurant_id, station, status, created_at)")
+
+    create_archive_tables(c)
+    create_reporting_tables(c)
+    create_kitchen_tables(c)
+
+
+def create_archive_tables(c):
+    """
+    Closed orders older than ARCHIVE_AFTER_DAYS are moved here by
+    `flask archive-orders`; history reads go through orders_history
+    """
+
+    # ---------------- ARCHIVE (same columns as the live tables) ----------------
+    c.execute("CREATE TABLE IF NOT EXISTS orders_archive AS SELECT * FROM orders WHERE 0")
+    c.execute("CREATE TABLE IF NOT EXISTS order_additions_archive AS SELECT * FROM order_additions WHERE 0")
+
+    c.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_orders_archive_id ON orders_archive(id)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_orders_archive_restaurant_created ON orders_archive(restaurant_id, created_at)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_additions_archive_order ON order_additions_archive(order_id)")
+    add_order_money_columns(c, "orders_archive")
+
+    # Rebuilt every migrate so it follows columns added to orders
+    cols = ", ".join(common_columns(c, "orders", "orders_archive"))
+    c.execute("DROP VIEW IF EXISTS orders_history")
+    c.execute(f"""
+    CREATE VIEW orders_history AS
+        SELECT {cols} FROM orders
+        UNION ALL
+        SELECT {cols} FROM orders_archive
+    """)
+
+
+def add_column(c, table, column, ddl):
+    """
+    ALTER TABLE ... ADD COLUMN unless it is already there (SQLite)
+    """
+    existing = {r[1] for r in c.execute(f"PRAGMA table_info({table})").fetchall()}
+    if column not in existing:
+        c.execute(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}")
+
+
+def add_order_money_columns(c, table):
+    """
+    Exact running subtotal (paise) and the GST rate the order was opened
+    with; older rows are backfilled from their rupee subtotal
+    """
+    add_column(c, table, "gst_rate_bp", "INTEGER DEFAULT 500")
+    add_column(c, table, "subtotal_paise", "INTEGER")
+    c.execute(f"""
+        UPDATE {table}
+        SET subtotal_paise = CAST(ROUND(COALESCE(subtotal, 0) * 100) AS INTEGER)
+        WHERE subtotal_paise IS NULL
+    """)
+
+
+def add_rollup_flag(c, table):
+    """
+    rolled_up: set once the order is counted in the sales rollup; orders
+    closed before the flag existed were counted already
+    """
+    existing = {r[1] for r in c.execute(f"PRAGMA table_info({table})").fetchall()}
+    if "rolled_up" not in existing:
+        c.execute(f"ALTER TABLE {table} ADD COLUMN rolled_up INTEGER DEFAULT 0")
+        c.execute(f"UPDATE {table} SET rolled_up=1 WHERE status='Closed'")
+
+
+def common_columns(c, table, other):
+    """
+    Columns of `table` (in its order) that `other` also has (SQLite)
+    """
+    theirs = {r[1] for r in c.execute(f"PRAGMA table_info({other})").fetchall()}
+    return [
+        r[1] for r in c.execute(f"PRAGMA table_info({table})").fetchall()
+        if r[1] in theirs
+    ]
+
+
+def create_reporting_tables(c):
+    """
+    Tables shared by both backends (portable DDL only)
+    """
+
+    # ---------------- SALES ROLLUP ----------------
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS sales_buckets (
+        restaurant_id INTEGER NOT NULL,
+        bucket TIMESTAMP NOT NULL,
+        orders INTEGER NOT NULL DEFAULT 0,
+        revenue NUMERIC(12, 2) NOT NULL DEFAULT 0,
+        PRIMARY KEY (restaurant_id, bucket)
+    )
+    """)
+
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS sales_rollup (
+        restaurant_id INTEGER NOT NULL,
+        bucket TIMESTAMP NOT NULL,
+        item_name TEXT NOT NULL,
+        qty INTEGER NOT NULL DEFAULT 0,
+        revenue NUMERIC(12, 2) NOT NULL DEFAULT 0,
+        PRIMARY KEY (restaurant_id, bucket, item_name)
+    )
+    """)
 
-    db.commit()
-    db.close()
+
+def create_kitchen_tables(c):
+    """
+    Kitchen station routing: menu category -> station (portable DDL only)
+    """
+
+    # ---------------- KITCHEN STATIONS ----------------
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS kitchen_stations (
+        restaurant_id INTEGER NOT NULL,
+        category TEXT NOT NULL,
+        station TEXT NOT NULL,
+        PRIMARY KEY (restaurant_id, category)
+    )
+    """)
 
 
 # --------------------------------------------------
@@ -157,19 +858,142 @@ def today_clause(column):
     return f"DATE({column}) = DATE('now')"
 
 
-def sql(query):
+def json_append(column, count):
+    """
+    Expression appending `count` values to a JSON array column; pass one
+    json.dumps()'d param per value
+    """
+    if DB_TYPE == "postgres":
+        values = ", ".join(["?::jsonb"] * count)
+        return f"COALESCE({column}, '[]'::jsonb) || jsonb_build_array({values})"
+
+    values = ", ".join(["'$[#]', json(?)"] * count)
+    return f"json_insert(COALESCE({column}, '[]'), {values})"
+
+
+def json_elements(column, alias):
     """
-    Convert SQLite placeholders (?) to Postgres (%s)
+    FROM-clause item with one row per element of a JSON array column;
+    read fields with json_field(alias, key)
     """
     if DB_TYPE == "postgres":
-        return query.replace("?", "%s")
-    return query
+        return f"jsonb_array_elements({column}) AS {alias}"
+    return f"json_each({column}) AS {alias}"
+
+
+def json_field(alias, key):
+    if DB_TYPE == "postgres":
+        return f"{alias}->>'{key}'"
+    return f"json_extract({alias}.value, '$.{key}')"
+
+
+def json_group(alias):
+    """
+    Aggregate json_elements() rows back into a JSON array (NULL when no
+    rows on Postgres, '[]' on SQLite)
+    """
+    if DB_TYPE == "postgres":
+        return f"jsonb_agg({alias})"
+    return f"json_group_array(json({alias}.value))"
+
+
+# --------------------------------------------------
+# QUERY COMPILER
+# --------------------------------------------------
+
+# Queries are written once, SQLite-style (`?` placeholders) or with the
+# Postgres date arithmetic below; sql() compiles each distinct text once
+# per process for the active dialect.
+
+_LITERAL = re.compile(r"('(?:[^']|'')*')")
+
+_SQLITE_REWRITES = (
+    (re.compile(r"\b(?:CURRENT_TIMESTAMP|NOW\(\))\s*([+-])\s*INTERVAL\s*'(\d+) (\w+)'", re.I),
+     r"datetime('now', '\1\2 \3')"),
+    (re.compile(r"\bCURRENT_DATE\s*([+-])\s*INTERVAL\s*'(\d+) (\w+)'", re.I),
+     r"date('now', '\1\2 \3')"),
+    (re.compile(r"\bNOW\(\)", re.I), "CURRENT_TIMESTAMP"),
+)
+
+
+class Prepared(str):
+    """
+    Compiled Postgres query that execute() runs as a server-side prepared
+    statement; anywhere else it is just the %s-style text
+    """
+    def __new__(cls, text, name, prepare_text, param_count):
+        self = super().__new__(cls, text)
+        self.name = name
+        self.prepare_text = prepare_text
+        self.execute_text = (
+            f"EXECUTE {name} ({', '.join(['%s'] * param_count)})"
+            if param_count else f"EXECUTE {name}"
+        )
+        return self
+
+
+def _placeholders(query, replace):
+    # Only outside string literals
+    parts = _LITERAL.split(query)
+    for i in range(0, len(parts), 2):
+        parts[i] = replace(parts[i])
+    return "".join(parts)
 
 
-def execute(query, params=()):
-    db = get_db()
+@functools.lru_cache(maxsize=1024)
+def _compile(query, name, dialect):
+    if dialect != "postgres":
+        for pattern, replacement in _SQLITE_REWRITES:
+            query = pattern.sub(replacement, query)
+        return query
+
+    # psycopg2 treats every % as a format character
+    text = _placeholders(query.replace("%", "%%"), lambda p: p.replace("?", "%s"))
+    if not name:
+        return text
+
+    count = itertools.count(1)
+    prepare_text = _placeholders(
+        query, lambda p: re.sub(r"\?", lambda m: f"${next(count)}", p)
+    )
+    return Prepared(text, name, prepare_text, next(count) - 1)
+
+
+def sql(query, name=None):
+    """
+    Compile a query for the active backend: placeholders, and Postgres
+    interval arithmetic on SQLite. Naming a hot query makes it a
+    prepared statement on Postgres.
+    """
+    return _compile(query, name if PG_PREPARE else None, DB_TYPE)
+
+
+def _execute_prepared(db, query, params):
+    cur = db.cursor()
+
+    for retry in (False, True):
+        if query.name not in db.prepared:
+            cur.execute(f"PREPARE {query.name} AS {query.prepare_text}")
+            db.prepared.add(query.name)
+        try:
+            cur.execute(query.execute_text, params)
+            return cur
+        except (psycopg2.errors.InvalidSqlStatementName,
+                psycopg2.errors.FeatureNotSupported):
+            # Statement gone (pooler reset) or stale after a schema change
+            if retry:
+                raise
+            cur.execute("DEALLOCATE ALL")
+            db.prepared.clear()
+
+
+def execute(query, params=(), db=None):
+    db = db or get_db()
 
     if DB_TYPE == "postgres":
+        if isinstance(query, Prepared) and hasattr(db, "prepared"):
+            return _execute_prepared(db, query, params)
+
         cur = db.cursor()
         cur.execute(query, params)
         return cur
@@ -177,16 +1001,101 @@ def execute(query, params=()):
     return db.execute(query, params)
 
 
-def fetchone(query, params=()):
-    cur = execute(query, params)
+def read(query, params=(), db=None):
+    if db is not None:
+        return execute(query, params, db)
+
+    cur = replica_execute(query, params) if use_replica() else None
+    return execute(query, params) if cur is None else cur
+
+
+def fetchone(query, params=(), db=None):
+    cur = read(query, params, db)
     return cur.fetchone()
 
 
-def fetchall(query, params=()):
-    cur = execute(query, params)
+def fetchall(query, params=(), db=None):
+    cur = read(query, params, db)
     return cur.fetchall()
 
 
+def stream(query, params=(), batch=None, db=None):
+    """
+    Iterate a large result set in batches instead of fetchall(): a named
+    (server-side) cursor on Postgres, fetchmany on SQLite. The query runs
+    now; rows are only read as the returned iterator is consumed.
+    """
+    db = db or get_db()
+    batch = batch or STREAM_BATCH
+
+    if DB_TYPE == "postgres":
+        # Named cursors only live inside a transaction
+        db.autocommit = False
+        cur = db.cursor(name=f"stream_{uuid.uuid4().hex}")
+        cur.itersize = batch
+        try:
+            cur.execute(query, params)
+        except Exception:
+            db.rollback()
+            db.autocommit = True
+            raise
+        return _drain(cur, batch, db)
+
+    return _drain(db.execute(query, params), batch)
+
+
+def _drain(cur, batch, pg_db=None):
+    try:
+        while True:
+            rows = cur.fetchmany(batch)
+            if not rows:
+                return
+            yield from rows
+    finally:
+        cur.close()
+        if pg_db is not None:
+            pg_db.rollback()
+            pg_db.autocommit = True
+
+
 def commit(db=None):
+    mark_write()
     if DB_TYPE == "sqlite":
-        (db or get_db()).commit()
\ No newline at end of file
+        (db or get_db()).commit()
+
+
+# Append to a SELECT inside transaction() to lock the rows it reads
+FOR_UPDATE = " FOR UPDATE" if DB_TYPE == "postgres" else ""
+
+
+@contextlib.contextmanager
+def transaction(db=None):
+    """
+    Read-modify-write block: commits at the end, rolls back on error.
+    Rows read with FOR_UPDATE stay locked until then on Postgres; SQLite
+    takes the database write lock up front (BEGIN IMMEDIATE).
+    """
+    db = db or get_db()
+
+    if DB_TYPE == "postgres":
+        db.autocommit = False
+        try:
+            yield db
+            db.commit()
+        except BaseException:
+            db.rollback()
+            raise
+        finally:
+            db.autocommit = True
+        mark_write()
+        return
+
+    if db.in_transaction:
+        db.commit()
+    db.execute("BEGIN IMMEDIATE")
+    try:
+        yield db
+    except BaseException:
+        db.rollback()
+        raise
+    commit(db)
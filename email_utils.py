@@ -1,8 +1,10 @@
-from sendgrid import SendGridAPIClient
-from sendgrid.helpers.mail import Mail, Email
 import os
 
 def send_otp_email(to_email, otp):
+    # Imported here: sendgrid is slow to import and only needed to send
+    from sendgrid import SendGridAPIClient
+    from sendgrid.helpers.mail import Mail, Email
+
     sg = SendGridAPIClient(os.getenv("SENDGRID_API_KEY"))
 
     message = Mail(
@@ -0,0 +1,133 @@
+"""
+Close-order style side effects, run off the request path.
+
+EVENT_BACKEND=thread (default) queues handlers onto an in-process worker
+pool; EVENT_BACKEND=inline runs them synchronously (tests, debugging).
+"""
+import os
+import time
+import queue
+import atexit
+import logging
+import threading
+
+EVENT_BACKEND = os.getenv("EVENT_BACKEND", "thread")
+EVENT_WORKERS = int(os.getenv("EVENT_WORKERS", "4"))
+EVENT_QUEUE_SIZE = int(os.getenv("EVENT_QUEUE_SIZE", "1000"))
+EVENT_RETRY_DELAY = float(os.getenv("EVENT_RETRY_DELAY", "1.0"))
+EVENT_DRAIN_SECONDS = float(os.getenv("EVENT_DRAIN_SECONDS", "5"))
+
+log = logging.getLogger(__name__)
+
+_app = None
+_handlers = {}
+_queue = queue.Queue(maxsize=EVENT_QUEUE_SIZE)
+_started_pid = None
+_start_lock = threading.Lock()
+
+
+def init_app(app):
+    global _app
+    _app = app
+
+
+def subscribe(event, retries=3):
+    """
+    Register a handler(payload) for an event. A failing handler is retried
+    up to `retries` times with exponential backoff; handlers that are not
+    idempotent should pass retries=0.
+    """
+    def decorator(func):
+        _handlers.setdefault(event, []).append((func, retries))
+        return func
+    return decorator
+
+
+def publish(event, payload):
+    for func, retries in _handlers.get(event, []):
+        job = (event, func, payload, retries, 0)
+
+        if EVENT_BACKEND == "inline":
+            _run(job)
+            continue
+
+        _ensure_workers()
+        try:
+            _queue.put_nowait(job)
+        except queue.Full:
+            log.error("event queue full, dropping %s for %s", event, func.__name__)
+
+
+# --------------------------------------------------
+# WORKERS
+# --------------------------------------------------
+
+def _ensure_workers():
+    # Threads do not survive a fork, so start them in each gunicorn worker
+    global _started_pid
+    if _started_pid == os.getpid():
+        return
+
+    with _start_lock:
+        if _started_pid == os.getpid():
+            return
+
+        for n in range(EVENT_WORKERS):
+            threading.Thread(
+                target=_worker, name=f"events-{n}", daemon=True
+            ).start()
+
+        _started_pid = os.getpid()
+
+
+def _worker():
+    while True:
+        job = _queue.get()
+        try:
+            _run(job)
+        finally:
+            _queue.task_done()
+
+
+def _run(job):
+    event, func, payload, retries, attempt = job
+
+    try:
+        with _app.app_context():
+            func(payload)
+    except Exception:
+        if attempt >= retries:
+            log.exception("event %s handler %s failed, giving up", event, func.__name__)
+            return
+
+        delay = EVENT_RETRY_DELAY * (2 ** attempt)
+        log.warning(
+            "event %s handler %s failed, retry %d in %.1fs",
+            event, func.__name__, attempt + 1, delay
+        )
+
+        retry = (event, func, payload, retries, attempt + 1)
+        if EVENT_BACKEND == "inline":
+            time.sleep(delay)
+            _run(retry)
+        else:
+            timer = threading.Timer(delay, _requeue, (retry,))
+            timer.daemon = True
+            timer.start()
+
+
+def _requeue(job):
+    try:
+        _queue.put_nowait(job)
+    except queue.Full:
+        log.error("event queue full, dropping retry of %s", job[0])
+
+
+@atexit.register
+def _drain():
+    if _started_pid != os.getpid():
+        return
+
+    deadline = time.monotonic() + EVENT_DRAIN_SECONDS
+    while _queue.unfinished_tasks and time.monotonic() < deadline:
+        time.sleep(0.05)
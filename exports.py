@@ -0,0 +1,128 @@
+"""
+GST-ready order exports for accountants.
+
+Rows come from db.stream() and are written out a batch at a time, so an
+export of a million orders holds no more in memory than one of a
+hundred.
+"""
+import io
+import csv
+import json
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from db import stream, sql, STREAM_BATCH
+
+FORMATS = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+}
+
+COLUMNS = (
+    "order_id", "created_at", "table_no", "customer_name", "customer_phone",
+    "status", "items", "subtotal", "gst_rate", "cgst", "sgst", "total"
+)
+
+
+# A spreadsheet runs a cell starting with one of these as a formula
+FORMULA_PREFIXES = ("=", "+", "-", "@", "\t", "\r")
+
+
+def _cell(value):
+    """
+    CSV cell safe to open in Excel/Sheets: diner-typed text such as
+    =HYPERLINK(...) is quoted with a leading ' instead of evaluated
+    """
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+def _row(r):
+    items = r["items"]
+    if isinstance(items, str):
+        items = json.loads(items or "[]")
+
+    created_at = r["created_at"]
+    if isinstance(created_at, datetime):
+        created_at = created_at.strftime("%Y-%m-%d %H:%M:%S")
+
+    return {
+        "order_id": r["id"],
+        "created_at": created_at,
+        "table_no": r["table_no"],
+        "customer_name": r["customer_name"],
+        "customer_phone": r["customer_phone"],
+        "status": r["status"],
+        "items": items or [],
+        "subtotal": float(r["subtotal"] or 0),
+        "gst_rate": (r["gst_rate_bp"] or 0) / 100,
+        "cgst": float(r["cgst"] or 0),
+        "sgst": float(r["sgst"] or 0),
+        "total": float(r["total"] or 0),
+    }
+
+
+def orders(restaurant_id, start, end, status=None):
+    """
+    Orders created between start and end (inclusive dates), oldest first
+    """
+    query = """
+        SELECT id, created_at, table_no, customer_name, customer_phone,
+               status, items, subtotal, gst_rate_bp, cgst, sgst, total
+        FROM orders_history
+        WHERE restaurant_id=?
+        AND created_at >= ?
+        AND created_at < ?
+    """
+    params = [restaurant_id, start.isoformat(), (end + timedelta(days=1)).isoformat()]
+
+    if status:
+        query += " AND status=?"
+        params.append(status)
+
+    return stream(sql(query + " ORDER BY created_at, id"), params)
+
+
+def _batched(rows):
+    batch = []
+    for r in rows:
+        batch.append(_row(r))
+        if len(batch) >= STREAM_BATCH:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def to_csv(rows):
+    """
+    Header, then one line per order; items as "qty x name @ price; ..."
+    """
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(COLUMNS)
+
+    for batch in _batched(rows):
+        for o in batch:
+            o["items"] = "; ".join(
+                f'{i["qty"]} x {i["name"]} @ {i["price"]}' for i in o["items"]
+            )
+            writer.writerow([_cell(o[c]) for c in COLUMNS])
+        yield buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+
+    if buf.tell():
+        yield buf.getvalue()
+
+
+def to_ndjson(rows):
+    for batch in _batched(rows):
+        yield "".join(json.dumps(o, default=_json_default) + "\n" for o in batch)
+
+
+def _json_default(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    return str(value)
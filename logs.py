@@ -0,0 +1,163 @@
+"""
+Structured JSON logging that never blocks a request thread.
+
+Records are tagged with request id, restaurant id and route on the
+request thread, then handed to a bounded in-memory queue; one listener
+thread per process writes them to stdout as JSON lines. If the queue is
+full the record is dropped (and counted) rather than stalling a request.
+
+Each request also gets one access line. High-frequency routes (kitchen
+polling) can be sampled with LOG_SAMPLE, e.g.
+"kitchen_orders=0.05,api_kitchen_additions=0.05": a sampled-out request
+drops all its info lines; warnings and errors are always kept.
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import queue
+import atexit
+import random
+import logging
+import threading
+import logging.handlers
+
+from flask import g, request, session, has_request_context
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_SAMPLE = os.getenv(
+    "LOG_SAMPLE",
+    "kitchen_orders=0.05,api_kitchen_additions=0.05,claim_kitchen_additions=0.05,"
+    "table_status_feed=0.05"
+)
+
+SAMPLE_RATES = {
+    route.strip(): float(rate)
+    for route, rate in (
+        pair.split("=", 1) for pair in LOG_SAMPLE.split(",") if "=" in pair
+    )
+}
+
+# Attributes every LogRecord has; anything else came from `extra=`
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message"}
+
+log = logging.getLogger("app.requests")
+
+
+class JSONFormatter(logging.Formatter):
+
+    def format(self, record):
+        entry = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created))
+                  + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class RequestContextFilter(logging.Filter):
+    """
+    Runs on the request thread: tags the record and applies sampling
+    """
+
+    def filter(self, record):
+        if not has_request_context():
+            return True
+
+        record.request_id = getattr(g, "request_id", None)
+        record.restaurant_id = session.get("restaurant_id")
+        record.route = request.endpoint
+
+        return record.levelno >= logging.WARNING or getattr(g, "log_sampled", True)
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+
+    dropped = 0
+
+    def prepare(self, record):
+        # Render message and traceback now; the listener only serialises
+        record.message = record.getMessage()
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.msg, record.args, record.exc_info = record.message, None, None
+
+        # Report earlier overflow on the next record that gets through
+        if NonBlockingQueueHandler.dropped:
+            record.log_dropped, NonBlockingQueueHandler.dropped = NonBlockingQueueHandler.dropped, 0
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            NonBlockingQueueHandler.dropped += 1
+
+
+_handler = NonBlockingQueueHandler(queue.Queue(maxsize=LOG_QUEUE_SIZE))
+_handler.addFilter(RequestContextFilter())
+_listener_pid = None
+_listener_lock = threading.Lock()
+
+
+def _ensure_listener():
+    # The listener thread does not survive a gunicorn fork
+    global _listener_pid
+    if _listener_pid == os.getpid():
+        return
+
+    with _listener_lock:
+        if _listener_pid == os.getpid():
+            return
+
+        out = logging.StreamHandler(sys.stdout)
+        out.setFormatter(JSONFormatter())
+        listener = logging.handlers.QueueListener(_handler.queue, out)
+        listener.start()
+        atexit.register(listener.stop)   # flush what is queued on shutdown
+        _listener_pid = os.getpid()
+
+
+def init_app(app):
+    from flask.logging import default_handler
+
+    root = logging.getLogger()
+    root.setLevel(LOG_LEVEL)
+    root.handlers = [_handler]
+    app.logger.removeHandler(default_handler)
+    _ensure_listener()
+
+    @app.before_request
+    def start_request_log():
+        _ensure_listener()
+        g.request_id = request.headers.get("X-Request-ID") or uuid.uuid4().hex[:16]
+        g.request_started = time.perf_counter()
+        rate = SAMPLE_RATES.get(request.endpoint)
+        g.log_sampled = rate is None or random.random() < rate
+
+    @app.after_request
+    def finish_request_log(response):
+        response.headers["X-Request-ID"] = g.get("request_id", "")
+        started = g.get("request_started")
+
+        log.log(
+            logging.ERROR if response.status_code >= 500 else logging.INFO,
+            "request",
+            extra={
+                "method": request.method,
+                "path": request.path,
+                "status": response.status_code,
+                "duration_ms": round((time.perf_counter() - started) * 1000, 2)
+                if started else None,
+            }
+        )
+        return response
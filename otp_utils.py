@@ -1,7 +1,81 @@
-import random
+import os
+import hmac
+import time
+import secrets
+import hashlib
+
+from db import execute, commit, sql
+
+OTP_TTL_SECONDS = int(os.getenv("OTP_TTL_SECONDS", "600"))
+OTP_MAX_ATTEMPTS = int(os.getenv("OTP_MAX_ATTEMPTS", "5"))
+
+# Codes are stored as HMACs, never in clear
+OTP_PEPPER = os.getenv("SECRET_KEY", "dev-secret").encode()
+
 
 def generate_otp():
     """
     Generate a 6-digit numeric OTP
     """
-    return str(random.randint(100000, 999999))
+    return str(100000 + secrets.randbelow(900000))
+
+
+def _digest(email, purpose, code):
+    message = f"{email}:{purpose}:{code}".encode()
+    return hmac.new(OTP_PEPPER, message, hashlib.sha256).hexdigest()
+
+
+# --------------------------------------------------
+# OTP STORE (otp_codes table, both backends)
+# --------------------------------------------------
+
+def issue_otp(email, purpose):
+    """
+    Create (or replace) the code for this email and purpose
+    ("verify" or "reset") and return it for sending. Commits.
+    """
+    code = generate_otp()
+    now = int(time.time())
+
+    execute(sql("DELETE FROM otp_codes WHERE expires_at < ?"), (now,))
+    execute(sql("""
+        INSERT INTO otp_codes (email, purpose, code_hash, expires_at, attempts)
+        VALUES (?, ?, ?, ?, 0)
+        ON CONFLICT (email, purpose) DO UPDATE
+        SET code_hash = excluded.code_hash,
+            expires_at = excluded.expires_at,
+            attempts = 0
+    """), (email, purpose, _digest(email, purpose, code), now + OTP_TTL_SECONDS))
+    commit()
+
+    return code
+
+
+def verify_otp(email, purpose, code):
+    """
+    True if `code` is the live code for this email and purpose. Every
+    check spends an attempt; a code is single-use and dies after
+    OTP_MAX_ATTEMPTS wrong guesses. Commits.
+    """
+    rows = execute(sql("""
+        UPDATE otp_codes
+        SET attempts = attempts + 1
+        WHERE email=? AND purpose=? AND expires_at >= ? AND attempts < ?
+        RETURNING code_hash
+    """), (email, purpose, int(time.time()), OTP_MAX_ATTEMPTS)).fetchall()
+
+    ok = bool(rows) and hmac.compare_digest(
+        rows[0]["code_hash"], _digest(email, purpose, str(code).strip())
+    )
+
+    if ok:
+        clear_otp(email, purpose)
+    else:
+        commit()
+
+    return ok
+
+
+def clear_otp(email, purpose):
+    execute(sql("DELETE FROM otp_codes WHERE email=? AND purpose=?"), (email, purpose))
+    commit()
@@ -0,0 +1,86 @@
+"""
+Password hashing off the request thread.
+
+PBKDF2/scrypt cost hundreds of milliseconds of CPU by design. Hashes run
+on a small per-process thread pool (hashlib releases the GIL, so it uses
+every core); a bounded number may wait, beyond which callers get
+PasswordHashBusy straight away instead of piling up behind a shift
+change's worth of logins.
+
+PASSWORD_HASH_METHOD sets the full Werkzeug method for new hashes, e.g.
+"pbkdf2:sha256:600000" or "scrypt:32768:8:1". Stored hashes made with
+other parameters still verify and are upgraded on the next login.
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+from werkzeug.security import generate_password_hash, check_password_hash
+
+PASSWORD_HASH_METHOD = os.getenv("PASSWORD_HASH_METHOD", "pbkdf2:sha256:600000")
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(os.cpu_count() or 1)))
+PASSWORD_HASH_QUEUE = int(os.getenv("PASSWORD_HASH_QUEUE", "32"))
+PASSWORD_HASH_TIMEOUT = float(os.getenv("PASSWORD_HASH_TIMEOUT", "10"))
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(PASSWORD_HASH_WORKERS + PASSWORD_HASH_QUEUE)
+
+
+class PasswordHashBusy(Exception):
+    """Too many hashes already running or queued in this worker."""
+
+
+def _executor():
+    # Pool threads do not survive a gunicorn fork
+    global _pool, _pool_pid
+    if _pool_pid != os.getpid():
+        with _pool_lock:
+            if _pool_pid != os.getpid():
+                _pool = ThreadPoolExecutor(
+                    max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="pwhash"
+                )
+                _pool_pid = os.getpid()
+    return _pool
+
+
+def _run(fn, *args):
+    if not _slots.acquire(blocking=False):
+        raise PasswordHashBusy()
+    try:
+        future = _executor().submit(fn, *args)
+    except BaseException:
+        _slots.release()
+        raise
+
+    # The slot is held until the hash is done, not until we stop waiting,
+    # so a caller that times out cannot leave the pool's queue unbounded
+    future.add_done_callback(lambda _: _slots.release())
+    try:
+        return future.result(timeout=PASSWORD_HASH_TIMEOUT)
+    except FutureTimeout:
+        raise PasswordHashBusy()
+
+
+def hash_password(password):
+    return _run(generate_password_hash, password, PASSWORD_HASH_METHOD)
+
+
+def needs_rehash(stored):
+    return not stored.startswith(PASSWORD_HASH_METHOD + "$")
+
+
+def verify_password(stored, password):
+    """
+    (ok, new_hash): new_hash is set when the password matched but the
+    stored hash uses old parameters and should be replaced
+    """
+    def check():
+        if not check_password_hash(stored, password):
+            return False, None
+        if needs_rehash(stored):
+            return True, generate_password_hash(password, PASSWORD_HASH_METHOD)
+        return True, None
+
+    return _run(check)
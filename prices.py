@@ -0,0 +1,107 @@
+"""
+Per-restaurant price map for validating /order without a menu query per
+line: {menu id: (name, price, available, station)}, built from `menu`
+and `kitchen_stations` on first use.
+
+Each worker keeps its own copy, tagged with the restaurant's "menu:<id>"
+version in the shared cache. Menu and station writes call invalidate(),
+which bumps that version (and drops the shared customer menu with it);
+other workers rebuild within shared_cache.CACHE_VERSION_TTL.
+PRICE_MAP_TTL bounds staleness across hosts without a shared backend,
+for both the price map and the cached customer menu, so the page never
+shows prices older than the ones /order charges.
+"""
+import os
+import time
+import threading
+
+import shared_cache
+from db import fetchall, sql
+
+PRICE_MAP_TTL = float(os.getenv("PRICE_MAP_TTL", "300"))
+MAX_LINE_QTY = int(os.getenv("MAX_LINE_QTY", "100"))
+
+# Categories without a kitchen_stations row go to this station
+DEFAULT_STATION = os.getenv("KITCHEN_DEFAULT_STATION", "main")
+
+_maps = {}   # restaurant_id -> (version, built_at, {id: (name, price, available, station)})
+_lock = threading.Lock()
+
+
+def menu_namespace(restaurant_id):
+    return f"menu:{int(restaurant_id)}"
+
+
+def invalidate(restaurant_id):
+    """
+    Call after any write to this restaurant's menu or stations
+    """
+    shared_cache.invalidate(menu_namespace(restaurant_id))
+
+    with _lock:
+        _maps.pop(int(restaurant_id), None)
+
+
+def price_map(restaurant_id):
+    """
+    {menu id: (name, price, available, station)} for the current tenant
+    database
+    """
+    restaurant_id = int(restaurant_id)
+    version = shared_cache.version(menu_namespace(restaurant_id))
+
+    cached = _maps.get(restaurant_id)
+    if cached and cached[0] == version and time.monotonic() - cached[1] < PRICE_MAP_TTL:
+        return cached[2]
+
+    rows = fetchall(sql("""
+        SELECT m.id, m.name, m.price, m.available,
+               COALESCE(s.station, ?) AS station
+        FROM menu m
+        LEFT JOIN kitchen_stations s
+            ON s.restaurant_id = m.restaurant_id AND s.category = m.category
+        WHERE m.restaurant_id=?
+    """), (DEFAULT_STATION, restaurant_id))
+
+    menu = {
+        r["id"]: (r["name"], float(r["price"]), bool(r["available"]), r["station"])
+        for r in rows
+    }
+
+    with _lock:
+        _maps[restaurant_id] = (version, time.monotonic(), menu)
+    return menu
+
+
+def resolve(restaurant_id, items):
+    """
+    Turn client order lines into stored lines using menu names/prices,
+    tagged with the kitchen station that prepares them.
+    Returns (lines, rejected); rejected lists {"id", "reason"} for unknown
+    or unavailable items and bad quantities.
+    """
+    menu = price_map(restaurant_id)
+    lines, rejected = [], []
+
+    for i in items:
+        try:
+            item_id = int(i["id"])
+            qty = int(i["qty"])
+        except (KeyError, TypeError, ValueError):
+            rejected.append({"id": i.get("id") if isinstance(i, dict) else None,
+                             "reason": "invalid"})
+            continue
+
+        entry = menu.get(item_id)
+        if entry is None:
+            rejected.append({"id": item_id, "reason": "unknown"})
+        elif not entry[2]:
+            rejected.append({"id": item_id, "reason": "unavailable"})
+        elif not 1 <= qty <= MAX_LINE_QTY:
+            rejected.append({"id": item_id, "reason": "invalid_qty"})
+        else:
+            lines.append({
+                "name": entry[0], "price": entry[1], "qty": qty, "station": entry[3]
+            })
+
+    return lines, rejected
@@ -0,0 +1,267 @@
+import json
+from datetime import datetime, timedelta
+
+from db import execute, fetchall, sql, transaction
+
+BUCKET_MINUTES = 15
+
+# Orders are bucketed by created_at (not close time) so that a rebuild
+# from the orders table reproduces the incremental rollup exactly.
+
+
+def bucket_start(ts):
+    if isinstance(ts, str):
+        ts = datetime.fromisoformat(ts)
+
+    ts = ts.replace(tzinfo=None, second=0, microsecond=0)
+    return ts - timedelta(minutes=ts.minute % BUCKET_MINUTES)
+
+
+def bucket_key(ts):
+    return bucket_start(ts).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _parse_items(items):
+    if isinstance(items, str):
+        items = json.loads(items or "[]")
+    return items or []
+
+
+def _item_totals(items):
+    totals = {}
+    for i in _parse_items(items):
+        qty, revenue = totals.get(i["name"], (0, 0.0))
+        totals[i["name"]] = (
+            qty + int(i["qty"]),
+            revenue + float(i["price"]) * int(i["qty"])
+        )
+    return totals
+
+
+# --------------------------------------------------
+# INCREMENTAL UPDATE
+# --------------------------------------------------
+
+def record_closed_order(order):
+    """
+    Add one closed order (restaurant_id, items, total, created_at) to the
+    rollup. Caller commits, and must call this once per order: claim it
+    first by flipping orders.rolled_up in the same transaction.
+    """
+    bucket = bucket_key(order["created_at"])
+
+    execute(sql("""
+        INSERT INTO sales_buckets (restaurant_id, bucket, orders, revenue)
+        VALUES (?, ?, 1, ?)
+        ON CONFLICT (restaurant_id, bucket)
+        DO UPDATE SET orders = sales_buckets.orders + 1,
+                      revenue = sales_buckets.revenue + excluded.revenue
+    """), (order["restaurant_id"], bucket, float(order["total"] or 0)))
+
+    for name, (qty, revenue) in _item_totals(order["items"]).items():
+        execute(sql("""
+            INSERT INTO sales_rollup (restaurant_id, bucket, item_name, qty, revenue)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (restaurant_id, bucket, item_name)
+            DO UPDATE SET qty = sales_rollup.qty + excluded.qty,
+                          revenue = sales_rollup.revenue + excluded.revenue
+        """), (order["restaurant_id"], bucket, name, qty, round(revenue, 2)))
+
+
+def roll_up(order_id, restaurant_id):
+    """
+    Add a Closed order to the rollup unless it is already in; safe to
+    retry. Returns True if it was added now.
+    """
+    with transaction():
+        rows = execute(sql("""
+            UPDATE orders
+            SET rolled_up=1
+            WHERE id=? AND restaurant_id=? AND status='Closed' AND rolled_up=0
+            RETURNING restaurant_id, items, total, created_at
+        """), (order_id, restaurant_id)).fetchall()
+
+        if rows:
+            record_closed_order(rows[0])
+
+    return bool(rows)
+
+
+def roll_up_pending(restaurant_id=None):
+    """
+    Add Closed orders whose order.closed event was lost (full queue,
+    worker restart). Returns the number added.
+    """
+    query = "SELECT id, restaurant_id FROM orders WHERE status='Closed' AND rolled_up=0"
+    params = ()
+
+    if restaurant_id is not None:
+        query += " AND restaurant_id=?"
+        params = (restaurant_id,)
+
+    return sum(
+        roll_up(o["id"], o["restaurant_id"])
+        for o in fetchall(sql(query), params)
+    )
+
+
+# --------------------------------------------------
+# REBUILD / CONSISTENCY CHECK
+# --------------------------------------------------
+
+def _scan_orders(restaurant_id=None):
+    query = """
+        SELECT restaurant_id, items, total, created_at
+        FROM orders_history
+        WHERE status='Closed'
+    """
+    params = ()
+
+    if restaurant_id is not None:
+        query += " AND restaurant_id=?"
+        params = (restaurant_id,)
+
+    buckets, lines = {}, {}
+
+    for o in fetchall(sql(query), params):
+        key = (o["restaurant_id"], bucket_key(o["created_at"]))
+        orders, revenue = buckets.get(key, (0, 0.0))
+        buckets[key] = (orders + 1, revenue + float(o["total"] or 0))
+
+        for name, (qty, rev) in _item_totals(o["items"]).items():
+            q, r = lines.get(key + (name,), (0, 0.0))
+            lines[key + (name,)] = (q + qty, r + rev)
+
+    return buckets, lines
+
+
+def _stored(restaurant_id=None):
+    where, params = "", ()
+    if restaurant_id is not None:
+        where, params = " WHERE restaurant_id=?", (restaurant_id,)
+
+    buckets = {
+        (r["restaurant_id"], bucket_key(r["bucket"])): (r["orders"], float(r["revenue"]))
+        for r in fetchall(sql(
+            "SELECT restaurant_id, bucket, orders, revenue FROM sales_buckets" + where
+        ), params)
+    }
+    lines = {
+        (r["restaurant_id"], bucket_key(r["bucket"]), r["item_name"]): (r["qty"], float(r["revenue"]))
+        for r in fetchall(sql(
+            "SELECT restaurant_id, bucket, item_name, qty, revenue FROM sales_rollup" + where
+        ), params)
+    }
+    return buckets, lines
+
+
+def rebuild(restaurant_id=None):
+    """
+    Recompute the rollup from closed orders. Caller commits.
+    """
+    where, params = "", ()
+    if restaurant_id is not None:
+        where, params = " WHERE restaurant_id=?", (restaurant_id,)
+
+    execute(sql("DELETE FROM sales_buckets" + where), params)
+    execute(sql("DELETE FROM sales_rollup" + where), params)
+
+    # Every closed order is counted below; the close handler must not add
+    # them again
+    execute(sql(
+        "UPDATE orders SET rolled_up=1 WHERE status='Closed' AND rolled_up=0"
+        + where.replace(" WHERE", " AND")
+    ), params)
+
+    buckets, lines = _scan_orders(restaurant_id)
+
+    for (rid, bucket), (orders, revenue) in buckets.items():
+        execute(sql("""
+            INSERT INTO sales_buckets (restaurant_id, bucket, orders, revenue)
+            VALUES (?, ?, ?, ?)
+        """), (rid, bucket, orders, round(revenue, 2)))
+
+    for (rid, bucket, name), (qty, revenue) in lines.items():
+        execute(sql("""
+            INSERT INTO sales_rollup (restaurant_id, bucket, item_name, qty, revenue)
+            VALUES (?, ?, ?, ?, ?)
+        """), (rid, bucket, name, qty, round(revenue, 2)))
+
+    return len(buckets), len(lines)
+
+
+def check(restaurant_id=None):
+    """
+    Compare the stored rollup with a fresh scan; returns mismatched keys
+    """
+    expected = _scan_orders(restaurant_id)
+    stored = _stored(restaurant_id)
+
+    mismatches = []
+    for want, have in zip(expected, stored):
+        for key in want.keys() | have.keys():
+            a, b = want.get(key, (0, 0.0)), have.get(key, (0, 0.0))
+            if a[0] != b[0] or abs(a[1] - b[1]) > 0.005:
+                mismatches.append({"key": list(key), "expected": a, "stored": b})
+
+    return mismatches
+
+
+# --------------------------------------------------
+# CHART READS
+# --------------------------------------------------
+
+def day_series(restaurant_id, day):
+    """
+    Orders and revenue for every bucket of one (UTC) day, zero filled
+    """
+    start = datetime.combine(day, datetime.min.time())
+    end = start + timedelta(days=1)
+
+    rows = fetchall(sql("""
+        SELECT bucket, orders, revenue
+        FROM sales_buckets
+        WHERE restaurant_id=?
+        AND bucket >= ?
+        AND bucket < ?
+    """), (restaurant_id, bucket_key(start), bucket_key(end)))
+
+    found = {bucket_key(r["bucket"]): r for r in rows}
+    series = []
+
+    t = start
+    while t < end:
+        r = found.get(bucket_key(t))
+        series.append({
+            "bucket": t.strftime("%H:%M"),
+            "orders": r["orders"] if r else 0,
+            "revenue": round(float(r["revenue"]), 2) if r else 0.0
+        })
+        t += timedelta(minutes=BUCKET_MINUTES)
+
+    return series
+
+
+def daily_totals(restaurant_id, start, end):
+    """
+    {date: (orders, revenue)} for start..end inclusive
+    """
+    rows = fetchall(sql("""
+        SELECT DATE(bucket) AS day,
+               SUM(orders) AS orders,
+               SUM(revenue) AS revenue
+        FROM sales_buckets
+        WHERE restaurant_id=?
+        AND bucket >= ?
+        AND bucket < ?
+        GROUP BY DATE(bucket)
+    """), (
+        restaurant_id,
+        start.isoformat(),
+        (end + timedelta(days=1)).isoformat()
+    ))
+
+    return {
+        str(r["day"]): (int(r["orders"]), round(float(r["revenue"]), 2))
+        for r in rows
+    }
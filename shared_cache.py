@@ -0,0 +1,263 @@
+"""
+Cache shared by every gunicorn worker on the host.
+
+Entries live in a namespace with a version number; invalidate(namespace)
+bumps the version, so every worker stops seeing the old entries the next
+time it checks. Workers re-read a namespace's version at most every
+CACHE_VERSION_TTL seconds, which bounds how long a stale entry can be
+served after a write on another worker. Old-version entries are never
+read again and age out by LRU.
+
+CACHE_BACKEND=sqlite (default) keeps entries in a small local file with
+LRU eviction at CACHE_MAX_ENTRIES; =redis uses REDIS_URL (set an
+allkeys-lru maxmemory policy there); =memory is a per-process stand-in
+for tests and single-process dev. Values must be JSON-serialisable.
+"""
+import os
+import json
+import time
+import sqlite3
+import logging
+import tempfile
+import threading
+from collections import OrderedDict
+from decimal import Decimal
+from datetime import date, datetime
+
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "sqlite")
+CACHE_DB = os.getenv(
+    "CACHE_DB", os.path.join(tempfile.gettempdir(), "qr_restaurant_cache.db")
+)
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "5000"))
+CACHE_DEFAULT_TTL = float(os.getenv("CACHE_DEFAULT_TTL", "3600"))
+CACHE_VERSION_TTL = float(os.getenv("CACHE_VERSION_TTL", "1"))
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+
+# LRU recency is only rewritten when older than this (reads stay reads)
+CACHE_TOUCH_SECONDS = 10
+
+log = logging.getLogger(__name__)
+
+
+def _encode(value):
+    def default(v):
+        if isinstance(v, Decimal):
+            return float(v)
+        if isinstance(v, (datetime, date)):
+            return v.isoformat()
+        raise TypeError(f"{type(v).__name__} is not cacheable")
+    return json.dumps(value, default=default)
+
+
+# --------------------------------------------------
+# BACKENDS
+# --------------------------------------------------
+
+class MemoryBackend:
+
+    def __init__(self, max_entries):
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()   # key -> (expires, payload)
+        self.versions = {}
+        self.max_entries = max_entries
+
+    def get(self, key, now):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] < now:
+                return None
+            self.entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, payload, expires):
+        with self.lock:
+            self.entries[key] = (expires, payload)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def version(self, namespace):
+        return self.versions.get(namespace, 0)
+
+    def bump(self, namespace):
+        with self.lock:
+            self.versions[namespace] = self.versions.get(namespace, 0) + 1
+
+
+class SQLiteBackend:
+
+    def __init__(self, path, max_entries):
+        self.path = path
+        self.max_entries = max_entries
+        self.local = threading.local()
+        self.sets = 0
+
+    def _db(self):
+        db = getattr(self.local, "db", None)
+        if db is None or self.local.pid != os.getpid():
+            db = sqlite3.connect(self.path, timeout=1, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=OFF")   # cache contents are disposable
+            db.execute("""
+                CREATE TABLE IF NOT EXISTS entries (
+                    key TEXT PRIMARY KEY,
+                    payload TEXT NOT NULL,
+                    expires REAL NOT NULL,
+                    used REAL NOT NULL
+                )
+            """)
+            db.execute("CREATE INDEX IF NOT EXISTS idx_entries_used ON entries(used)")
+            db.execute("""
+                CREATE TABLE IF NOT EXISTS versions (
+                    namespace TEXT PRIMARY KEY,
+                    version INTEGER NOT NULL
+                )
+            """)
+            self.local.db, self.local.pid = db, os.getpid()
+        return db
+
+    def get(self, key, now):
+        db = self._db()
+        row = db.execute(
+            "SELECT payload, expires, used FROM entries WHERE key=?", (key,)
+        ).fetchone()
+        if row is None or row[1] < now:
+            return None
+
+        if now - row[2] > CACHE_TOUCH_SECONDS:
+            db.execute("UPDATE entries SET used=? WHERE key=?", (now, key))
+        return row[0]
+
+    def set(self, key, payload, expires):
+        db = self._db()
+        now = time.time()
+        db.execute(
+            "INSERT OR REPLACE INTO entries (key, payload, expires, used) VALUES (?, ?, ?, ?)",
+            (key, payload, expires, now)
+        )
+
+        # Evict now and then rather than counting on every write
+        self.sets += 1
+        if self.sets % 100 == 0:
+            self.evict(now)
+
+    def evict(self, now):
+        db = self._db()
+        db.execute("DELETE FROM entries WHERE expires < ?", (now,))
+        extra = db.execute("SELECT COUNT(*) FROM entries").fetchone()[0] - self.max_entries
+        if extra > 0:
+            db.execute("""
+                DELETE FROM entries WHERE key IN (
+                    SELECT key FROM entries ORDER BY used LIMIT ?
+                )
+            """, (extra,))
+
+    def version(self, namespace):
+        row = self._db().execute(
+            "SELECT version FROM versions WHERE namespace=?", (namespace,)
+        ).fetchone()
+        return row[0] if row else 0
+
+    def bump(self, namespace):
+        self._db().execute("""
+            INSERT INTO versions (namespace, version) VALUES (?, 1)
+            ON CONFLICT (namespace) DO UPDATE SET version = version + 1
+        """, (namespace,))
+
+
+class RedisBackend:
+
+    def __init__(self, url):
+        import redis
+        self.redis = redis.Redis.from_url(url)
+
+    def get(self, key, now):
+        payload = self.redis.get(f"cache:{key}")
+        return payload.decode() if payload is not None else None
+
+    def set(self, key, payload, expires):
+        ttl = max(1, int(expires - time.time()))
+        self.redis.set(f"cache:{key}", payload, ex=ttl)
+
+    def version(self, namespace):
+        return int(self.redis.get(f"cache-version:{namespace}") or 0)
+
+    def bump(self, namespace):
+        self.redis.incr(f"cache-version:{namespace}")
+
+
+if CACHE_BACKEND == "memory":
+    backend = MemoryBackend(CACHE_MAX_ENTRIES)
+elif CACHE_BACKEND == "redis":
+    backend = RedisBackend(REDIS_URL)
+else:
+    backend = SQLiteBackend(CACHE_DB, CACHE_MAX_ENTRIES)
+
+# Backend errors degrade to a cache miss, never a failed request
+_ERRORS = (sqlite3.Error,)
+if CACHE_BACKEND == "redis":
+    import redis
+    _ERRORS += (redis.RedisError,)
+
+
+# --------------------------------------------------
+# VERSIONED KEYS
+# --------------------------------------------------
+
+_versions = {}   # namespace -> (version, checked_at), per worker
+_versions_lock = threading.Lock()
+
+
+def version(namespace):
+    now = time.monotonic()
+    cached = _versions.get(namespace)
+    if cached and now - cached[1] < CACHE_VERSION_TTL:
+        return cached[0]
+
+    try:
+        current = backend.version(namespace)
+    except _ERRORS:
+        log.exception("shared cache unavailable, reusing version of %s", namespace)
+        current = cached[0] if cached else -1
+
+    with _versions_lock:
+        _versions[namespace] = (current, now)
+    return current
+
+
+def invalidate(namespace):
+    """
+    Drop every entry in `namespace` for all workers (this one at once,
+    the others within CACHE_VERSION_TTL)
+    """
+    try:
+        backend.bump(namespace)
+    except _ERRORS:
+        log.exception("shared cache unavailable, invalidation of %s lost", namespace)
+    with _versions_lock:
+        _versions.pop(namespace, None)
+
+
+def get_or_load(namespace, key, loader, ttl=None):
+    """
+    Cached value for (namespace, key), calling loader() on a miss.
+    None is never cached, so a lookup that found nothing is retried.
+    """
+    full_key = f"{namespace}:{version(namespace)}:{key}"
+    try:
+        payload = backend.get(full_key, time.time())
+    except _ERRORS:
+        log.exception("shared cache unavailable, loading %s directly", namespace)
+        return loader()
+
+    if payload is not None:
+        return json.loads(payload)
+
+    value = loader()
+    if value is None:
+        return None
+    try:
+        backend.set(full_key, _encode(value), time.time() + (ttl or CACHE_DEFAULT_TTL))
+    except _ERRORS:
+        log.exception("shared cache unavailable, not storing %s", namespace)
+    return value
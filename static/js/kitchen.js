@@ -6,6 +6,12 @@ const lastOrderIds = new Set();
 const lastAdditionIds = new Set();
 const updatingOrders = new Set();
 
+// Multi-select (kept across re-renders) and the latest feeds
+const selectedOrders = new Set();
+const selectedAdditions = new Set();
+let currentOrders = [];
+let currentAdditions = [];
+
 /* ================= SOUND ================= */
 
 function playSound() {
@@ -27,11 +33,20 @@ function getStatusColor(status) {
 
 /* ================= RENDER ORDERS ================= */
 
+function nextStatusFor(status) {
+    return status === "Received" ? "Preparing" :
+        status === "Preparing" ? "Ready" :
+        "Served";
+}
+
 function renderOrders(orders) {
     const activeOrders = orders.filter(o =>
         ["Received", "Preparing", "Ready"].includes(o.status)
     );
 
+    currentOrders = activeOrders;
+    pruneSelection(selectedOrders, activeOrders);
+
     pendingCount.innerText = activeOrders.length;
 
     if (!activeOrders.length) {
@@ -50,15 +65,17 @@ function renderOrders(orders) {
             .map(i => `<div class="mb-1">${i.qty} × ${i.name}</div>`)
             .join("");
 
-        const nextStatus =
-            o.status === "Received" ? "Preparing" :
-            o.status === "Preparing" ? "Ready" :
-            "Served";
+        const nextStatus = nextStatusFor(o.status);
 
         return `
             <div class="bg-white w-96 rounded-xl shadow-xl text-gray-900 border-t-8 ${getStatusColor(o.status)}">
 
                 <div class="p-5 border-b">
+                    <label class="float-right">
+                        <input type="checkbox" class="w-6 h-6"
+                            ${selectedOrders.has(o.id) ? "checked" : ""}
+                            onchange="toggleSelected(selectedOrders, ${o.id}, this.checked)">
+                    </label>
                     <h2 class="text-4xl font-black">
                         TABLE ${o.table_no}
                     </h2>
@@ -90,7 +107,8 @@ function renderOrders(orders) {
 /* ================= LOAD ORDERS ================= */
 
 function loadKitchenOrders() {
-    fetch("/api/kitchen/orders")
+    const query = station ? `?station=${encodeURIComponent(station)}` : "";
+    fetch(`/api/kitchen/orders${query}`)
         .then(res => res.json())
         .then(orders => {
 
@@ -115,6 +133,9 @@ function loadKitchenOrders() {
 /* ================= ADDITIONS ================= */
 
 function renderAdditions(additions) {
+    currentAdditions = additions;
+    pruneSelection(selectedAdditions, additions);
+
     if (!additions.length) {
         additionsContainer.innerHTML =
             `<p class="text-gray-500">No new additions</p>`;
@@ -123,6 +144,11 @@ function renderAdditions(additions) {
 
     additionsContainer.innerHTML = additions.map(a => `
         <div class="bg-red-600 text-white p-4 rounded-lg shadow">
+            <label class="float-right">
+                <input type="checkbox" class="w-5 h-5"
+                    ${selectedAdditions.has(a.id) ? "checked" : ""}
+                    onchange="toggleSelected(selectedAdditions, ${a.id}, this.checked)">
+            </label>
             <h3 class="text-lg font-black">
                 TABLE ${a.table_no}
             </h3>
@@ -139,8 +165,17 @@ function renderAdditions(additions) {
     `).join("");
 }
 
+// Each screen leases its own tickets so screens never double up
+const screenId = localStorage.getItem("kitchenScreenId") ||
+    Math.random().toString(36).slice(2, 12);
+localStorage.setItem("kitchenScreenId", screenId);
+
 function loadKitchenAdditions() {
-    fetch("/api/kitchen/additions")
+    fetch("/api/kitchen/additions/claim", {
+        method: "POST",
+        headers: { "Content-Type": "application/json" },
+        body: JSON.stringify({ screen: screenId, station: station || null })
+    })
         .then(res => res.json())
         .then(additions => {
 
@@ -189,8 +224,102 @@ function markAdditionDone(id) {
         });
 }
 
+/* ================= BATCH ACTIONS ================= */
+
+function toggleSelected(set, id, checked) {
+    if (checked) set.add(id);
+    else set.delete(id);
+}
+
+function pruneSelection(set, rows) {
+    const visible = new Set(rows.map(r => r.id));
+    [...set].forEach(id => {
+        if (!visible.has(id)) set.delete(id);
+    });
+}
+
+// One request (one UPDATE server side) for the whole batch
+async function postStatusBatch(url, updates) {
+    if (!updates.length) return;
+
+    const res = await fetch(url, {
+        method: "POST",
+        headers: { "Content-Type": "application/json" },
+        body: JSON.stringify({ updates })
+    });
+
+    if (!res.ok) throw new Error(`Batch update failed (${res.status})`);
+    return res.json();
+}
+
+async function bumpOrders(onlySelected) {
+    const orders = currentOrders.filter(o =>
+        !onlySelected || selectedOrders.has(o.id)
+    );
+
+    try {
+        await postStatusBatch(
+            "/api/kitchen/orders/status",
+            orders.map(o => ({ id: o.id, status: nextStatusFor(o.status) }))
+        );
+        orders.forEach(o => selectedOrders.delete(o.id));
+    } catch (err) {
+        alert("Failed to update orders");
+    }
+
+    loadKitchenOrders();
+}
+
+async function bumpAdditions(onlySelected) {
+    const additions = currentAdditions.filter(a =>
+        !onlySelected || selectedAdditions.has(a.id)
+    );
+
+    try {
+        await postStatusBatch(
+            "/api/kitchen/additions/status",
+            additions.map(a => ({ id: a.id, status: "Preparing" }))
+        );
+        additions.forEach(a => selectedAdditions.delete(a.id));
+    } catch (err) {
+        alert("Failed to update additions");
+    }
+
+    loadKitchenAdditions();
+    loadKitchenOrders();
+}
+
+/* ================= STATIONS ================= */
+
+// Grill / tandoor / bar screens only fetch their own tickets
+let station = localStorage.getItem("kitchenStation") || "";
+
+function loadStations() {
+    fetch("/api/kitchen/stations")
+        .then(res => res.json())
+        .then(data => {
+            const names = new Set([data.default, ...Object.keys(data.stations)]);
+            const select = document.getElementById("station-select");
+
+            // Station names are user input: set them as text, never as HTML
+            select.replaceChildren(new Option("All stations", ""));
+            names.forEach(n => {
+                select.appendChild(new Option(n, n, false, n === station));
+            });
+        })
+        .catch(err => console.error("Stations error:", err));
+}
+
+function setStation(value) {
+    station = value;
+    localStorage.setItem("kitchenStation", value);
+    loadKitchenOrders();
+    loadKitchenAdditions();
+}
+
 /* ================= INIT ================= */
 
+loadStations();
 loadKitchenOrders();
 loadKitchenAdditions();
 
@@ -0,0 +1,124 @@
+"""
+Live order status for the diners at one table, by long-polling.
+
+Every status change for a table bumps its "table:<restaurant>:<table>"
+version in the shared cache. A poll that already has the current version
+waits until it changes: waiters in the same worker are woken at once,
+other workers' changes are picked up within TABLE_STATUS_CHECK seconds.
+Waiting holds no database connection or transaction, and the snapshot
+itself is cached under that version, so hundreds of phones cost one
+query per change.
+
+Each worker lets at most TABLE_STATUS_MAX_WAITERS polls wait at once;
+beyond that a poll is answered immediately with a retry_after hint
+(TABLE_STATUS_RETRY_AFTER seconds) and the page backs off. Keep it below
+the gunicorn --threads count (Procfile) so waiting polls never take
+every thread from staff and order requests.
+"""
+import os
+import json
+import time
+import threading
+
+import shared_cache
+from db import execute, sql
+
+TABLE_STATUS_WAIT = float(os.getenv("TABLE_STATUS_WAIT", "25"))
+TABLE_STATUS_CHECK = float(os.getenv("TABLE_STATUS_CHECK", "1"))
+TABLE_STATUS_MAX_WAITERS = int(os.getenv("TABLE_STATUS_MAX_WAITERS", "48"))
+TABLE_STATUS_RETRY_AFTER = float(os.getenv("TABLE_STATUS_RETRY_AFTER", "10"))
+
+_changed = threading.Condition()
+_waiters = threading.BoundedSemaphore(TABLE_STATUS_MAX_WAITERS)
+
+
+def namespace(restaurant_id, table_no):
+    return f"table:{int(restaurant_id)}:{int(table_no)}"
+
+
+def notify(restaurant_id, *table_nos):
+    """
+    Call after committing any change a diner at these tables would see
+    """
+    for table_no in set(table_nos):
+        try:
+            ns = namespace(restaurant_id, table_no)
+        except (TypeError, ValueError):
+            continue   # no usable table number (e.g. "NA")
+        shared_cache.invalidate(ns)
+
+    with _changed:
+        _changed.notify_all()
+
+
+def snapshot(restaurant_id, table_no):
+    """
+    The table's open orders: status, lines, and each kitchen add-on
+    ticket with its own status. Nothing personal: no names, phones or
+    totals.
+    """
+    def load():
+        orders = execute(sql("""
+            SELECT id, status, items, created_at
+            FROM orders
+            WHERE restaurant_id=? AND table_no=? AND status!='Closed'
+            ORDER BY id
+        """), (restaurant_id, table_no)).fetchall()
+        if not orders:
+            return []
+
+        ids = [o["id"] for o in orders]
+        additions = execute(sql(f"""
+            SELECT order_id, item_name, qty, status
+            FROM order_additions
+            WHERE restaurant_id=? AND order_id IN ({",".join("?" for _ in ids)})
+            ORDER BY id
+        """), (restaurant_id, *ids)).fetchall()
+
+        result = []
+        for o in orders:
+            items = o["items"]
+            if isinstance(items, str):
+                items = json.loads(items or "[]")
+
+            result.append({
+                "order_id": o["id"],
+                "status": o["status"],
+                "created_at": str(o["created_at"]),
+                "items": [{"name": i["name"], "qty": i["qty"]} for i in items or []],
+                "additions": [
+                    {"name": a["item_name"], "qty": a["qty"], "status": a["status"]}
+                    for a in additions if a["order_id"] == o["id"]
+                ]
+            })
+        return result
+
+    return shared_cache.get_or_load(namespace(restaurant_id, table_no), "snapshot", load)
+
+
+def wait(restaurant_id, table_no, since):
+    """
+    (version, retry_after): the current version once it differs from
+    `since`, or after TABLE_STATUS_WAIT seconds. If too many polls are
+    already waiting, answers at once with retry_after in seconds.
+    """
+    ns = namespace(restaurant_id, table_no)
+    version = shared_cache.version(ns)
+    if since is None or version != since:
+        return version, None
+
+    if not _waiters.acquire(blocking=False):
+        return version, TABLE_STATUS_RETRY_AFTER
+
+    try:
+        deadline = time.monotonic() + TABLE_STATUS_WAIT
+        while version == since:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            with _changed:
+                _changed.wait(min(TABLE_STATUS_CHECK, remaining))
+            version = shared_cache.version(ns)
+        return version, None
+    finally:
+        _waiters.release()
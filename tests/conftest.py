@@ -0,0 +1,171 @@
+"""
+Every test runs once per backend. SQLite uses a fresh file per test;
+Postgres runs only when TEST_DATABASE_URL points at a database the
+tests may wipe (its public schema is dropped and recreated).
+
+    TEST_DATABASE_URL=postgresql://postgres@localhost/qr_test python -m pytest -q
+"""
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+
+# Tables that exist before `flask migrate` on Postgres; the app only
+# ever migrates on top of them
+PG_BASE_SCHEMA = """
+    CREATE TABLE restaurants (
+        id SERIAL PRIMARY KEY,
+        name TEXT NOT NULL,
+        subdomain TEXT UNIQUE NOT NULL,
+        gstin TEXT,
+        address TEXT,
+        phone TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        trial_start TIMESTAMP,
+        trial_expires_at TIMESTAMP,
+        plan TEXT,
+        subscription_end TIMESTAMP,
+        is_active BOOLEAN DEFAULT TRUE
+    );
+    CREATE TABLE users (
+        id SERIAL PRIMARY KEY,
+        restaurant_id INTEGER REFERENCES restaurants(id),
+        username TEXT UNIQUE NOT NULL,
+        password TEXT NOT NULL,
+        role TEXT NOT NULL,
+        is_verified BOOLEAN DEFAULT FALSE,
+        auth_provider TEXT DEFAULT 'local',
+        otp_code TEXT,
+        otp_expires_at TIMESTAMP,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE TABLE menu (
+        id SERIAL PRIMARY KEY,
+        restaurant_id INTEGER NOT NULL REFERENCES restaurants(id),
+        name TEXT NOT NULL,
+        price NUMERIC(10, 2) NOT NULL,
+        category TEXT,
+        image TEXT,
+        available BOOLEAN DEFAULT TRUE,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE TABLE orders (
+        id SERIAL PRIMARY KEY,
+        restaurant_id INTEGER NOT NULL REFERENCES restaurants(id),
+        table_no INTEGER,
+        customer_name TEXT,
+        customer_phone TEXT,
+        items TEXT,
+        subtotal NUMERIC(10, 2),
+        cgst NUMERIC(10, 2),
+        sgst NUMERIC(10, 2),
+        total NUMERIC(10, 2),
+        status TEXT DEFAULT 'Received',
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE TABLE order_additions (
+        id SERIAL PRIMARY KEY,
+        order_id INTEGER NOT NULL REFERENCES orders(id),
+        restaurant_id INTEGER NOT NULL REFERENCES restaurants(id),
+        table_no INTEGER NOT NULL,
+        item_name TEXT NOT NULL,
+        qty INTEGER NOT NULL,
+        price NUMERIC(10, 2) NOT NULL,
+        status TEXT DEFAULT 'New',
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+"""
+
+
+def _app_modules():
+    return {
+        name[:-3] for name in os.listdir(ROOT)
+        if name.endswith(".py")
+    }
+
+
+def _reset_pg(url):
+    import psycopg2
+    db = psycopg2.connect(url)
+    db.autocommit = True
+    c = db.cursor()
+    c.execute("DROP SCHEMA public CASCADE")
+    c.execute("CREATE SCHEMA public")
+    c.execute(PG_BASE_SCHEMA)
+    db.close()
+
+
+@pytest.fixture(params=["sqlite", "postgres"])
+def backend(request):
+    if request.param == "postgres" and not TEST_DATABASE_URL:
+        pytest.skip("set TEST_DATABASE_URL to run against Postgres")
+    return request.param
+
+
+@pytest.fixture
+def appmod(backend, tmp_path, monkeypatch):
+    """
+    The app imported fresh for `backend`: settings are read at import
+    """
+    monkeypatch.setenv("DB_TYPE", backend)
+    monkeypatch.setenv("SQLITE_PATH", str(tmp_path / "restaurant.db"))
+    monkeypatch.setenv("SQLITE_SHARDING", "off")
+    monkeypatch.setenv("CACHE_BACKEND", "memory")
+    monkeypatch.setenv("BILL_CACHE_DIR", str(tmp_path / "bills"))
+    monkeypatch.setenv("ADMISSION_CONTROL", "off")
+    monkeypatch.setenv("RATE_LIMIT_BACKEND", "memory")
+    monkeypatch.delenv("SQLITE_GROUP_COMMIT", raising=False)
+    monkeypatch.setenv("ASSET_FINGERPRINT", "off")
+    monkeypatch.setenv("LOG_LEVEL", "WARNING")
+
+    if backend == "postgres":
+        monkeypatch.setenv("DATABASE_URL", TEST_DATABASE_URL)
+        # One pooled connection, so tests can see what a request left on it
+        monkeypatch.setenv("PG_POOL_SIZE", "1")
+        monkeypatch.setenv("PG_POOL_TIMEOUT", "1")
+        _reset_pg(TEST_DATABASE_URL)
+
+    for name in _app_modules():
+        sys.modules.pop(name, None)
+
+    import app
+    app.init_db()
+
+    with app.app.app_context():
+        rid = app.execute(app.sql("""
+            INSERT INTO restaurants (name, subdomain) VALUES ('Test Dhaba', 'dhaba')
+            RETURNING id
+        """)).fetchone()["id"]
+        for name, price, category in (
+            ("Naan", 40, "Breads"), ("Dal", 180, "Main Course"), ("Lassi", 60, "Beverages")
+        ):
+            app.execute(app.sql("""
+                INSERT INTO menu (restaurant_id, name, price, category, available)
+                VALUES (?, ?, ?, ?, TRUE)
+            """), (rid, name, price, category))
+        app.execute(app.sql("""
+            INSERT INTO kitchen_stations (restaurant_id, category, station)
+            VALUES (?, 'Beverages', 'bar')
+        """), (rid,))
+        app.commit()
+
+    app.test_restaurant_id = rid
+    return app
+
+
+@pytest.fixture
+def client(appmod):
+    def make(role=None):
+        c = appmod.app.test_client()
+        if role:
+            with c.session_transaction() as s:
+                s["user"] = f"{role}@example.com"
+                s["role"] = role
+                s["restaurant_id"] = appmod.test_restaurant_id
+        return c
+    return make
@@ -0,0 +1,395 @@
+"""
+The same requests against SQLite and Postgres: the named (PREPAREd on
+Postgres) queries, order writes, and signup.
+"""
+from datetime import datetime
+
+import pytest
+
+
+def place(client, appmod, table, *lines):
+    return client().post("/order", json={
+        "restaurant_id": appmod.test_restaurant_id,
+        "table": table,
+        "customer_name": "Asha",
+        "customer_phone": "9876543210",
+        "items": [{"id": item_id, "qty": qty} for item_id, qty in lines]
+    })
+
+
+def menu_ids(appmod):
+    with appmod.app.app_context():
+        rows = appmod.fetchall(appmod.sql("SELECT id, name FROM menu ORDER BY id"))
+    return {r["name"]: r["id"] for r in rows}
+
+
+def open_orders(appmod, table):
+    with appmod.app.app_context():
+        return appmod.fetchall(appmod.sql("""
+            SELECT id, items, subtotal_paise, subtotal, cgst, sgst, total
+            FROM orders
+            WHERE restaurant_id=? AND table_no=? AND status!='Closed'
+        """), (appmod.test_restaurant_id, table))
+
+
+def test_customer_menu(appmod, client):
+    # restaurant_by_subdomain, customer_menu; twice so Postgres EXECUTEs
+    # an already-prepared statement
+    for _ in range(2):
+        resp = client().get("/customer/dhaba?table=4")
+        assert resp.status_code == 200
+        assert b"Lassi" in resp.data
+
+    assert client().get("/customer/nowhere").status_code == 404
+
+
+def test_orders_append_to_open_order(appmod, client):
+    ids = menu_ids(appmod)
+
+    assert place(client, appmod, 4, (ids["Naan"], 2)).status_code == 200
+    assert place(client, appmod, 4, (ids["Lassi"], 1)).status_code == 200   # open_order
+
+    orders = open_orders(appmod, 4)
+    assert len(orders) == 1
+
+    order = orders[0]
+    assert order["subtotal_paise"] == 2 * 4000 + 6000
+    assert float(order["total"]) == float(order["subtotal"]) + float(order["cgst"]) + float(order["sgst"])
+
+
+def test_order_limits_key_on_parsed_ids(appmod, client, monkeypatch):
+    import admission
+    monkeypatch.setattr(admission, "ADMISSION_CONTROL", True)
+    ids = menu_ids(appmod)
+
+    # All table 4: one bucket of ORDER_BURST_PER_TABLE (5)
+    codes = [
+        place(client, appmod, table, (ids["Naan"], 1)).status_code
+        for table in (4, "4", "04", "004", "0004", " 4", 4, "4")
+    ]
+    assert codes.count(429) == 3
+
+    for table in ("4a", "", None, True, 0, -4, 4.5, [4]):
+        assert place(client, appmod, table, (ids["Naan"], 1)).status_code == 400
+
+
+def test_old_open_tab_stays_live(appmod, client):
+    ids = menu_ids(appmod)
+    place(client, appmod, 8, (ids["Dal"], 1))
+
+    # A tab left open for days is still the table's order and still cooking
+    with appmod.app.app_context():
+        appmod.execute(appmod.sql("""
+            UPDATE orders SET created_at = CURRENT_TIMESTAMP - INTERVAL '5 days'
+        """))
+        appmod.execute(appmod.sql("""
+            UPDATE order_additions SET created_at = CURRENT_TIMESTAMP - INTERVAL '5 days'
+        """))
+        appmod.commit()
+
+    place(client, appmod, 8, (ids["Lassi"], 1))
+    assert len(open_orders(appmod, 8)) == 1
+
+    kitchen = client("kitchen")
+    assert len(kitchen.get("/api/kitchen/orders").get_json()) == 1
+    assert [a["item_name"] for a in kitchen.get("/api/kitchen/additions").get_json()] == ["Lassi"]
+
+
+def test_add_and_remove_item_keep_totals(appmod, client):
+    ids = menu_ids(appmod)
+    place(client, appmod, 6, (ids["Naan"], 1))
+    order_id = open_orders(appmod, 6)[0]["id"]
+
+    admin = client("admin")
+    assert admin.post(f"/api/order/{order_id}/add-item",
+                      json={"item_id": ids["Dal"], "qty": 1}).status_code == 200
+    assert admin.post(f"/api/order/{order_id}/remove-item",
+                      json={"item_name": "Naan"}).status_code == 200
+    assert admin.post(f"/api/order/{order_id}/remove-item",
+                      json={"item_name": "Naan"}).status_code == 400
+
+    order = open_orders(appmod, 6)[0]
+    assert order["subtotal_paise"] == 18000
+    assert float(order["subtotal"]) == 180
+
+
+def sales(appmod):
+    appmod.events._queue.join()   # order.closed handlers
+    with appmod.app.app_context():
+        rows = appmod.fetchall(appmod.sql("SELECT orders, revenue FROM sales_buckets"))
+    return [(r["orders"], float(r["revenue"])) for r in rows]
+
+
+def test_closed_order_rolled_up_once(appmod, client):
+    ids = menu_ids(appmod)
+    place(client, appmod, 5, (ids["Dal"], 1))
+    order_id = open_orders(appmod, 5)[0]["id"]
+
+    admin, kitchen = client("admin"), client("kitchen")
+    assert admin.post(f"/api/order/{order_id}/close").status_code == 200
+    assert sales(appmod) == [(1, 189.0)]
+
+    # The kitchen cannot reopen a Closed order
+    kitchen.post(f"/api/order/{order_id}/status", json={"status": "Ready"})
+    batch = kitchen.post("/api/kitchen/orders/status", json={"ids": [order_id], "status": "Served"})
+    assert batch.get_json()["results"] == [{"id": order_id, "result": "not_found"}]
+    assert open_orders(appmod, 5) == []
+
+    # Reopened some other way, a second close still counts it once
+    with appmod.app.app_context():
+        appmod.execute(appmod.sql("UPDATE orders SET status='Ready' WHERE id=?"), (order_id,))
+        appmod.commit()
+    assert admin.post(f"/api/order/{order_id}/close").status_code == 200
+    assert sales(appmod) == [(1, 189.0)]
+
+
+def test_status_batch_rejects_non_lists(appmod, client):
+    kitchen = client("kitchen")
+    for body in (
+        {"ids": "12", "status": "Ready"},
+        {"ids": {"1": 2}, "status": "Ready"},
+        {"updates": "12"},
+        {"updates": ["12"]},
+        [12]
+    ):
+        assert kitchen.post("/api/kitchen/orders/status", json=body).status_code == 400
+
+
+def test_lost_close_event_rolled_up_later(appmod, client, monkeypatch):
+    ids = menu_ids(appmod)
+    place(client, appmod, 7, (ids["Naan"], 2))
+    order_id = open_orders(appmod, 7)[0]["id"]
+
+    monkeypatch.setattr(appmod.events, "_handlers", {})   # e.g. queue full
+    client("admin").post(f"/api/order/{order_id}/close")
+    assert sales(appmod) == []
+
+    with appmod.app.app_context():
+        assert appmod.rollups.roll_up_pending() == 1
+        assert appmod.rollups.roll_up_pending() == 0
+    assert sales(appmod) == [(1, 84.0)]
+
+
+def test_bill_not_cached_when_order_changes_mid_render(appmod, client, monkeypatch):
+    ids = menu_ids(appmod)
+    place(client, appmod, 10, (ids["Dal"], 1))
+    order_id = open_orders(appmod, 10)[0]["id"]
+    admin = client("admin")
+    put = appmod.bill_cache.put
+
+    def racing_put(rid, version, oid, variant, html):
+        # Another request changes the order (and invalidates) just before
+        # this render's stale HTML is written
+        appmod.execute(appmod.sql("UPDATE orders SET customer_name='Ravi' WHERE id=?"), (oid,))
+        appmod.commit()
+        appmod.bill_cache.invalidate(rid, oid)
+        put(rid, version, oid, variant, html)
+
+    monkeypatch.setattr(appmod.bill_cache, "put", racing_put)
+    assert b"Asha" in admin.get(f"/bill/{order_id}").data
+
+    monkeypatch.setattr(appmod.bill_cache, "put", put)
+    assert b"Ravi" in admin.get(f"/bill/{order_id}").data
+    assert b"Ravi" in admin.get(f"/bill/{order_id}").data   # now from the cache
+    assert appmod.bill_cache.get(
+        appmod.test_restaurant_id, appmod.bill_cache.profile_version(appmod.test_restaurant_id),
+        order_id, "full"
+    ) is not None
+
+
+def test_csv_export_neutralises_formulas(appmod, client):
+    import csv
+    import io
+
+    ids = menu_ids(appmod)
+    client().post("/order", json={
+        "restaurant_id": appmod.test_restaurant_id,
+        "table": 9,
+        "customer_name": '=HYPERLINK("http://evil.example","Asha")',
+        "customer_phone": "+1|cmd",
+        "items": [{"id": ids["Dal"], "qty": 1}]
+    })
+
+    resp = client("admin").get("/admin/export?status=all")
+    rows = list(csv.DictReader(io.StringIO(resp.get_data(as_text=True))))
+
+    assert rows[0]["customer_name"] == '\'=HYPERLINK("http://evil.example","Asha")'
+    assert rows[0]["customer_phone"] == "'+1|cmd"
+    assert rows[0]["total"] == "189.0"
+
+
+def test_kitchen_feeds(appmod, client):
+    ids = menu_ids(appmod)
+    place(client, appmod, 2, (ids["Dal"], 1))
+    place(client, appmod, 2, (ids["Lassi"], 2))
+
+    kitchen = client("kitchen")
+    for _ in range(2):
+        orders = kitchen.get("/api/kitchen/orders")   # kitchen_orders
+        assert orders.status_code == 200
+        assert len(orders.get_json()) == 1
+
+        additions = kitchen.get("/api/kitchen/additions")   # kitchen_additions
+        assert [a["item_name"] for a in additions.get_json()] == ["Lassi"]
+
+        bar = kitchen.get("/api/kitchen/additions?station=bar")   # kitchen_additions_station
+        assert [a["item_name"] for a in bar.get_json()] == ["Lassi"]
+
+        grill = kitchen.get("/api/kitchen/additions?station=grill")
+        assert grill.get_json() == []
+
+        # kitchen_orders_station: only the station's lines, sliced in SQL
+        for station, names in (("bar", [["Lassi"]]), ("main", [["Dal"]]), ("grill", [])):
+            sliced = kitchen.get(f"/api/kitchen/orders?station={station}").get_json()
+            assert [[i["name"] for i in o["items"]] for o in sliced] == names
+
+
+def test_station_categories_must_be_strings(appmod, client):
+    admin = client("admin")
+    for categories in ([["Breads"]], [{"a": 1}], [""], [None]):
+        resp = admin.put("/api/kitchen/stations", json={"stations": {"grill": categories}})
+        assert resp.status_code == 400
+
+    assert admin.put("/api/kitchen/stations", json=["grill"]).status_code == 400
+    assert admin.put("/api/kitchen/stations",
+                     json={"stations": {"grill": ["Breads"]}}).status_code == 200
+
+
+def test_kitchen_claim_limit(appmod, client):
+    ids = menu_ids(appmod)
+    place(client, appmod, 3, (ids["Dal"], 1))
+    for _ in range(3):
+        place(client, appmod, 3, (ids["Lassi"], 1))
+
+    kitchen = client("kitchen")
+    for bad in (0, -5, "many"):
+        resp = kitchen.post("/api/kitchen/additions/claim", json={"screen": "a", "limit": bad})
+        assert resp.status_code == 400
+
+    claimed = kitchen.post("/api/kitchen/additions/claim", json={"screen": "a", "limit": 2})
+    assert len(claimed.get_json()) == 2
+
+    rest = kitchen.post("/api/kitchen/additions/claim", json={"screen": "b"})
+    assert len(rest.get_json()) == 1
+
+
+def test_signup_creates_restaurant_and_admin(appmod, client, monkeypatch):
+    sent = []
+    monkeypatch.setattr(appmod, "send_otp_email", lambda email, otp: sent.append(email))
+
+    resp = client().post("/signup", data={
+        "email": "Owner@Example.com",
+        "subdomain": "spice",
+        "password": "correct horse battery",
+        "restaurant_name": "Spice Route",
+        "gstin": "",
+        "phone": "9876543210",
+        "address": "MG Road"
+    })
+    assert resp.status_code == 302
+    assert resp.headers["Location"].endswith("/verify-email")
+    assert sent == ["owner@example.com"]
+
+    with appmod.app.app_context():
+        user = appmod.fetchone(appmod.sql("""
+            SELECT u.role, r.subdomain, r.trial_expires_at
+            FROM users u JOIN restaurants r ON r.id = u.restaurant_id
+            WHERE u.username=?
+        """), ("owner@example.com",))
+    assert user["role"] == "admin"
+    assert user["subdomain"] == "spice"
+    assert user["trial_expires_at"] is not None
+
+
+# --------------------------------------------------
+# POSTGRES CONNECTION POOL
+# --------------------------------------------------
+
+@pytest.fixture
+def pg(appmod, backend):
+    if backend != "postgres":
+        pytest.skip("Postgres only")
+    return appmod
+
+
+def prepared_names(appmod):
+    with appmod.app.app_context():
+        rows = appmod.fetchall("SELECT name FROM pg_prepared_statements")
+    return {r["name"] for r in rows}
+
+
+def test_named_queries_stay_prepared(pg, client):
+    client().get("/customer/dhaba")
+    client("kitchen").get("/api/kitchen/additions")
+
+    assert {"restaurant_by_subdomain", "customer_menu", "kitchen_additions"} <= prepared_names(pg)
+
+
+def test_prepared_statements_recover_after_deallocate(pg, client):
+    client().get("/customer/dhaba")
+
+    # e.g. a pooler reset the server session behind our back
+    with pg.app.app_context():
+        db = pg.get_db()
+        db.cursor().execute("DEALLOCATE ALL")
+        assert "customer_menu" in db.prepared
+
+    resp = client().get("/customer/dhaba")
+    assert resp.status_code == 200
+    assert b"Lassi" in resp.data
+
+
+def test_release_returns_clean_connection(pg):
+    import psycopg2.extensions
+
+    with pg.app.app_context():
+        db = pg.get_db()
+        db.autocommit = False
+        db.cursor().execute("SELECT 1")   # leaves a transaction open
+
+    with pg.app.app_context():
+        again = pg.get_db()
+        assert again is db   # PG_POOL_SIZE=1
+        assert again.autocommit
+        assert again.status == psycopg2.extensions.STATUS_READY
+
+
+def test_pool_is_bounded(pg):
+    import db
+
+    held = db.pooled_pg()
+    try:
+        with pytest.raises(db.PgPoolTimeout):
+            db.pooled_pg()
+    finally:
+        db.release_pg(held)
+
+    db.release_pg(db.pooled_pg())
+
+
+def test_partition_takes_rows_from_default(pg, client):
+    import archive
+
+    runner = pg.app.test_cli_runner()
+    assert "not partitioned" in runner.invoke(args=["archive-orders"]).output
+    archive.partition_orders()
+
+    # Beyond PARTITION_MONTHS_AHEAD, so it lands in orders_default
+    future = archive._month(datetime.utcnow().date())
+    for _ in range(5):
+        future = archive._next_month(future)
+    with pg.app.app_context():
+        pg.execute(pg.sql("""
+            INSERT INTO orders (restaurant_id, table_no, items, status, created_at)
+            VALUES (?, 1, '[]', 'Closed', ?)
+        """), (pg.test_restaurant_id, future.isoformat()))
+
+    ensured, stuck = archive.ensure_partitions(months_ahead=5)
+    assert stuck == {}
+    assert f"orders_p{future:%Y%m}" in ensured
+
+    with pg.app.app_context():
+        assert pg.fetchone("SELECT COUNT(*) AS n FROM orders_default")["n"] == 0
+        assert pg.fetchone(f"SELECT COUNT(*) AS n FROM orders_p{future:%Y%m}")["n"] == 1
+
+    assert runner.invoke(args=["archive-orders"]).exit_code == 0
@@ -0,0 +1,132 @@
+"""
+Single-writer group commit for SQLite (SQLITE_GROUP_COMMIT=1).
+
+Request threads hand a write function to one writer thread per database
+file. The writer runs every job that arrives within a few milliseconds
+inside one transaction (each job in its own SAVEPOINT) and commits once,
+so a burst of orders pays for one WAL commit instead of one each.
+"""
+import os
+import time
+import queue
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+
+from db import (
+    DB_TYPE, SQLITE_PATH, TENANT_SHARDED,
+    connect_sqlite, connect_tenant, tenant_path
+)
+
+GROUP_COMMIT = DB_TYPE == "sqlite" and os.getenv("SQLITE_GROUP_COMMIT") == "1"
+GROUP_COMMIT_WINDOW_MS = float(os.getenv("GROUP_COMMIT_WINDOW_MS", "2"))
+GROUP_COMMIT_MAX_BATCH = int(os.getenv("GROUP_COMMIT_MAX_BATCH", "64"))
+GROUP_COMMIT_TIMEOUT = float(os.getenv("GROUP_COMMIT_TIMEOUT", "10"))
+
+_writers = {}
+_writers_lock = threading.Lock()
+
+
+class GroupCommitBusy(Exception):
+    """The writer did not start the job in time; it was withdrawn, not run."""
+
+
+class GroupCommitWriter:
+
+    def __init__(self, connect):
+        self.connect = connect
+        self.jobs = queue.Queue()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def submit(self, fn):
+        """
+        Run fn(db) in the next batch and return its result (or raise its
+        error). fn must not commit. Raises GroupCommitBusy if the job was
+        still queued after GROUP_COMMIT_TIMEOUT; it then never runs.
+        """
+        future = Future()
+        self.jobs.put((fn, future))
+        try:
+            return future.result(timeout=GROUP_COMMIT_TIMEOUT)
+        except FutureTimeout:
+            if future.cancel():
+                raise GroupCommitBusy()
+
+        # Already in a batch: report how that batch ends
+        return future.result()
+
+    def _collect(self):
+        batch = [self.jobs.get()]
+        deadline = time.monotonic() + GROUP_COMMIT_WINDOW_MS / 1000
+
+        while len(batch) < GROUP_COMMIT_MAX_BATCH:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.jobs.get(timeout=remaining))
+            except queue.Empty:
+                break
+
+        return batch
+
+    def _run(self):
+        db = self.connect()
+        db.isolation_level = None   # explicit BEGIN / SAVEPOINT / COMMIT
+
+        while True:
+            # Jobs whose caller gave up (cancelled) are dropped unrun
+            batch = [
+                (fn, future) for fn, future in self._collect()
+                if future.set_running_or_notify_cancel()
+            ]
+            if not batch:
+                continue
+
+            results = []
+
+            try:
+                db.execute("BEGIN IMMEDIATE")
+
+                for fn, future in batch:
+                    db.execute("SAVEPOINT job")
+                    try:
+                        results.append((future, fn(db), None))
+                        db.execute("RELEASE job")
+                    except Exception as e:
+                        db.execute("ROLLBACK TO job")
+                        db.execute("RELEASE job")
+                        results.append((future, None, e))
+
+                db.execute("COMMIT")
+
+            except Exception as e:
+                if db.in_transaction:
+                    db.execute("ROLLBACK")
+                results = [(future, None, e) for _, future in batch]
+
+            for future, result, error in results:
+                if error is not None:
+                    future.set_exception(error)
+                else:
+                    future.set_result(result)
+
+
+def writer_for(restaurant_id):
+    """
+    The writer for the database file holding this restaurant's orders
+    """
+    if TENANT_SHARDED:
+        key = tenant_path(restaurant_id)
+        connect = lambda: connect_tenant(restaurant_id)
+    else:
+        key = SQLITE_PATH
+        connect = lambda: connect_sqlite(SQLITE_PATH)
+
+    # Keyed by pid too: writer threads do not survive a gunicorn fork
+    key = (os.getpid(), key)
+
+    with _writers_lock:
+        if key not in _writers:
+            _writers[key] = GroupCommitWriter(connect)
+        return _writers[key]